@@ -0,0 +1,40 @@
+"""Add category_city_counts table
+
+Revision ID: 0c124ca6be63
+Revises: 1b14adaf8924
+Create Date: 2026-10-18 19:41:07.530214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c124ca6be63'
+down_revision: Union[str, None] = '1b14adaf8924'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'category_city_counts',
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('city', sa.String(), nullable=False),
+        sa.Column('approved_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('category', 'city')
+    )
+    # Начальное заполнение по уже одобренным объявлениям
+    op.execute("""
+        INSERT INTO category_city_counts (category, city, approved_count)
+        SELECT category, city, count(*)
+        FROM advertisements
+        WHERE status = 'approved' AND city IS NOT NULL
+        GROUP BY category, city
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('category_city_counts')
@@ -0,0 +1,44 @@
+"""Add tag_facets table
+
+Revision ID: 1b14adaf8924
+Revises: 7d8eba557cc6
+Create Date: 2026-10-18 19:20:41.118390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b14adaf8924'
+down_revision: Union[str, None] = '7d8eba557cc6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tag_facets',
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('city', sa.String(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('approved_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('category', 'city', 'tag_id')
+    )
+    # Начальное заполнение по уже одобренным объявлениям
+    op.execute("""
+        INSERT INTO tag_facets (category, city, tag_id, approved_count)
+        SELECT a.category, a.city, t.id, count(DISTINCT a.id)
+        FROM advertisements a
+        CROSS JOIN LATERAL unnest(a.tags) AS ad_tag(name)
+        JOIN tags t ON t.name = ad_tag.name AND t.category = a.category
+        WHERE a.status = 'approved' AND a.city IS NOT NULL
+        GROUP BY a.category, a.city, t.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('tag_facets')
@@ -0,0 +1,38 @@
+"""Add last_contact to users
+
+Revision ID: 5e1f0c9a3d27
+Revises: 772f1277374b
+Create Date: 2026-10-18 23:12:40.127305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e1f0c9a3d27'
+down_revision: Union[str, None] = '772f1277374b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('last_contact', sa.String(), nullable=True))
+    # Начальное заполнение контактом из последнего объявления пользователя
+    op.execute("""
+        UPDATE users u
+        SET last_contact = last_ad.contact_info
+        FROM (
+            SELECT DISTINCT ON (user_id) user_id, contact_info
+            FROM advertisements
+            WHERE contact_info IS NOT NULL AND contact_info <> ''
+            ORDER BY user_id, created_at DESC, id DESC
+        ) AS last_ad
+        WHERE last_ad.user_id = u.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'last_contact')
@@ -0,0 +1,38 @@
+"""Add fanout_events table
+
+Revision ID: 683ca9894052
+Revises: ac2f4780c463
+Create Date: 2026-10-18 21:08:42.273950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '683ca9894052'
+down_revision: Union[str, None] = 'ac2f4780c463'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'fanout_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('ad_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['ad_id'], ['advertisements.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_fanout_events_available_at', 'fanout_events', ['available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fanout_events_available_at', table_name='fanout_events')
+    op.drop_table('fanout_events')
@@ -0,0 +1,58 @@
+"""Add hot path indexes
+
+Revision ID: 7d8eba557cc6
+Revises: 871d1b46c46c
+Create Date: 2026-10-18 18:55:12.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d8eba557cc6'
+down_revision: Union[str, None] = '871d1b46c46c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Просмотр объявлений: category/city/status + сортировка по id, очередь модерации и фильтр по тегам
+    op.create_index('ix_advertisements_category_city_status_id', 'advertisements',
+                    ['category', 'city', 'status', 'id'], unique=False)
+    op.create_index('ix_advertisements_status_id', 'advertisements', ['status', 'id'], unique=False)
+    op.create_index('ix_advertisements_tags_gin', 'advertisements', ['tags'], unique=False,
+                    postgresql_using='gin')
+
+    # Подбор подписок при одобрении объявления и список подписок пользователя
+    op.create_index('ix_subscriptions_city_category', 'subscriptions', ['city', 'category'], unique=False)
+    op.create_index('ix_subscriptions_user_id', 'subscriptions', ['user_id'], unique=False)
+    op.create_index('ix_subscriptions_tags_gin', 'subscriptions', ['tags'], unique=False,
+                    postgresql_using='gin')
+
+    # Перед уникальными индексами убираем накопившиеся дубликаты, оставляя самую раннюю запись
+    op.execute(
+        "DELETE FROM viewed_ads a USING viewed_ads b "
+        "WHERE a.user_id = b.user_id AND a.advertisement_id = b.advertisement_id AND a.id > b.id"
+    )
+    op.execute(
+        "DELETE FROM favorites a USING favorites b "
+        "WHERE a.user_id = b.user_id AND a.advertisement_id = b.advertisement_id AND a.id > b.id"
+    )
+    op.create_index('ux_viewed_ads_user_id_advertisement_id', 'viewed_ads',
+                    ['user_id', 'advertisement_id'], unique=True)
+    op.create_index('ux_favorites_user_id_advertisement_id', 'favorites',
+                    ['user_id', 'advertisement_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_favorites_user_id_advertisement_id', table_name='favorites')
+    op.drop_index('ux_viewed_ads_user_id_advertisement_id', table_name='viewed_ads')
+    op.drop_index('ix_subscriptions_tags_gin', table_name='subscriptions')
+    op.drop_index('ix_subscriptions_user_id', table_name='subscriptions')
+    op.drop_index('ix_subscriptions_city_category', table_name='subscriptions')
+    op.drop_index('ix_advertisements_tags_gin', table_name='advertisements')
+    op.drop_index('ix_advertisements_status_id', table_name='advertisements')
+    op.drop_index('ix_advertisements_category_city_status_id', table_name='advertisements')
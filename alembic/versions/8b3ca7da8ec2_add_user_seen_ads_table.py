@@ -0,0 +1,40 @@
+"""Add user_seen_ads table
+
+Revision ID: 8b3ca7da8ec2
+Revises: 0c124ca6be63
+Create Date: 2026-10-18 20:12:54.318407
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b3ca7da8ec2'
+down_revision: Union[str, None] = '0c124ca6be63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_seen_ads',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('ad_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    # Переносим историю просмотров из viewed_ads, таблица остаётся как архив
+    op.execute("""
+        INSERT INTO user_seen_ads (user_id, ad_ids)
+        SELECT user_id, array_agg(DISTINCT advertisement_id ORDER BY advertisement_id)
+        FROM viewed_ads
+        GROUP BY user_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_seen_ads')
@@ -0,0 +1,27 @@
+"""Add version to fsm_states
+
+Revision ID: 9a4d6b2e81f3
+Revises: 5e1f0c9a3d27
+Create Date: 2026-10-18 23:48:12.561094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4d6b2e81f3'
+down_revision: Union[str, None] = '5e1f0c9a3d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Версия строки для записи compare-and-swap из нескольких процессов
+    op.add_column('fsm_states', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('fsm_states', 'version')
@@ -0,0 +1,35 @@
+"""Add pending_digests table
+
+Revision ID: ac2f4780c463
+Revises: 8b3ca7da8ec2
+Create Date: 2026-10-18 20:47:19.604112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ac2f4780c463'
+down_revision: Union[str, None] = '8b3ca7da8ec2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pending_digests',
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('telegram_id', sa.String(), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('subscription_id')
+    )
+    op.create_index('ix_pending_digests_due_at', 'pending_digests', ['due_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pending_digests_due_at', table_name='pending_digests')
+    op.drop_table('pending_digests')
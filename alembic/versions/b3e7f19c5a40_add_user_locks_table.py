@@ -0,0 +1,32 @@
+"""Add user_locks table
+
+Revision ID: b3e7f19c5a40
+Revises: 9a4d6b2e81f3
+Create Date: 2026-10-19 00:21:37.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e7f19c5a40'
+down_revision: Union[str, None] = '9a4d6b2e81f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_locks',
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('owner', sa.String(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_locks')
@@ -11,12 +11,14 @@ from aiogram.exceptions import TelegramAPIError  # Для обработки о
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 from config import BOT_TOKEN, DATABASE_URL  # Импорт токена и URL базы из config.py
-from database import Advertisement, User, get_db, get_all_category_tags
+from database import Advertisement, User, engine, get_db, get_all_category_tags, get_user_identity, apply_ad_status_change, invalidate_city_counts, set_last_contact, invalidate_user
 from sqlalchemy import select
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.storage.base import StorageKey  # Для работы с FSMContext
 from data.constants import get_main_menu_keyboard  # Для клавиатуры
+from tools.retry import telegram_retry
+from tools.fsm_storage import PostgresStorage
+from tools.scheduler import user_scheduler
 import json
 
 # Настройка логирования
@@ -25,7 +27,8 @@ logger.add("logs/api.log", rotation="10MB", compression="zip", level="DEBUG")
 # Инициализация FastAPI и бота Froggle
 app = FastAPI()
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-storage = MemoryStorage()  # Для работы с FSMContext в API
+bot.session.middleware(telegram_retry)  # Повтор при RetryAfter, сетевых ошибках и 5xx
+storage = PostgresStorage(cache_ttl=0)  # Общие с ботом состояния FSM, без кэша: запись сразу в базу
 
 # ID канала для загрузки фото и админа для уведомлений
 CHAT_ID_HOUSING = -1002575896997
@@ -52,12 +55,13 @@ async def notify_admins(
         logger.error(f"Неверный api_key: {api_key}")
         raise HTTPException(status_code=403, detail="Invalid API key")
 
+    db_user = await get_user_identity(user_id)
+    if not db_user:
+        logger.error(f"Пользователь с telegram_id={user_id} не найден")
+        raise HTTPException(status_code=400, detail="User not found")
+    db_user_id = db_user.id
+
     async for session in get_db():
-        result = await session.execute(select(User.id).where(User.telegram_id == user_id))
-        db_user_id = result.scalar_one_or_none()
-        if not db_user_id:
-            logger.error(f"Пользователь с telegram_id={user_id} не найден")
-            raise HTTPException(status_code=400, detail="User not found")
 
         # Парсим теги как массив
         try:
@@ -103,46 +107,58 @@ async def notify_admins(
                 is_test=is_test
             )
             session.add(ad)
+            await apply_ad_status_change(session, ad, None, status)  # Объявление может прийти сразу одобренным
+            await set_last_contact(session, db_user_id, contact_info)
             await session.commit()
+            invalidate_city_counts(category)
+            invalidate_user(db_user.telegram_id)
             await session.refresh(ad)
             ad_id = ad.id
             logger.info(f"Добавлено объявление #{ad_id} с тегами: {ad.tags}")
 
-            state = FSMContext(
-                storage=storage,
-                key=StorageKey(bot_id=bot.id, chat_id=ADMIN_CHAT_ID, user_id=ADMIN_CHAT_ID)
-            )
-            data = await state.get_data()
-            initial_message_id = data.get("initial_message_id")
-            full_text = f"🏠Главное меню\nУведомления: Новое объявление #{ad_id} добавлено на модерацию"
-            if initial_message_id:
-                try:
-                    await bot.edit_message_text(
-                        chat_id=ADMIN_CHAT_ID,
-                        message_id=initial_message_id,
-                        text=full_text,
-                        reply_markup=get_main_menu_keyboard()
-                    )
-                except TelegramAPIError as e:
+            # Меню администратора читается и меняется и ботом: берём его очередь, как хэндлеры бота
+            async with user_scheduler.user_lock(ADMIN_CHAT_ID):
+                state = FSMContext(
+                    storage=storage,
+                    key=StorageKey(bot_id=bot.id, chat_id=ADMIN_CHAT_ID, user_id=ADMIN_CHAT_ID)
+                )
+                data = await state.get_data()
+                initial_message_id = data.get("initial_message_id")
+                full_text = f"🏠Главное меню\nУведомления: Новое объявление #{ad_id} добавлено на модерацию"
+                if initial_message_id:
+                    try:
+                        await bot.edit_message_text(
+                            chat_id=ADMIN_CHAT_ID,
+                            message_id=initial_message_id,
+                            text=full_text,
+                            reply_markup=get_main_menu_keyboard()
+                        )
+                    except TelegramAPIError as e:
+                        menu_message = await bot.send_message(
+                            chat_id=ADMIN_CHAT_ID,
+                            text=full_text,
+                            reply_markup=get_main_menu_keyboard()
+                        )
+                        await state.update_data(initial_message_id=menu_message.message_id)
+                else:
                     menu_message = await bot.send_message(
                         chat_id=ADMIN_CHAT_ID,
                         text=full_text,
                         reply_markup=get_main_menu_keyboard()
                     )
                     await state.update_data(initial_message_id=menu_message.message_id)
-            else:
-                menu_message = await bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
-                    text=full_text,
-                    reply_markup=get_main_menu_keyboard()
-                )
-                await state.update_data(initial_message_id=menu_message.message_id)
 
             return {"ad_id": ad_id}
         except Exception as e:
             logger.error(f"Ошибка при обработке запроса: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
+# Закрываем соединения пула при остановке uvicorn
+@app.on_event("shutdown")
+async def shutdown():
+    await storage.close()
+    await engine.dispose()
+
 async def main():
     logger.info("Запуск API Froggle...")
     # FastAPI запускается через uvicorn в терминале
@@ -2,14 +2,72 @@
 # Определяет модели и функции для взаимодействия с PostgreSQL
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, ARRAY, select, Enum
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, ARRAY, select, Enum, Index, literal, all_, text, and_, delete, update, tuple_, values, column
+from sqlalchemy import exc as sa_exc
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, insert
 from loguru import logger
+from typing import NamedTuple, Optional
+from datetime import timedelta
+import time
+from tools.cache import TTLCache
+from tools.write_buffer import WriteBehindBuffer
+from tools.subscription_index import SubscriptionIndex, SubscriptionEntry
+from tools.catalog import Catalog, TagEntry
 from config import DATABASE_URL
+import config
+
+# Параметры пула и соединений, переопределяются в config.py
+POOL_SLOW_WAIT = getattr(config, "DB_POOL_SLOW_WAIT", 0.5)  # Порог в секундах для предупреждения в лог
+_server_settings = {}
+if getattr(config, "DB_STATEMENT_TIMEOUT_MS", None):
+    _server_settings["statement_timeout"] = str(config.DB_STATEMENT_TIMEOUT_MS)
+
+# Пул соединений, который считает, сколько ждали свободного соединения
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"Пул соединений исчерпан: {self.status()}")
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited > POOL_SLOW_WAIT:
+                logger.warning(f"Ожидание соединения из пула {waited:.3f} с: {self.status()}")
+
+
+DB_MAX_OVERFLOW = getattr(config, "DB_MAX_OVERFLOW", 10)
 
 # Создание асинхронного движка для подключения к базе данных
-engine = create_async_engine(DATABASE_URL, echo=False)
+# pre-ping и recycle по умолчанию выключены, как было до настройки пула: pre-ping стоит лишнего запроса на каждую выдачу соединения
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    poolclass=InstrumentedQueuePool,
+    pool_size=getattr(config, "DB_POOL_SIZE", 5),
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=getattr(config, "DB_POOL_TIMEOUT", 30),
+    pool_pre_ping=getattr(config, "DB_POOL_PRE_PING", False),
+    pool_recycle=getattr(config, "DB_POOL_RECYCLE", -1),
+    connect_args={
+        "prepared_statement_cache_size": getattr(config, "DB_STATEMENT_CACHE_SIZE", 100),
+        "server_settings": _server_settings,
+    },
+)
 
 # Создание асинхронной сессии
 AsyncSessionLocal = sessionmaker(
@@ -21,6 +79,22 @@ AsyncSessionLocal = sessionmaker(
 # Базовый класс для моделей
 Base = declarative_base()
 
+
+def get_pool_stats() -> dict:
+    """Текущее состояние пула соединений и накопленная статистика ожидания."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checkouts": pool.checkouts,
+        "timeouts": pool.timeouts,
+        "wait_avg_ms": round(pool.wait_total / pool.checkouts * 1000, 2) if pool.checkouts else 0.0,
+        "wait_max_ms": round(pool.wait_max * 1000, 2),
+    }
+
 # Генератор сессий базы данных
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -36,6 +110,7 @@ class User(Base):
     username = Column(String)
     city = Column(String, nullable=True)
     is_admin = Column(Boolean, default=False)
+    last_contact = Column(String, nullable=True)  # Контакт из последнего объявления, обновляется при добавлении
 
 # Модель Advertisement
 class Advertisement(Base):
@@ -54,6 +129,14 @@ class Advertisement(Base):
     created_at = Column(DateTime, default=func.now())
     is_test = Column(Boolean, default=False)  # Новое поле для тестовых объявлений
 
+    __table_args__ = (
+        # Просмотр по категории/городу/статусу с сортировкой по id
+        Index("ix_advertisements_category_city_status_id", "category", "city", "status", "id"),
+        # Очередь модерации: status == 'pending' ORDER BY id
+        Index("ix_advertisements_status_id", "status", "id"),
+        Index("ix_advertisements_tags_gin", "tags", postgresql_using="gin"),
+    )
+
 # Модель Tag
 class Tag(Base):
     __tablename__ = "tags"
@@ -69,12 +152,84 @@ class City(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
 
+# Фасеты тегов: сколько одобренных объявлений с тегом в категории и городе
+# Обновляется при смене статуса объявления, читается при показе клавиатуры тегов
+class TagFacet(Base):
+    __tablename__ = "tag_facets"
+    category = Column(String, primary_key=True)
+    city = Column(String, primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+    approved_count = Column(Integer, nullable=False, default=0)
+
+# Счётчик одобренных объявлений по категории и городу для первого экрана просмотра
+class CategoryCityCount(Base):
+    __tablename__ = "category_city_counts"
+    category = Column(String, primary_key=True)
+    city = Column(String, primary_key=True)
+    approved_count = Column(Integer, nullable=False, default=0)
+
 class ViewedAds(Base):
     __tablename__ = "viewed_ads"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     advertisement_id = Column(Integer, ForeignKey("advertisements.id", ondelete="CASCADE"), nullable=False)
 
+    __table_args__ = (
+        Index("ux_viewed_ads_user_id_advertisement_id", "user_id", "advertisement_id", unique=True),
+    )
+
+# Просмотренные пользователем объявления одной строкой: отсортированный массив id без повторов
+# Заменяет построчный viewed_ads для фильтра "Только новые" и счётчиков непросмотренного
+class UserSeenAds(Base):
+    __tablename__ = "user_seen_ads"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    ad_ids = Column(ARRAY(Integer), nullable=False, default=list)
+
+# Отложенные уведомления подписчикам: одна строка на подписку до истечения окна дайджеста
+class PendingDigest(Base):
+    __tablename__ = "pending_digests"
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id", ondelete="CASCADE"), primary_key=True)
+    telegram_id = Column(String, nullable=False)
+    due_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_pending_digests_due_at", "due_at"),
+    )
+
+# Очередь событий "объявление одобрено" для фоновой рассылки подписчикам (tools/fanout.py)
+class FanoutEvent(Base):
+    __tablename__ = "fanout_events"
+    id = Column(Integer, primary_key=True)
+    ad_id = Column(Integer, ForeignKey("advertisements.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    available_at = Column(DateTime, default=func.now())  # NULL — попытки исчерпаны, событие ждёт разбора
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String)
+
+    __table_args__ = (
+        Index("ix_fanout_events_available_at", "available_at"),
+    )
+
+# Состояния и данные FSM (tools/fsm_storage.py): переживают перезапуск и общие для процессов бота и API
+# Аренда очереди пользователя между процессами бота (tools/scheduler.py): строка есть — апдейт обрабатывается
+class UserLock(Base):
+    __tablename__ = "user_locks"
+    user_id = Column(BigInteger, primary_key=True)  # telegram_id
+    owner = Column(String, nullable=False)  # Процесс, который держит аренду
+    expires_at = Column(DateTime, nullable=False)  # После этого аренду может забрать другой процесс
+
+class FsmState(Base):
+    __tablename__ = "fsm_states"
+    key = Column(String, primary_key=True)
+    state = Column(String)
+    data = Column(JSONB, nullable=False, default=dict)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Растёт при каждой записи
+    updated_at = Column(DateTime, default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_fsm_states_updated_at", "updated_at"),
+    )
+
 class Favorite(Base):
     __tablename__ = "favorites"
     id = Column(Integer, primary_key=True, index=True)
@@ -82,6 +237,10 @@ class Favorite(Base):
     advertisement_id = Column(Integer, ForeignKey("advertisements.id"), nullable=False)
     added_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ux_favorites_user_id_advertisement_id", "user_id", "advertisement_id", unique=True),
+    )
+
 
 # Модель Subscription для хранения подписок пользователей
 class Subscription(Base):
@@ -94,15 +253,115 @@ class Subscription(Base):
     tags = Column(ARRAY(String), nullable=False)  # До трёх тегов
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_subscriptions_city_category", "city", "category"),
+        Index("ix_subscriptions_user_id", "user_id"),
+        Index("ix_subscriptions_tags_gin", "tags", postgresql_using="gin"),
+    )
+
+
+# Краткие данные пользователя, которые нужны почти каждому хэндлеру
+class UserIdentity(NamedTuple):
+    id: int
+    telegram_id: str
+    is_admin: bool
+    city: Optional[str]
+    last_contact: Optional[str]
+
+
+# Кэш category -> {город: число одобренных объявлений}, сбрасывается при смене статусов в этом процессе
+# и при изменении отпечатка category_city_counts (смены статусов в api.py и других воркерах)
+city_counts_cache = TTLCache(maxsize=64, ttl=getattr(config, "CITY_COUNTS_CACHE_TTL", 60))
+# Как часто get_cities сверяет отпечаток category_city_counts с базой
+CITY_COUNTS_CHECK_INTERVAL = getattr(config, "CITY_COUNTS_CHECK_INTERVAL", 5)
+_city_counts_sync = {"mark": None, "checked": 0.0}
+
+# Кэш готовых карточек объявлений для render_ad: ad_id -> {вариант: карточка}, сбрасывается при смене статуса
+ad_card_cache = TTLCache(maxsize=getattr(config, "AD_CARD_CACHE_SIZE", 2000), ttl=getattr(config, "AD_CARD_CACHE_TTL", 3600))
+
+# Кэш telegram_id -> UserIdentity, чтобы не ходить в users на каждый апдейт
+user_cache = TTLCache(
+    maxsize=getattr(config, "USER_CACHE_SIZE", 10000),
+    ttl=getattr(config, "USER_CACHE_TTL", 300)
+)
+
+
+async def get_user_identity(telegram_id: str) -> Optional[UserIdentity]:
+    """
+    Возвращает данные пользователя по telegram_id из кэша, при промахе — из базы.
+
+    Args:
+        telegram_id: Telegram ID пользователя.
+
+    Returns:
+        UserIdentity или None, если пользователь ещё не зарегистрирован через /start.
+    """
+    telegram_id = str(telegram_id)
+    identity = user_cache.get(telegram_id)
+    if identity is not None:
+        return identity
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(User.id, User.telegram_id, User.is_admin, User.city, User.last_contact)
+            .where(User.telegram_id == telegram_id)
+        )
+        row = result.one_or_none()
+    if row is None:
+        return None
+    identity = UserIdentity(id=row.id, telegram_id=row.telegram_id, is_admin=bool(row.is_admin), city=row.city,
+                            last_contact=row.last_contact)
+    user_cache.set(telegram_id, identity)
+    return identity
+
+
+def invalidate_user(telegram_id: str) -> None:
+    user_cache.invalidate(str(telegram_id))
+
+
+async def upsert_user(telegram_id: str, first_name: str = None, last_name: str = None, username: str = None) -> UserIdentity:
+    """Создаёт пользователя или обновляет его имя, сбрасывая запись в кэше."""
+    telegram_id = str(telegram_id)
+    async with AsyncSessionLocal() as session:
+        stmt = insert(User).values(
+            telegram_id=telegram_id,
+            first_name=first_name,
+            last_name=last_name,
+            username=username,
+            is_admin=False
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={"first_name": first_name, "last_name": last_name, "username": username}
+        ).returning(User.id, User.telegram_id, User.is_admin, User.city, User.last_contact)
+        row = (await session.execute(stmt)).one()
+        await session.commit()
+    invalidate_user(telegram_id)
+    identity = UserIdentity(id=row.id, telegram_id=row.telegram_id, is_admin=bool(row.is_admin), city=row.city,
+                            last_contact=row.last_contact)
+    user_cache.set(telegram_id, identity)
+    return identity
+
 
 # Функции для работы с базой (оставлены без изменений)
 async def add_to_favorites(user_id: int, advertisement_id: int) -> int:
     async with AsyncSessionLocal() as session:
-        favorite = Favorite(user_id=user_id, advertisement_id=advertisement_id)
-        session.add(favorite)
+        # Повторное добавление не нарушает уникальный индекс (user_id, advertisement_id)
+        result = await session.execute(
+            insert(Favorite)
+            .values(user_id=user_id, advertisement_id=advertisement_id)
+            .on_conflict_do_nothing(index_elements=[Favorite.user_id, Favorite.advertisement_id])
+            .returning(Favorite.id)
+        )
+        favorite_id = result.scalar_one_or_none()
+        if favorite_id is None:
+            favorite_id = await session.scalar(
+                select(Favorite.id).where(
+                    Favorite.user_id == user_id,
+                    Favorite.advertisement_id == advertisement_id
+                )
+            )
         await session.commit()
-        await session.refresh(favorite)
-        return favorite.id
+        return favorite_id
 
 async def remove_from_favorites(user_id: int, advertisement_id: int) -> bool:
     async with AsyncSessionLocal() as session:
@@ -129,14 +388,386 @@ async def is_favorite(user_id: int, advertisement_id: int) -> bool:
         )
         return result.scalar_one_or_none() is not None
 
+def unseen_ads_condition(user_id: int):
+    """Условие "объявление ещё не просмотрено пользователем" для where() по Advertisement."""
+    seen = select(UserSeenAds.ad_ids).where(UserSeenAds.user_id == user_id).scalar_subquery()
+    return Advertisement.id != all_(func.coalesce(seen, literal([], ARRAY(Integer))))
+
+
+async def count_unseen_for_subscriptions(sub_ids: list[int]) -> dict[int, int]:
+    """
+    Считает непросмотренные владельцами одобренные объявления сразу по всем подпискам одним запросом.
+
+    Returns:
+        Словарь subscription_id -> количество (подписки без новых объявлений дают 0).
+    """
+    if not sub_ids:
+        return {}
+    seen = func.coalesce(UserSeenAds.ad_ids, literal([], ARRAY(Integer)))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Subscription.id, func.count(Advertisement.id))
+            .select_from(Subscription)
+            .outerjoin(UserSeenAds, UserSeenAds.user_id == Subscription.user_id)
+            .outerjoin(Advertisement, and_(
+                Advertisement.status == "approved",
+                Advertisement.city == Subscription.city,
+                Advertisement.category == Subscription.category,
+                Advertisement.tags.overlap(Subscription.tags),
+                Advertisement.id != all_(seen)
+            ))
+            .where(Subscription.id.in_(sub_ids))
+            .group_by(Subscription.id)
+        )
+        return dict(result.all())
+
+
+async def merge_seen_ads(pairs: list[tuple[int, int]]) -> None:
+    """
+    Добавляет пачку отметок (user_id, advertisement_id) в массивы просмотренного одним INSERT.
+
+    При слиянии из массива выбрасываются объявления, которые больше не одобрены (отклонены, удалены),
+    поэтому его размер ограничен числом живых объявлений, а не всей историей просмотров.
+    """
+    by_user: dict[int, set[int]] = {}
+    for user_id, ad_id in pairs:
+        by_user.setdefault(user_id, set()).add(ad_id)
+    stmt = insert(UserSeenAds).values([
+        {"user_id": user_id, "ad_ids": sorted(ad_ids)} for user_id, ad_ids in by_user.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserSeenAds.user_id],
+        set_={"ad_ids": text(
+            "ARRAY(SELECT DISTINCT seen.id FROM unnest(user_seen_ads.ad_ids || excluded.ad_ids) AS seen(id)"
+            " JOIN advertisements a ON a.id = seen.id AND a.status = 'approved' ORDER BY 1)"
+        )}
+    )
+    async with AsyncSessionLocal() as session:
+        await session.execute(stmt)
+        await session.commit()
+    logger.debug(f"Записано отметок просмотра: {len(pairs)} для {len(by_user)} пользователей")
+
+
+# Отметки просмотра пишутся пачками в фоне, запуск и остановка — в main.py
+viewed_ads_buffer = WriteBehindBuffer(
+    merge_seen_ads,
+    max_batch=getattr(config, "VIEWED_ADS_BATCH_SIZE", 500),
+    interval=getattr(config, "VIEWED_ADS_FLUSH_INTERVAL", 2.0),
+    name="viewed_ads"
+)
+
 async def mark_ad_as_viewed(telegram_id: str, advertisement_id: int) -> None:
+    user = await get_user_identity(telegram_id)
+    if not user:
+        return
+    await viewed_ads_buffer.add((user.id, advertisement_id))
+
+# Индекс подписок для рассылки при одобрении, строится в main.py при старте
+subscription_index = SubscriptionIndex()
+
+async def _subscriptions_mark(session: AsyncSession) -> tuple:
+    """
+    Отпечаток таблицы subscriptions: (число строк, максимальный id).
+
+    Подписки только создаются и удаляются (не изменяются), а id берутся из последовательности,
+    поэтому любое добавление или удаление в любом процессе меняет отпечаток.
+    """
+    result = await session.execute(select(func.count(Subscription.id), func.max(Subscription.id)))
+    return tuple(result.one())
+
+async def load_subscription_index() -> None:
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
-        user_id = result.scalar_one_or_none()
-        if user_id:
-            viewed = ViewedAds(user_id=user_id, advertisement_id=advertisement_id)
-            session.add(viewed)
-            await session.commit()
+        # Отпечаток снимается до чтения строк: изменение между запросами даст лишнюю перестройку, а не пропуск
+        mark = await _subscriptions_mark(session)
+        result = await session.execute(
+            select(Subscription.id, Subscription.user_id, User.telegram_id,
+                   Subscription.city, Subscription.category, Subscription.tags)
+            .join(User, User.id == Subscription.user_id)
+        )
+        subscription_index.rebuild((SubscriptionEntry(*row) for row in result.all()), mark)
+    logger.info(f"Индекс подписок построен: {subscription_index.stats()}")
+
+async def refresh_subscription_index() -> bool:
+    """
+    Перестраивает индекс, если подписки менялись в другом процессе (другой воркер вебхука, API).
+
+    Вызывается обработчиком рассылки и отправителем дайджестов перед каждой пачкой.
+
+    Returns:
+        True, если индекс был перестроен.
+    """
+    async with AsyncSessionLocal() as session:
+        mark = await _subscriptions_mark(session)
+    if mark == subscription_index.mark:
+        return False
+    await load_subscription_index()
+    return True
+
+# Справочники тегов и городов, загружаются при старте бота и перечитываются при изменении таблиц
+catalog = Catalog()
+
+async def _catalog_mark(session: AsyncSession) -> tuple:
+    """
+    Отпечаток таблиц tags и cities: md5 от их содержимого.
+
+    Скрипты заполнения могут переименовать тег или поменять порядок, не меняя числа строк,
+    поэтому сравнивается всё содержимое; таблицы маленькие, запрос дешёвый.
+    """
+    result = await session.execute(text("""
+        SELECT
+            (SELECT md5(coalesce(string_agg(concat_ws('|', id, name, category, is_primary, "order"), ',' ORDER BY id), ''))
+             FROM tags),
+            (SELECT md5(coalesce(string_agg(concat_ws('|', id, name), ',' ORDER BY id), '')) FROM cities)
+    """))
+    return tuple(result.one())
+
+async def load_catalog() -> None:
+    async with AsyncSessionLocal() as session:
+        mark = await _catalog_mark(session)  # До чтения строк: изменение во время чтения заметим при следующей сверке
+        tags = await session.execute(
+            select(Tag.id, Tag.name, Tag.category, Tag.is_primary, Tag.__table__.c.order)
+        )
+        cities = await session.execute(select(City.name, City.id).order_by(City.id))
+        catalog.rebuild(
+            (TagEntry(row.id, row.name, row.category, bool(row.is_primary), row.order or 0) for row in tags.all()),
+            cities.all(),
+            mark
+        )
+    logger.info(f"Справочники загружены: {catalog.stats()}")
+
+async def refresh_catalog() -> bool:
+    """
+    Перестраивает каталог, если теги или города изменились с последней загрузки.
+
+    Вызывается периодически в каждом процессе (tools/catalog_refresh.py), поэтому /reload_catalog
+    и скрипты заполнения доходят до всех воркеров вебхука, а не только до того, что принял команду.
+
+    Returns:
+        True, если каталог был перестроен.
+    """
+    async with AsyncSessionLocal() as session:
+        mark = await _catalog_mark(session)
+    if mark == catalog.mark:
+        return False
+    await load_catalog()
+    return True
+
+async def add_subscription(user: UserIdentity, city: str, category: str, tags: list[str]) -> int:
+    async with AsyncSessionLocal() as session:
+        subscription = Subscription(user_id=user.id, city=city, category=category, tags=tags)
+        session.add(subscription)
+        await session.commit()
+        subscription_index.add(SubscriptionEntry(subscription.id, user.id, user.telegram_id, city, category, tags))
+        return subscription.id
+
+async def delete_subscription(user_id: int, subscription_id: int) -> bool:
+    """Удаляет подписку пользователя; чужую или несуществующую не трогает."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Subscription).where(Subscription.id == subscription_id, Subscription.user_id == user_id)
+        )
+        subscription = result.scalar_one_or_none()
+        if not subscription:
+            return False
+        await session.delete(subscription)
+        await session.commit()
+    subscription_index.remove(subscription_id)
+    return True
+
+async def enqueue_digests(subscriptions: list[SubscriptionEntry], window: float) -> None:
+    """
+    Откладывает уведомления по подпискам на window секунд.
+
+    Если по подписке уже ждёт дайджест, его срок не сдвигается: новые объявления попадут в тот же дайджест.
+    """
+    if not subscriptions:
+        return
+    stmt = insert(PendingDigest).values([
+        {"subscription_id": sub.id, "telegram_id": sub.telegram_id, "due_at": func.now() + timedelta(seconds=window)}
+        for sub in subscriptions
+    ]).on_conflict_do_nothing(index_elements=[PendingDigest.subscription_id])
+    async with AsyncSessionLocal() as session:
+        await session.execute(stmt)
+        await session.commit()
+
+async def claim_due_digests(limit: int, lease: float) -> list[tuple[int, str]]:
+    """
+    Забирает до limit дайджестов с наступившим сроком и откладывает их на lease секунд.
+
+    Так несколько процессов бота не отправят один дайджест дважды; если процесс упадёт
+    до delete_digests, дайджест снова станет доступным после истечения lease.
+
+    Returns:
+        Список (subscription_id, telegram_id).
+    """
+    claimable = (
+        select(PendingDigest.subscription_id)
+        .where(PendingDigest.due_at <= func.now())
+        .order_by(PendingDigest.due_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(PendingDigest)
+            .where(PendingDigest.subscription_id.in_(claimable))
+            .values(due_at=func.now() + timedelta(seconds=lease))
+            .returning(PendingDigest.subscription_id, PendingDigest.telegram_id)
+        )
+        due = result.all()
+        await session.commit()
+        return due
+
+async def delete_digests(sub_ids: list[int]) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(PendingDigest).where(PendingDigest.subscription_id.in_(sub_ids)))
+        await session.commit()
+
+async def claim_fanout_events(limit: int, lease: float) -> list[tuple[int, int, int]]:
+    """
+    Забирает до limit готовых событий рассылки и откладывает их на lease секунд, пока они обрабатываются.
+
+    SKIP LOCKED позволяет нескольким обработчикам разбирать очередь, не мешая друг другу;
+    если обработчик упадёт, событие снова станет доступным после истечения lease.
+
+    Returns:
+        Список (event_id, ad_id, attempts) с уже увеличенным счётчиком попыток.
+    """
+    claimable = (
+        select(FanoutEvent.id)
+        .where(FanoutEvent.available_at <= func.now())
+        .order_by(FanoutEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(FanoutEvent)
+            .where(FanoutEvent.id.in_(claimable))
+            .values(available_at=func.now() + timedelta(seconds=lease), attempts=FanoutEvent.attempts + 1)
+            .returning(FanoutEvent.id, FanoutEvent.ad_id, FanoutEvent.attempts)
+        )
+        events = result.all()
+        await session.commit()
+        return events
+
+async def complete_fanout_event(event_id: int) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(FanoutEvent).where(FanoutEvent.id == event_id))
+        await session.commit()
+
+async def fail_fanout_event(event_id: int, error: str, retry_in: Optional[float]) -> None:
+    """Сохраняет ошибку и откладывает повтор на retry_in секунд; retry_in=None снимает событие с очереди."""
+    available_at = func.now() + timedelta(seconds=retry_in) if retry_in is not None else None
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(FanoutEvent)
+            .where(FanoutEvent.id == event_id)
+            .values(available_at=available_at, last_error=error[:1000])
+        )
+        await session.commit()
+
+async def load_fsm_state(key: str) -> Optional[tuple[Optional[str], dict, int]]:
+    """Возвращает (state, data, version) по ключу FSM или None, если записи нет."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(FsmState.state, FsmState.data, FsmState.version).where(FsmState.key == key)
+        )
+        return result.first()
+
+async def try_lock_user(user_id: int, owner: str, lease: float) -> bool:
+    """Берёт аренду очереди пользователя на lease секунд, если она свободна или истекла."""
+    stmt = insert(UserLock).values(user_id=user_id, owner=owner, expires_at=func.now() + timedelta(seconds=lease))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[UserLock.user_id],
+                set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+                where=UserLock.expires_at < func.now()
+            ).returning(UserLock.user_id)
+        )
+        await session.commit()
+        return result.first() is not None
+
+async def extend_user_lock(user_id: int, owner: str, lease: float) -> bool:
+    """Продлевает свою аренду; False, если она уже истекла и перешла к другому процессу."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(UserLock)
+            .where(UserLock.user_id == user_id, UserLock.owner == owner)
+            .values(expires_at=func.now() + timedelta(seconds=lease))
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+async def unlock_user(user_id: int, owner: str) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(UserLock).where(UserLock.user_id == user_id, UserLock.owner == owner))
+        await session.commit()
+
+async def load_fsm_version(key: str) -> int:
+    """Версия строки FSM по ключу (0, если строки нет) — для сверки кэша без чтения данных."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(FsmState.version).where(FsmState.key == key))
+        return result.scalar() or 0
+
+async def save_fsm_states(rows: list[tuple[str, Optional[str], dict, int]]) -> dict[str, int]:
+    """
+    Записывает пачку (key, state, data, version) по принципу compare-and-swap.
+
+    version — версия строки, от которой отсчитаны изменения (0 — строки не было). Строка пишется,
+    только если её версия в базе не изменилась; пустые записи (без состояния и данных, как после
+    state.clear()) удаляются, чтобы таблица не росла.
+
+    Returns:
+        Новая версия каждого записанного ключа (0 — строки больше нет). Ключей, которые за это время
+        изменил другой процесс, в словаре нет — их нужно перечитать и записать заново.
+    """
+    saved = {}
+    empty = [(key, version) for key, state, data, version in rows if state is None and not data]
+    filled = [(key, state, data, version) for key, state, data, version in rows if state is not None or data]
+    created = [{"key": key, "state": state, "data": data, "version": 1} for key, state, data, version in filled if not version]
+    changed = [(key, state, data, version) for key, state, data, version in filled if version]
+    async with AsyncSessionLocal() as session:
+        # Строки, которой не было, нет и сейчас — удалять нечего
+        saved.update((key, 0) for key, version in empty if not version)
+        deleted = [(key, version) for key, version in empty if version]
+        if deleted:
+            result = await session.execute(
+                delete(FsmState).where(tuple_(FsmState.key, FsmState.version).in_(deleted)).returning(FsmState.key)
+            )
+            saved.update((key, 0) for key in result.scalars())
+        if created:
+            result = await session.execute(
+                insert(FsmState).values(created).on_conflict_do_nothing(index_elements=[FsmState.key])
+                .returning(FsmState.key, FsmState.version)
+            )
+            saved.update({key: version for key, version in result})
+        if changed:
+            new = values(
+                column("key", String), column("state", String), column("data", JSONB), column("version", Integer),
+                name="new"
+            ).data(changed)
+            result = await session.execute(
+                update(FsmState)
+                .where(FsmState.key == new.c.key, FsmState.version == new.c.version)
+                .values(state=new.c.state, data=new.c.data, version=FsmState.version + 1, updated_at=func.now())
+                .returning(FsmState.key, FsmState.version)
+            )
+            saved.update({key: version for key, version in result})
+        await session.commit()
+    return saved
+
+async def delete_idle_fsm_states(idle: float) -> int:
+    """Удаляет записи FSM, которые не менялись дольше idle секунд."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            delete(FsmState).where(FsmState.updated_at < func.now() - timedelta(seconds=idle))
+        )
+        await session.commit()
+        return result.rowcount
 
 async def add_advertisement(user_id: int, category: str, city: str, title_ru: str, description_ru: str, tags: list[str], media_file_ids: list[str], contact_info: str, price: str = None) -> int:
     async with AsyncSessionLocal() as session:
@@ -152,17 +783,127 @@ async def add_advertisement(user_id: int, category: str, city: str, title_ru: st
             price=price
         )
         session.add(ad)
+        telegram_id = await set_last_contact(session, user_id, contact_info)
         await session.commit()
+        if telegram_id:
+            invalidate_user(telegram_id)
         await session.refresh(ad)
         return ad.id
 
-async def get_category_tags(category: str, city: str) -> list[tuple[int, str]]:
+
+async def set_last_contact(session: AsyncSession, user_id: int, contact_info: Optional[str]) -> Optional[str]:
+    """
+    Запоминает контакт нового объявления в users.last_contact (без коммита).
+
+    Returns:
+        telegram_id пользователя, чтобы после коммита сбросить его запись в user_cache, или None, если контакт пустой.
+    """
+    if not contact_info:
+        return None
+    result = await session.execute(
+        update(User).where(User.id == user_id).values(last_contact=contact_info).returning(User.telegram_id)
+    )
+    return result.scalar_one_or_none()
+
+async def _adjust_tag_facets(session: AsyncSession, ad: Advertisement, delta: int) -> None:
+    """Прибавляет delta к счётчикам фасетов для всех тегов объявления (без коммита)."""
+    if not ad.tags or not ad.city:
+        return
+    stmt = insert(TagFacet).from_select(
+        ["category", "city", "tag_id", "approved_count"],
+        select(literal(ad.category), literal(ad.city), Tag.id, literal(delta))
+        .where(Tag.category == ad.category, Tag.name.in_(ad.tags))
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TagFacet.category, TagFacet.city, TagFacet.tag_id],
+        set_={"approved_count": TagFacet.approved_count + stmt.excluded.approved_count}
+    )
+    await session.execute(stmt)
+
+
+async def _adjust_city_count(session: AsyncSession, ad: Advertisement, delta: int) -> None:
+    """Прибавляет delta к счётчику объявлений категории в городе (без коммита)."""
+    if not ad.city:
+        return
+    stmt = insert(CategoryCityCount).values(category=ad.category, city=ad.city, approved_count=delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CategoryCityCount.category, CategoryCityCount.city],
+        set_={"approved_count": CategoryCityCount.approved_count + stmt.excluded.approved_count}
+    )
+    await session.execute(stmt)
+
+
+def invalidate_city_counts(category: str) -> None:
+    city_counts_cache.invalidate(category)
+
+
+async def apply_ad_status_change(session: AsyncSession, ad: Advertisement, old_status: Optional[str],
+                                 new_status: Optional[str]) -> None:
+    """
+    Обновляет производные счётчики при переходе объявления между статусами (без коммита).
+
+    Args:
+        session: Сессия, в транзакции которой меняется объявление.
+        ad: Объявление.
+        old_status: Статус до изменения (None — объявление только создаётся).
+        new_status: Статус после изменения (None — объявление удаляется).
+    """
+    if old_status == new_status:
+        return
+    if old_status == "approved":
+        await _adjust_tag_facets(session, ad, -1)
+        await _adjust_city_count(session, ad, -1)
+    if new_status == "approved":
+        await _adjust_tag_facets(session, ad, 1)
+        await _adjust_city_count(session, ad, 1)
+
+
+async def change_ad_status(session: AsyncSession, ad: Advertisement, status: str) -> bool:
+    """
+    Меняет статус объявления и пересчитывает фасеты и счётчики городов в одной транзакции.
+
+    Строка объявления перечитывается под FOR UPDATE, поэтому параллельные смены статуса
+    (два модератора, одобрение против отклонения) выполняются по очереди и видят статус друг друга.
+    При переходе в approved в той же транзакции ставится событие рассылки подписчикам (FanoutEvent),
+    повторное одобрение уже одобренного объявления второй рассылки не создаёт.
+
+    Returns:
+        True, если статус изменился; False, если объявление уже было в этом статусе.
+    """
+    await session.refresh(ad, with_for_update=True)
+    old_status = ad.status
+    if old_status == status:
+        await session.commit()  # Снимаем блокировку строки
+        return False
+    ad.status = status
+    await apply_ad_status_change(session, ad, old_status, status)
+    if status == "approved":
+        session.add(FanoutEvent(ad_id=ad.id))
+    await session.commit()
+    invalidate_city_counts(ad.category)
+    ad_card_cache.invalidate(ad.id)
+    return True
+
+
+async def delete_advertisement(session: AsyncSession, ad: Advertisement) -> None:
+    """Удаляет объявление из базы вместе с его вкладом в фасеты и счётчики городов."""
+    await session.refresh(ad, with_for_update=True)  # Статус под блокировкой, как в change_ad_status
+    category = ad.category
+    await apply_ad_status_change(session, ad, ad.status, None)
+    ad_id = ad.id
+    await session.delete(ad)
+    await session.commit()
+    invalidate_city_counts(category)
+    ad_card_cache.invalidate(ad_id)
+
+
+async def get_category_tags(category: str, city: str) -> list[tuple[int, str, int]]:
+    """Возвращает теги одобренных объявлений категории в городе с количеством объявлений по каждому."""
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            select(Tag.id, Tag.name)
-            .join(Advertisement, Advertisement.tags.any(Tag.name))
-            .where(Advertisement.category == category, Advertisement.city == city, Advertisement.status == "approved")
-            .distinct(Tag.name)
+            select(Tag.id, Tag.name, TagFacet.approved_count)
+            .join(TagFacet, TagFacet.tag_id == Tag.id)
+            .where(TagFacet.category == category, TagFacet.city == city, TagFacet.approved_count > 0)
             .order_by(Tag.name)
         )
         return result.all()
@@ -179,7 +920,32 @@ async def get_all_category_tags(category: str) -> list[tuple[int, str]]:
         logger.debug(f"Получены теги для категории '{category}': {tags}")
         return tags
 
+async def _sync_city_counts_cache() -> None:
+    """
+    Сбрасывает кэш счётчиков городов, если category_city_counts изменилась с прошлой сверки.
+
+    invalidate_city_counts чистит кэш только своего процесса; объявления, одобренные через api.py
+    или в другом воркере, видны здесь не позже чем через CITY_COUNTS_CHECK_INTERVAL секунд.
+    Таблица маленькая (категории × города), а сверка идёт не чаще раза в интервал.
+    """
+    if time.monotonic() - _city_counts_sync["checked"] < CITY_COUNTS_CHECK_INTERVAL:
+        return
+    _city_counts_sync["checked"] = time.monotonic()
+    async with AsyncSessionLocal() as session:
+        mark = await session.scalar(text("""
+            SELECT md5(coalesce(string_agg(concat_ws('|', category, city, approved_count), ',' ORDER BY category, city), ''))
+            FROM category_city_counts
+        """))
+    if mark != _city_counts_sync["mark"]:
+        _city_counts_sync["mark"] = mark
+        city_counts_cache.clear()
+
 async def get_cities(category=None):
+    if category is not None:
+        await _sync_city_counts_cache()
+        cities_dict = city_counts_cache.get(category)
+        if cities_dict is not None:
+            return dict(cities_dict)
     async with AsyncSessionLocal() as session:
         if category is None:
             result = await session.execute(select(City))
@@ -187,14 +953,14 @@ async def get_cities(category=None):
             return {city.name: city.id for city in cities}
         else:
             result = await session.execute(
-                select(Advertisement.city, func.count(Advertisement.id))
-                .where(Advertisement.category == category, Advertisement.status == "approved")
-                .group_by(Advertisement.city)
-                .having(func.count(Advertisement.id) > 0)
+                select(CategoryCityCount.city, CategoryCityCount.approved_count)
+                .where(CategoryCityCount.category == category, CategoryCityCount.approved_count > 0)
+                .order_by(CategoryCityCount.city)
             )
             cities_dict = dict(result.all())
+            city_counts_cache.set(category, cities_dict)
             logger.debug(f"get_cities: category='{category}', result={cities_dict}")
-            return cities_dict
+            return dict(cities_dict)
 
 async def init_db():
     async with engine.begin() as conn:
@@ -4,24 +4,28 @@ from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 from aiogram import F
 from states import AdAddForm, AdsViewForm  # Добавлен AdsViewForm
-from database import get_db, User, Tag, City, Advertisement, add_advertisement, get_category_tags, get_cities, get_all_category_tags, select, Advertisement  # Добавлен get_all_category_tags
+from database import get_db, User, Tag, City, Advertisement, add_advertisement, get_category_tags, catalog, select, Advertisement, UserIdentity
 from data.constants import get_main_menu_keyboard
 from data.categories import CATEGORIES
 from loguru import logger
-import asyncio
-from tools.utils import render_ad, format_ad_text
+from tools.utils import render_ad
+from tools.scheduler import user_scheduler
+from tools.media_group import media_group_collector
+from tools.ad_draft import AdDraft, AdDraftMiddleware
+from tools.keyboards import wizard_step_keyboard, wizard_city_keyboard, wizard_other_cities_keyboard, wizard_tags_keyboard
 
 ad_router = Router()
+ad_router.message.middleware(AdDraftMiddleware())  # Черновик читается один раз на апдейт и пишется одним update_data
+ad_router.callback_query.middleware(AdDraftMiddleware())
 
 # Обработчик начала процесса добавления объявления через текстовую команду
 # Очищает старые теги и проверяет категорию перед началом
 @ad_router.message(F.text == "Добавить своё")
-async def process_ad_start(message: types.Message, state: FSMContext):
+async def process_ad_start(message: types.Message, state: FSMContext, draft: AdDraft):
     logger.info(f"process_ad_start вызвана для telegram_id={message.from_user.id}")
-    data = await state.get_data()
-    category = data.get("category")
+    category = draft.category
     # Очищаем старые теги перед началом добавления
-    await state.update_data(tags=[])
+    draft.tags = []
     if not category or category not in CATEGORIES:
         logger.info(f"Категория не выбрана или неверна: {category}")
         await message.answer("Пожалуйста, выберите категорию из главного меню.\n:", reply_markup=get_main_menu_keyboard())
@@ -29,17 +33,8 @@ async def process_ad_start(message: types.Message, state: FSMContext):
 
     logger.info(f"Начало добавления объявления в категории {category} для telegram_id={message.from_user.id}")
     await state.set_state(AdAddForm.city)
-    await state.update_data(category=category)
     logger.info(f"Отправка меню городов для категории {category}")
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Тбилиси", callback_data=f"city:{category}:Тбилиси"),
-         InlineKeyboardButton(text="Батуми", callback_data=f"city:{category}:Батуми")],
-        [InlineKeyboardButton(text="Кутаиси", callback_data=f"city:{category}:Кутаиси"),
-         InlineKeyboardButton(text="Гори", callback_data=f"city:{category}:Гори")],
-        [InlineKeyboardButton(text="Другой город", callback_data=f"city_other:{category}"),
-         InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:city"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_city_keyboard(category)
     await message.answer(
         CATEGORIES[category]["texts"]["city"],
         reply_markup=keyboard
@@ -47,10 +42,9 @@ async def process_ad_start(message: types.Message, state: FSMContext):
 
 # Обработчик callback’а action:add для начала добавления объявления с текущей категорией
 @ad_router.callback_query(F.data == "action:add")
-async def process_ad_start_from_callback(call: types.CallbackQuery, state: FSMContext):
+async def process_ad_start_from_callback(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
     logger.info(f"process_ad_start_from_callback вызвана для telegram_id={call.from_user.id}")
-    data = await state.get_data()
-    category = data.get("category")
+    category = draft.category
     await state.clear()  # Очищаем состояние от старых данных
     if not category or category not in CATEGORIES:
         logger.info(f"Категория не выбрана или неверна: {category}")
@@ -63,17 +57,9 @@ async def process_ad_start_from_callback(call: types.CallbackQuery, state: FSMCo
 
     logger.info(f"Начало добавления объявления в категории {category} для telegram_id={call.from_user.id}")
     await state.set_state(AdAddForm.city)
-    await state.update_data(category=category)
+    draft.category = category  # Сохраняется после хэндлера, уже в очищенное состояние
     logger.info(f"Отправка меню городов для категории {category}")
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Тбилиси", callback_data=f"city:{category}:Тбилиси"),
-         InlineKeyboardButton(text="Батуми", callback_data=f"city:{category}:Батуми")],
-        [InlineKeyboardButton(text="Кутаиси", callback_data=f"city:{category}:Кутаиси"),
-         InlineKeyboardButton(text="Гори", callback_data=f"city:{category}:Гори")],
-        [InlineKeyboardButton(text="Другой город", callback_data=f"city_other:{category}"),
-         InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:city"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_city_keyboard(category)
     await call.message.edit_text(
         CATEGORIES[category]["texts"]["city"],
         reply_markup=keyboard
@@ -82,30 +68,20 @@ async def process_ad_start_from_callback(call: types.CallbackQuery, state: FSMCo
 
 # Обрабатывает выбор города и переходит к выбору тегов для объявления
 @ad_router.callback_query(F.data.startswith("city:"), StateFilter(AdAddForm.city))
-async def process_city_selection(call: types.CallbackQuery, state: FSMContext):
+async def process_city_selection(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
     _, category, city = call.data.split(":", 2)
-    data = await state.get_data()
     logger.info(f"Выбран город '{city}' для telegram_id={call.from_user.id} в категории {category}")
     try:
-        logger.debug(f"Перед обновлением состояния с городом '{city}'")
-        await state.update_data(city=city)
-        logger.debug(f"Состояние обновлено с городом '{city}'")
-        logger.debug(f"Перед вызовом get_all_category_tags для категории '{category}'")
-        tags = await get_all_category_tags(category)  # Используем все теги категории
-        if not tags:
+        if not catalog.category_tags(category):
             await call.message.edit_text(
                 "Нет доступных тегов. Обратитесь к администратору.\n:", reply_markup=get_main_menu_keyboard()
             )
             await state.clear()
             return
-        buttons = [tags[i:i + 3] for i in range(0, len(tags), 3)]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=name, callback_data=f"tag_select:{id}") for id, name in row] for row in buttons
-        ] + [[InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:tags"),
-              InlineKeyboardButton(text="Назад", callback_data="back")]])
+        draft.city = city
         await call.message.edit_text(
             CATEGORIES[category]["texts"]["tags"],
-            reply_markup=keyboard
+            reply_markup=wizard_tags_keyboard(category)
         )
         await state.set_state(AdAddForm.tags)
         logger.debug(f"Установлено состояние AdAddForm.tags для telegram_id={call.from_user.id}, текущее состояние: {await state.get_state()}")
@@ -126,30 +102,20 @@ async def process_city_other(call: types.CallbackQuery, state: FSMContext):
     category = call.data.split(":", 1)[1]
     logger.info(f"Пользователь {call.from_user.id} выбрал 'Другой город' для категории '{category}'")
 
-    cities = await get_cities()
-    main_cities = ["Тбилиси", "Батуми", "Кутаиси", "Гори"]
-    other_cities = [city for city in cities.keys() if city not in main_cities]
-    buttons = [
-        InlineKeyboardButton(text=city, callback_data=f"city:{category}:{city}")
-        for city in other_cities
-    ]
-    keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
     await call.message.edit_text(
         "Выберите другой город:",
-        reply_markup=keyboard
+        reply_markup=wizard_other_cities_keyboard(category)
     )
     await call.answer()
 
 # Обрабатывает выбор тегов для объявления, добавляет их в состояние и обновляет клавиатуру
 # Проверяет обязательные теги с учётом текущей категории
 @ad_router.callback_query(F.data.startswith("tag_select:"), StateFilter(AdAddForm.tags))
-async def process_ad_tags(call: types.CallbackQuery, state: FSMContext):
+async def process_ad_tags(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
     logger.debug(f"Начало process_ad_tags для telegram_id={call.from_user.id}, текущее состояние: {await state.get_state()}")
     tag_id = int(call.data.split(":", 1)[1])
-    data = await state.get_data()
-    category = data.get("category")
-    tags = data.get("tags", [])  # Список уже выбранных тегов
+    category = draft.category
+    tags = list(draft.tags)  # Список уже выбранных тегов
     previous_tags = tags.copy()  # Сохраняем предыдущее состояние
 
     if len(tags) >= 3:
@@ -157,56 +123,38 @@ async def process_ad_tags(call: types.CallbackQuery, state: FSMContext):
         return
 
     try:
-        async for session in get_db():
-            result = await session.execute(select(Tag).where(Tag.id == tag_id))
-            tag = result.scalar_one_or_none()
-            if tag and tag.name not in tags:  # Добавляем только новый тег
-                tags.append(tag.name)
-                await state.update_data(tags=tags)
-
-            if tags == previous_tags:  # Если ничего не изменилось
-                logger.debug(f"Теги не изменились: {tags}")
-                await call.answer()
-                return
-
-            logger.debug(f"Выбраны теги: {tags}")
-
-            tags_list = await get_all_category_tags(category)  # Используем все теги категории
-            buttons = [tags_list[i:i + 3] for i in range(0, len(tags_list), 3)]
-            keyboard_rows = [
-                [InlineKeyboardButton(text=name, callback_data=f"tag_select:{id}") for id, name in row] for row in buttons
-            ]
-
-            # Проверяем наличие primary_tag для текущей категории
-            primary_tags = [tag.name for tag in (
-                await session.execute(
-                    select(Tag).where(Tag.is_primary == True, Tag.category == CATEGORIES[category]["tag_category"])
-                )
-            ).scalars().all()]
-            has_primary = any(tag_name in primary_tags for tag_name in tags) if primary_tags else True  # Если нет primary_tags, считаем проверку пройденной
-            logger.debug(f"Primary теги для категории '{category}': {primary_tags}, has_primary: {has_primary}")
-
-            if has_primary:
-                keyboard_rows.append([InlineKeyboardButton(text="Далее", callback_data="next_to_title")])
-
-            keyboard_rows.append([
-                InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:tags"),
-                InlineKeyboardButton(text="Назад", callback_data="back")
-            ])
-
-            if has_primary:
-                logger.debug(f"Отображаем сообщение: 'Выбрано: {', '.join(tags)}\nНажмите Далее для продолжения.'")
-                await call.message.edit_text(
-                    f"Выбрано: {', '.join(tags)}\nНажмите 'Далее' для продолжения.",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-                )
-            else:
-                logger.debug(f"Отображаем сообщение: 'Выбрано: {', '.join(tags)}\nВыберите хотя бы один обязательный тег из: {', '.join(primary_tags)}.'")
-                await call.message.edit_text(
-                    f"Выбрано: {', '.join(tags)}\nВыберите хотя бы один обязательный тег из:\n{', '.join(primary_tags)}.",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-                )
+        tag = catalog.tag(tag_id)
+        if tag and tag.name not in tags:  # Добавляем только новый тег
+            tags.append(tag.name)
+            draft.tags = tags
+
+        if tags == previous_tags:  # Если ничего не изменилось
+            logger.debug(f"Теги не изменились: {tags}")
             await call.answer()
+            return
+
+        logger.debug(f"Выбраны теги: {tags}")
+
+        # Проверяем наличие primary_tag для текущей категории
+        primary_tags = catalog.primary_tags(CATEGORIES[category]["tag_category"])
+        has_primary = any(tag_name in primary_tags for tag_name in tags) if primary_tags else True  # Если нет primary_tags, считаем проверку пройденной
+        logger.debug(f"Primary теги для категории '{category}': {primary_tags}, has_primary: {has_primary}")
+
+        keyboard = wizard_tags_keyboard(category, with_next=has_primary)
+
+        if has_primary:
+            logger.debug(f"Отображаем сообщение: 'Выбрано: {', '.join(tags)}\nНажмите Далее для продолжения.'")
+            await call.message.edit_text(
+                f"Выбрано: {', '.join(tags)}\nНажмите 'Далее' для продолжения.",
+                reply_markup=keyboard
+            )
+        else:
+            logger.debug(f"Отображаем сообщение: 'Выбрано: {', '.join(tags)}\nВыберите хотя бы один обязательный тег из: {', '.join(primary_tags)}.'")
+            await call.message.edit_text(
+                f"Выбрано: {', '.join(tags)}\nВыберите хотя бы один обязательный тег из:\n{', '.join(primary_tags)}.",
+                reply_markup=keyboard
+            )
+        await call.answer()
     except Exception as e:
         logger.error(f"Ошибка в process_ad_tags для telegram_id={call.from_user.id}: {str(e)}")
         await call.message.edit_text(
@@ -220,21 +168,10 @@ async def process_ad_tags(call: types.CallbackQuery, state: FSMContext):
 # Обработчик кнопки "Далее" для перехода к вводу заголовка объявления
 # Показывает первое превью с категорией, городом и тегами
 @ad_router.callback_query(F.data == "next_to_title", StateFilter(AdAddForm.tags))
-async def process_next_to_title(call: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:title"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
-    preview = (
-        f"Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags)}\n"
-        f"Введите 📌 Заголовок:"
-    )
+async def process_next_to_title(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
+    category = draft.category
+    keyboard = wizard_step_keyboard(category, "title")
+    preview = draft.preview(prompt="Введите 📌 Заголовок:")
     await call.message.edit_text(
         preview,
         reply_markup=keyboard
@@ -244,25 +181,15 @@ async def process_next_to_title(call: types.CallbackQuery, state: FSMContext):
 
 
 @ad_router.message(StateFilter(AdAddForm.title))
-async def process_ad_title(message: types.Message, state: FSMContext):
-    title = message.text.strip()
-    data = await state.get_data()
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    await state.update_data(title=title)
-
-    logger.debug(f"Вход в process_ad_title: category={category}, city={city}, tags={tags}, title={title}")
-    ad = Advertisement(category=category, city=city, tags=tags, title_ru=title)
-    lines = format_ad_text(ad, fields=['title'], complete=False)
-    logger.debug(f"Результат format_ad_text: {lines}")
-    preview = "Ваше объявление:\n" + "\n".join(lines) + "\nВведите описание:"
+async def process_ad_title(message: types.Message, state: FSMContext, draft: AdDraft):
+    draft.title = message.text.strip()
+    category = draft.category
+
+    logger.debug(f"Вход в process_ad_title: category={category}, city={draft.city}, tags={draft.tags}, title={draft.title}")
+    preview = draft.preview("title", prompt="Введите описание:")
     logger.debug(f"Отправляемый текст: {preview}")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:description"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_step_keyboard(category, "description")
     await message.answer(
         preview,
         reply_markup=keyboard
@@ -273,30 +200,12 @@ async def process_ad_title(message: types.Message, state: FSMContext):
 # Обработчик ввода описания объявления
 # Показывает превью с категорией, городом, тегами, заголовком и описанием, запрашивает цену
 @ad_router.message(StateFilter(AdAddForm.description))
-async def process_ad_description(message: types.Message, state: FSMContext):
-    description = message.text.strip()
-    data = await state.get_data()
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    title = data.get("title")
-    await state.update_data(description=description)
-
-    # Формируем превью
-    preview = (
-        "Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags) if tags else 'Нет тегов'}\n"
-        f"📌 Заголовок: {title}\n"
-        f"Описание: {description}\n"
-        "Введите 💰 цену:"
-    )
+async def process_ad_description(message: types.Message, state: FSMContext, draft: AdDraft):
+    draft.description = message.text.strip()
+    category = draft.category
+    preview = draft.preview("title", "description", prompt="Введите 💰 цену:")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Без цены", callback_data="skip_price")],
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:price"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_step_keyboard(category, "price", ("Без цены", "skip_price"))
     await message.answer(
         preview,
         reply_markup=keyboard
@@ -307,31 +216,12 @@ async def process_ad_description(message: types.Message, state: FSMContext):
 # Обработчик ввода цены объявления
 # Показывает превью с категорией, городом, тегами, заголовком, описанием и ценой, запрашивает медиа
 @ad_router.message(StateFilter(AdAddForm.price))
-async def process_ad_price(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    title = data.get("title")
-    description = data.get("description")
-    price = message.text.strip()[:30]  # Обрезаем до 30 символов
-    await state.update_data(price=price)
-
-    # Формируем превью
-    preview = (
-        "Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags) if tags else 'Нет тегов'}\n"
-        f"📌 Заголовок: {title}\n"
-        f"Описание: {description}\n"
-        f"💰 Цена: {price}"
-    )
+async def process_ad_price(message: types.Message, state: FSMContext, draft: AdDraft):
+    draft.price = message.text.strip()[:30]  # Обрезаем до 30 символов
+    category = draft.category
+    preview = draft.preview("title", "description", "price")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Пропустить загрузку медиа", callback_data="media_skip")],
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:media"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_step_keyboard(category, "media", ("Пропустить загрузку медиа", "media_skip"))
     await message.answer(
         preview + "\n\n" + CATEGORIES[category]["texts"]["media"],
         reply_markup=keyboard
@@ -342,30 +232,12 @@ async def process_ad_price(message: types.Message, state: FSMContext):
 # Обработчик пропуска ввода цены
 # Показывает превью с категорией, городом, тегами, заголовком, описанием и "Цена: не указана", запрашивает медиа
 @ad_router.callback_query(F.data == "skip_price", StateFilter(AdAddForm.price))
-async def process_ad_price_skip(call: types.CallbackQuery, state: FSMContext):
-    await state.update_data(price=None)
-    data = await state.get_data()
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    title = data.get("title")
-    description = data.get("description")
-
-    # Формируем превью без цены
-    preview = (
-        "Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags) if tags else 'Нет тегов'}\n"
-        f"📌 Заголовок: {title}\n"
-        f"Описание: {description}\n"
-        "💰 Цена: не указана"
-    )
+async def process_ad_price_skip(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
+    draft.price = None
+    category = draft.category
+    preview = draft.preview("title", "description", "price")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Пропустить загрузку медиа", callback_data="media_skip")],
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:media"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_step_keyboard(category, "media", ("Пропустить загрузку медиа", "media_skip"))
     await call.message.edit_text(
         preview + "\n\n" + CATEGORIES[category]["texts"]["media"],
         reply_markup=keyboard
@@ -376,7 +248,7 @@ async def process_ad_price_skip(call: types.CallbackQuery, state: FSMContext):
 
 # Обрабатывает загрузку медиа и сохраняет их с типом в формате JSONB
 @ad_router.message(F.photo | F.video, StateFilter(AdAddForm.media))
-async def process_ad_media(message: types.Message, state: FSMContext):
+async def process_ad_media(message: types.Message, state: FSMContext, draft: AdDraft, db_user: UserIdentity | None):
     if message.from_user.is_bot:
         logger.debug(f"Сообщение от бота {message.from_user.id} проигнорировано")
         return
@@ -393,79 +265,68 @@ async def process_ad_media(message: types.Message, state: FSMContext):
         return
 
     media_group_id = message.media_group_id
-    data = await state.get_data()
-    category = data.get("category")
-    media_file_ids = data.get("media_file_ids", []) or []  # Убеждаемся, что это список
-    media_message_id = data.get("media_message_id")
-    media_groups = data.get("media_groups", {})
-    last_group_time = data.get("last_group_time", 0)
-    current_time = asyncio.get_event_loop().time()
-    logger.debug(f"Начало обработки медиа: file_id={file_id}, media_group_id={media_group_id}, текущие файлы={media_file_ids}")
+    if media_group_id:
+        # Части альбома копятся в памяти, состояние пишется один раз при сборе альбома
+        media_group_collector.add(media_group_id, {"id": file_id, "type": media_type},
+                                  lambda files: _finish_media_group(message, state, files, db_user))
+        logger.debug(f"Добавлен файл в альбом: {media_group_id}, file_id={file_id}")
+        return
+
+    # Одиночный файл
+    logger.debug(f"Начало обработки медиа: file_id={file_id}, текущие файлы={draft.media_file_ids}")
 
     # Проверяем, добавлен ли этот file_id ранее
-    if not any(media["id"] == file_id for media in media_file_ids):
-        media_file_ids.append({"id": file_id, "type": media_type})
-        if media_group_id:
-            # Накопление файлов группы
-            group_files = media_groups.get(media_group_id, [])
-            group_files.append({"id": file_id, "type": media_type})
-            media_groups[media_group_id] = group_files
-            await state.update_data(media_file_ids=media_file_ids[:10], media_groups=media_groups, last_group_time=current_time)
-            logger.debug(f"Добавлен файл в группу: {media_group_id}, files={group_files}")
-
-            # Ждем 1 секунду после последнего файла группы
-            await asyncio.sleep(1)
-            data = await state.get_data()
-            if data.get("last_group_time") == current_time:  # Это последний файл группы
-                file_count = len(data.get("media_file_ids", []))
-                text = f"Загружено {file_count} файлов" if file_count > 1 else f"Загружено {file_count} файл"
-                try:
-                    if not media_message_id:
-                        msg = await message.answer(text)
-                        await state.update_data(media_message_id=msg.message_id)
-                        logger.debug(f"Создано сообщение: message_id={msg.message_id}, text='{text}'")
-                    else:
-                        await message.bot.edit_message_text(
-                            text=text,
-                            chat_id=message.chat.id,
-                            message_id=media_message_id
-                        )
-                        logger.debug(f"Отредактировано сообщение: message_id={media_message_id}, text='{text}'")
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке медиа-группы для telegram_id={message.from_user.id}: {e}")
-                    await message.answer("Ошибка при загрузке файлов. Попробуйте снова.")
-                await state.set_state(AdAddForm.contacts)
-                await _send_contact_options(message, state)
+    if not any(media["id"] == file_id for media in draft.media_file_ids):
+        draft.media_file_ids = (draft.media_file_ids + [{"id": file_id, "type": media_type}])[:10]
+        logger.debug(f"Сохранён одиночный файл: media_file_ids={draft.media_file_ids}")
+        await _report_media(message, draft)
+        logger.debug(f"Переход к состоянию AdAddForm.contacts для telegram_id={message.from_user.id}")
+        await state.set_state(AdAddForm.contacts)
+        await _send_contact_options(message, draft, db_user)
+
+# Создаёт или обновляет сообщение "Загружено N файлов"
+async def _report_media(message: types.Message, draft: AdDraft):
+    file_count = len(draft.media_file_ids)
+    text = f"Загружено {file_count} файлов" if file_count > 1 else f"Загружено {file_count} файл"
+    try:
+        if not draft.media_message_id:
+            msg = await message.answer(text)
+            draft.media_message_id = msg.message_id
+            logger.debug(f"Создано сообщение: message_id={msg.message_id}, text='{text}'")
         else:
-            # Одиночный файл
-            file_count = len(media_file_ids)
-            text = f"Загружено {file_count} файлов" if file_count > 1 else f"Загружено {file_count} файл"
-            await state.update_data(media_file_ids=media_file_ids[:10])
-            logger.debug(f"Сохранён одиночный файл: media_file_ids={media_file_ids}")
-            try:
-                if not media_message_id:
-                    msg = await message.answer(text)
-                    await state.update_data(media_message_id=msg.message_id)
-                    logger.debug(f"Создано сообщение для одиночного файла: message_id={msg.message_id}, text='{text}'")
-                else:
-                    await message.bot.edit_message_text(
-                        text=text,
-                        chat_id=message.chat.id,
-                        message_id=media_message_id
-                    )
-                    logger.debug(f"Отредактировано сообщение для одиночного файла: message_id={media_message_id}, text='{text}'")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке одиночного медиа для telegram_id={message.from_user.id}: {e}")
-                await message.answer("Ошибка при загрузке файла. Попробуйте снова.")
-            logger.debug(f"Переход к состоянию AdAddForm.contacts для telegram_id={message.from_user.id}")
-            await state.set_state(AdAddForm.contacts)
-            logger.debug(f"Состояние изменено, вызов _send_contact_options для telegram_id={message.from_user.id}")
-            await _send_contact_options(message, state)
+            await message.bot.edit_message_text(
+                text=text,
+                chat_id=message.chat.id,
+                message_id=draft.media_message_id
+            )
+            logger.debug(f"Отредактировано сообщение: message_id={draft.media_message_id}, text='{text}'")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке медиа для telegram_id={message.from_user.id}: {e}")
+        await message.answer("Ошибка при загрузке файлов. Попробуйте снова.")
+
+# Сохраняет собранный альбом одной записью в состояние и один раз сообщает о загрузке
+async def _finish_media_group(message: types.Message, state: FSMContext, files: list[dict], db_user: UserIdentity | None):
+    async with user_scheduler.user_lock(message.from_user.id):
+        if await state.get_state() != AdAddForm.media.state:
+            logger.debug(f"Альбом от telegram_id={message.from_user.id} пропущен: шаг загрузки медиа уже пройден")
+            return
+        # Вызывается вне хэндлера, поэтому черновик читается и сохраняется здесь же
+        draft = await AdDraft.load(state)
+        media_file_ids = list(draft.media_file_ids)
+        known = {media["id"] for media in media_file_ids}
+        for media in files:
+            if media["id"] not in known:
+                known.add(media["id"])
+                media_file_ids.append(media)
+        draft.media_file_ids = media_file_ids[:10]
+        await _report_media(message, draft)
+        await draft.save(state)
+        await state.set_state(AdAddForm.contacts)
+        await _send_contact_options(message, draft, db_user)
 
 # Пропуск загрузки медиа
 @ad_router.callback_query(F.data == "media_skip", StateFilter(AdAddForm.media))
-async def process_ad_skip(call: types.CallbackQuery, state: FSMContext):
-    await state.update_data(media_file_ids=[])
+async def process_ad_skip(call: types.CallbackQuery, state: FSMContext, draft: AdDraft, db_user: UserIdentity | None):
     logger.info(f"Пользователь {call.from_user.id} пропустил загрузку медиа")
     if call.from_user.is_bot:
         logger.debug(f"Пользователь {call.from_user.id} — бот, дальнейшие действия невозможны")
@@ -476,13 +337,14 @@ async def process_ad_skip(call: types.CallbackQuery, state: FSMContext):
         await state.clear()
     else:
         logger.debug(f"Переход к выбору контактов для пользователя {call.from_user.id}")
+        draft.media_file_ids = []
         await state.set_state(AdAddForm.contacts)
-        await _send_contact_options(call, state)
+        await _send_contact_options(call, draft, db_user)
     await call.answer()
 
 # Отправляет варианты выбора контактов для объявления
 # Показывает превью с категорией, городом, тегами, заголовком, описанием, ценой и медиа
-async def _send_contact_options(message_or_call, state: FSMContext):
+async def _send_contact_options(message_or_call, draft: AdDraft, db_user: UserIdentity | None):
     if isinstance(message_or_call, types.Message):
         telegram_id = str(message_or_call.from_user.id)
         username = message_or_call.from_user.username
@@ -496,41 +358,15 @@ async def _send_contact_options(message_or_call, state: FSMContext):
         chat_id = message_or_call.from_user.id
         bot = message_or_call.message.bot
 
-    data = await state.get_data()
     if is_bot:
         logger.debug(f"Сообщение от бота {telegram_id} проигнорировано")
         return
 
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    title = data.get("title")
-    description = data.get("description")
-    price = data.get("price")
-    media_file_ids = data.get("media_file_ids", [])
-
-    # Формируем превью
-    media_text = f"Медиа: {len(media_file_ids)} файл{'а' if 2 <= len(media_file_ids) <= 4 else 'ов' if len(media_file_ids) >= 5 else ''}" if media_file_ids else "Медиа: не загружено"
-    preview = (
-        "Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags) if tags else 'Нет тегов'}\n"
-        f"📌 Заголовок: {title}\n"
-        f"Описание: {description}\n"
-        f"💰 Цена: {price if price else 'не указана'}\n"
-        f"{media_text}"
-    )
+    category = draft.category
+    preview = draft.preview("title", "description", "price", media=True)
 
-    logger.debug(f"Получение сохранённых контактов для {telegram_id}")
-    async for session in get_db():
-        result = await session.execute(
-            select(Advertisement.contact_info)
-            .where(Advertisement.user_id == select(User.id).where(User.telegram_id == telegram_id).scalar_subquery())
-            .order_by(Advertisement.created_at.desc())
-            .limit(1)
-        )
-        saved_contact = result.scalar_one_or_none()
-        logger.debug(f"Сохранённый контакт для {telegram_id}: {saved_contact}")
+    saved_contact = db_user.last_contact if db_user else None  # Контакт из последнего объявления, без запроса к advertisements
+    logger.debug(f"Сохранённый контакт для {telegram_id}: {saved_contact}")
 
     buttons = []
     if username:
@@ -553,29 +389,11 @@ async def _send_contact_options(message_or_call, state: FSMContext):
 # Обработчик выбора контактов через инлайн-кнопки
 # Показывает полное превью объявления с выбранными контактами для уточнения или подтверждения
 @ad_router.callback_query(F.data.startswith("contact:"), StateFilter(AdAddForm.contacts))
-async def process_contact_choice(call: types.CallbackQuery, state: FSMContext):
+async def process_contact_choice(call: types.CallbackQuery, state: FSMContext, draft: AdDraft, db_user: UserIdentity | None):
     action = call.data.split(":", 1)[1]
     username = call.from_user.username
-    telegram_id = str(call.from_user.id)
-    data = await state.get_data()
-
-    category = data.get("category")
-    city = data.get("city")
-    tags = data.get("tags", [])
-    title = data.get("title")
-    description = data.get("description")
-    price = data.get("price")
-    media_file_ids = data.get("media_file_ids", [])
-
-    async for session in get_db():
-        result = await session.execute(
-            select(Advertisement.contact_info)
-            .where(
-                Advertisement.user_id == select(User.id).where(User.telegram_id == str(telegram_id)).scalar_subquery())
-            .order_by(Advertisement.created_at.desc())
-            .limit(1)
-        )
-        saved_contact = result.scalar_one_or_none()
+    category = draft.category
+    saved_contact = db_user.last_contact if db_user else None
 
     if action == "username" and username:
         contact_text = f"@{username}"
@@ -585,27 +403,13 @@ async def process_contact_choice(call: types.CallbackQuery, state: FSMContext):
         await call.answer("Ошибка выбора контакта.", show_alert=True)
         return
 
-    await state.update_data(selected_contact=contact_text)
-
-    # Формируем превью
-    media_text = f"Медиа: {len(media_file_ids)} файл{'а' if 2 <= len(media_file_ids) <= 4 else 'ов' if len(media_file_ids) >= 5 else ''}" if media_file_ids else "Медиа: не загружено"
-    preview = (
-        "Ваше объявление:\n"
-        f"{CATEGORIES[category]['display_name']} в {city}\n"
-        f"🏷️ {', '.join(tags) if tags else 'Нет тегов'}\n"
-        f"📌 Заголовок: {title}\n"
-        f"Описание: {description}\n"
-        f"💰 Цена: {price if price else 'не указана'}\n"
-        f"{media_text}\n"
-        f"☎️ Контакты: <code>{contact_text}</code>\n"
-        "Введите дополнительные данные или подтвердите:"
+    draft.selected_contact = contact_text
+    preview = draft.preview(
+        "title", "description", "price", media=True,
+        prompt=f"☎️ Контакты: <code>{contact_text}</code>\nВведите дополнительные данные или подтвердите:"
     )
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Подтвердить", callback_data="confirm_contact")],
-        [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:contacts"),
-         InlineKeyboardButton(text="Назад", callback_data="back")]
-    ])
+    keyboard = wizard_step_keyboard(category, "contacts", ("Подтвердить", "confirm_contact"))
     await call.message.edit_text(
         preview,
         reply_markup=keyboard
@@ -616,28 +420,15 @@ async def process_contact_choice(call: types.CallbackQuery, state: FSMContext):
 # Обработчик подтверждения контактов
 # Показывает конечное превью объявления с медиа через render_ad и предлагает сохранить или отменить
 @ad_router.callback_query(F.data == "confirm_contact", StateFilter(AdAddForm.contacts))
-async def process_confirm_contact(call: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    selected_contact = data.get("selected_contact", "")
-    if not selected_contact:
+async def process_confirm_contact(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
+    if not draft.selected_contact:
         await call.message.edit_text("Ошибка: контакт не выбран. Попробуйте снова",
                                      reply_markup=get_main_menu_keyboard())
         await state.clear()
         return
 
-    await state.update_data(contacts=selected_contact)
-
-    # Создаём объект Advertisement для render_ad
-    ad = Advertisement(
-        category=data["category"],
-        city=data["city"],
-        tags=data.get("tags", []),
-        title_ru=data["title"],
-        description_ru=data["description"],
-        price=data.get("price"),
-        media_file_ids=data.get("media_file_ids", []),
-        contact_info=selected_contact
-    )
+    draft.contacts = draft.selected_contact
+    ad = draft.to_ad()  # Объект Advertisement для render_ad
 
     # Формируем кнопки для финального подтверждения
     buttons = [[
@@ -653,30 +444,17 @@ async def process_confirm_contact(call: types.CallbackQuery, state: FSMContext):
 
 # Ручной ввод контактов
 @ad_router.message(StateFilter(AdAddForm.contacts))
-async def process_ad_contacts_manual(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    category = data.get("category")
-    selected_contact = data.get("selected_contact", "")
+async def process_ad_contacts_manual(message: types.Message, state: FSMContext, draft: AdDraft):
+    category = draft.category
+    selected_contact = draft.selected_contact or ""
     additional_text = message.text.strip()
     contacts = f"{selected_contact} {additional_text}" if selected_contact and additional_text else selected_contact or additional_text
     if not contacts:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:contacts"),
-             InlineKeyboardButton(text="Назад", callback_data="back")]
-        ])
+        keyboard = wizard_step_keyboard(category, "contacts")
         await message.answer("Контакты не могут быть пустыми. Введите данные:", reply_markup=keyboard)
         return
-    await state.update_data(contacts=contacts)
-    preview = (
-        f"Категория: {category}\n"
-        f"Город: {data['city']}\n"
-        f"Теги: {', '.join(data['tags']) if data['tags'] else 'нет'}\n"
-        f"Заголовок: {data['title']}\n"
-        f"Описание: {data['description']}\n"
-        f"Цена: {data.get('price', 'без цены')}\n"
-        f"Медиа: {'Есть' if data.get('media_file_ids') else 'Нет'}\n"
-        f"Контакты: {contacts}"
-    )
+    draft.contacts = contacts
+    preview = draft.preview("title", "description", "price", "contacts", media=True)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Сохранить", callback_data="confirm:save"),
          InlineKeyboardButton(text="Отменить", callback_data="confirm:cancel")]
@@ -686,41 +464,36 @@ async def process_ad_contacts_manual(message: types.Message, state: FSMContext):
 
 # Подтверждает и сохраняет объявление в базу с выводом ID
 @ad_router.callback_query(F.data.startswith("confirm:"), StateFilter(AdAddForm.confirm))
-async def process_ad_confirm(call: types.CallbackQuery, state: FSMContext):
+async def process_ad_confirm(call: types.CallbackQuery, state: FSMContext, draft: AdDraft, db_user: UserIdentity | None):
     action = call.data.split(":", 1)[1]
-    data = await state.get_data()
     telegram_id = str(call.from_user.id)
 
     if action == "save":
-        async for session in get_db():
-            stmt = select(User.id).where(User.telegram_id == telegram_id)
-            result = await session.execute(stmt)
-            user_id = result.scalar_one_or_none()
-            if not user_id:
-                await call.message.bot.send_message(
-                    chat_id=call.from_user.id,
-                    text="Пользователь не найден. Используйте /start",
-                    reply_markup=get_main_menu_keyboard()
-                )
-                await state.set_state(AdsViewForm.select_category)
-                return
-            ad_id = await add_advertisement(
-                user_id=user_id,
-                category=data["category"],
-                city=data["city"],
-                title_ru=data["title"],
-                description_ru=data["description"],
-                tags=data.get("tags", []),
-                media_file_ids=data.get("media_file_ids"),
-                contact_info=data["contacts"],
-                price=data.get("price")
-            )
-            logger.info(f"Объявление #{ad_id} добавлено для telegram_id={telegram_id}")
+        if not db_user:
             await call.message.bot.send_message(
                 chat_id=call.from_user.id,
-                text=f"Объявление №{ad_id} сохранено и отправлено на модерацию",
+                text="Пользователь не найден. Используйте /start",
                 reply_markup=get_main_menu_keyboard()
             )
+            await state.set_state(AdsViewForm.select_category)
+            return
+        ad_id = await add_advertisement(
+            user_id=db_user.id,
+            category=draft.category,
+            city=draft.city,
+            title_ru=draft.title,
+            description_ru=draft.description,
+            tags=draft.tags,
+            media_file_ids=draft.media_file_ids,
+            contact_info=draft.contacts,
+            price=draft.price
+        )
+        logger.info(f"Объявление #{ad_id} добавлено для telegram_id={telegram_id}")
+        await call.message.bot.send_message(
+            chat_id=call.from_user.id,
+            text=f"Объявление №{ad_id} сохранено и отправлено на модерацию",
+            reply_markup=get_main_menu_keyboard()
+        )
     elif action == "cancel":
         await call.message.bot.send_message(
             chat_id=call.from_user.id,
@@ -741,10 +514,9 @@ async def process_ad_back(call: types.CallbackQuery, state: FSMContext):
 
 # Обработчик "Помощь"
 @ad_router.callback_query(F.data.startswith("help:"), StateFilter(AdAddForm))
-async def process_ad_help(call: types.CallbackQuery, state: FSMContext):
+async def process_ad_help(call: types.CallbackQuery, state: FSMContext, draft: AdDraft):
     _, category, step = call.data.split(":", 2)
-    data = await state.get_data()
-    category = data.get("category", category)
+    category = draft.category or category
     help_text = CATEGORIES[category]["texts"].get(f"help_{step}", "Помощь для этого шага недоступна.")
     await call.message.bot.send_message(
         chat_id=call.from_user.id,
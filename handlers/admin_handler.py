@@ -1,14 +1,23 @@
 from aiogram import Router, Bot
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import StateFilter
+from aiogram.filters import StateFilter, Command
 from aiogram import F
 from aiogram.fsm.storage.base import StorageKey
 from states import AdminForm, AdsViewForm
-from database import get_db, User, Advertisement, select, ViewedAds, Subscription
+from database import get_db, User, Advertisement, select, subscription_index, UserIdentity, change_ad_status, delete_advertisement, get_pool_stats, user_cache, city_counts_cache, viewed_ads_buffer, ad_card_cache, catalog, load_catalog
 from data.constants import get_main_menu_keyboard
 from loguru import logger
 from tools.utils import render_ad, get_navigation_keyboard, delete_messages, notify_user
+from tools.rate_limiter import outbound_limiter
+from tools.retry import telegram_retry
+from tools.fsm_storage import fsm_storage
+from tools.scheduler import user_scheduler
+from tools.media_group import media_group_collector
+from tools.keyboards import keyboard_cache
+from tools.digest import digest_sender
+from tools.fanout import fanout_worker
+from tools.catalog_refresh import catalog_refresher
 from sqlalchemy.sql import func
 
 admin_router = Router()
@@ -25,22 +34,75 @@ async def send_navigation_keyboard(bot: Bot, chat_id: int, state: FSMContext) ->
     logger.debug(f"Навигационная клавиатура отправлена, message_id={nav_message.message_id}")
     return nav_message.message_id
 
+# Собирает метрики для команды /stats: раздел -> словарь значений
+def collect_stats() -> dict[str, dict]:
+    return {
+        "Пул соединений БД": get_pool_stats(),
+        "Кэш пользователей": user_cache.stats(),
+        "Кэш счётчиков городов": city_counts_cache.stats(),
+        "Кэш карточек объявлений": ad_card_cache.stats(),
+        "Буфер отметок просмотра": viewed_ads_buffer.stats(),
+        "Индекс подписок": subscription_index.stats(),
+        "Справочники": catalog.stats(),
+        "Кэш клавиатур": keyboard_cache.stats(),
+        "Исходящие сообщения": outbound_limiter.stats(),
+        "Повторы запросов к Telegram": telegram_retry.stats(),
+        "Хранилище FSM": fsm_storage.stats(),
+        "Обработка апдейтов": user_scheduler.stats(),
+        "Альбомы": media_group_collector.stats(),
+        "Дайджесты подписчикам": digest_sender.stats(),
+        "Рассылка по одобренным": fanout_worker.stats(),
+    }
+
+
+# Показывает администратору текущие метрики бота
+@admin_router.message(Command("stats"))
+async def admin_stats(message: Message, db_user: UserIdentity | None):
+    if not db_user or not db_user.is_admin:
+        logger.warning(f"Пользователь telegram_id={message.from_user.id} запросил /stats без прав администратора")
+        return
+    lines = []
+    for section, values in collect_stats().items():
+        lines.append(f"<b>{section}</b>")
+        lines.extend(f"{key}: {value}" for key, value in values.items())
+        lines.append("")
+    await message.answer("\n".join(lines).strip())
+    logger.info(f"Метрики отправлены администратору telegram_id={message.from_user.id}")
+
+# Перечитывает теги и города из базы после запуска скриптов заполнения.
+# Сразу — в этом процессе; остальные процессы подхватят изменения сами при периодической сверке
+@admin_router.message(Command("reload_catalog"))
+async def admin_reload_catalog(message: Message, db_user: UserIdentity | None):
+    if not db_user or not db_user.is_admin:
+        logger.warning(f"Пользователь telegram_id={message.from_user.id} запросил /reload_catalog без прав администратора")
+        return
+    try:
+        await load_catalog()
+    except Exception as e:
+        logger.error(f"Ошибка перезагрузки справочников: {e}")
+        await message.answer("Не удалось перезагрузить справочники, оставлены прежние.")
+        return
+    stats = catalog.stats()
+    await message.answer(
+        f"Справочники перезагружены: тегов {stats['tags']}, городов {stats['cities']}.\n"
+        f"Остальные процессы бота обновят их в течение {catalog_refresher.interval:g} с."
+    )
+    logger.info(f"Справочники перезагружены администратором telegram_id={message.from_user.id}")
+
 # Отображает объявления на модерацию и предоставляет кнопки для управления
 @admin_router.callback_query(F.data == "admin_moderate")
-async def admin_moderate(call: CallbackQuery, state: FSMContext):
+async def admin_moderate(call: CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
     logger.debug(f"Вызван admin_moderate с callback_data={call.data}, from_id={call.from_user.id}")
     telegram_id = str(call.from_user.id)
     bot = call.message.bot
 
-    async for session in get_db():
-        # Проверка прав администратора
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user or not user.is_admin:
-            logger.warning(f"Пользователь telegram_id={telegram_id} не админ или не найден")
-            await call.message.edit_text("У вас нет прав для модерации.\n🏠:", reply_markup=get_main_menu_keyboard())
-            return
+    # Проверка прав администратора
+    if not db_user or not db_user.is_admin:
+        logger.warning(f"Пользователь telegram_id={telegram_id} не админ или не найден")
+        await call.message.edit_text("У вас нет прав для модерации.\n🏠:", reply_markup=get_main_menu_keyboard())
+        return
 
+    async for session in get_db():
         # Получение объявлений на модерацию
         result = await session.execute(
             select(Advertisement).where(Advertisement.status == "pending").order_by(Advertisement.id)
@@ -95,8 +157,12 @@ async def approve_ad(call: CallbackQuery, state: FSMContext):
         result = await session.execute(select(Advertisement).where(Advertisement.id == ad_id))
         ad = result.scalar_one_or_none()
         if ad:
-            ad.status = "approved"
-            await session.commit()
+            # Событие для рассылки подписчикам ставится в той же транзакции, только если статус изменился
+            if not await change_ad_status(session, ad, "approved"):
+                logger.info(f"Объявление #{ad_id} уже одобрено, повторное нажатие telegram_id={telegram_id}")
+                await call.answer(f"Объявление #{ad_id} уже одобрено")
+                return
+            fanout_worker.notify()
             logger.info(f"Объявление #{ad_id} принято модератором telegram_id={telegram_id}")
 
             user_result = await session.execute(select(User.telegram_id).where(User.id == ad.user_id))
@@ -106,41 +172,6 @@ async def approve_ad(call: CallbackQuery, state: FSMContext):
                 short_text = full_text[:35] + "..." if len(full_text) > 35 else full_text
                 await notify_user(bot, user_telegram_id, short_text, state)
 
-            # Оптимизированная выборка подписок
-            subscriptions = await session.execute(
-                select(Subscription)
-                .where(Subscription.city == ad.city)
-                .where(Subscription.category == ad.category)  # Исправлено с Submission на Subscription
-                .where(Subscription.tags.overlap(ad.tags))
-            )
-            subscriptions = subscriptions.scalars().all()
-            logger.debug(f"Найдено релевантных подписок: {len(subscriptions)}")
-
-            for sub in subscriptions:
-                user_result = await session.execute(select(User).where(User.id == sub.user_id))
-                user = user_result.scalar_one_or_none()
-                if not user:
-                    logger.warning(f"Пользователь для подписки user_id={sub.user_id} не найден")
-                    continue
-
-                # Подсчет непросмотренных объявлений через func.count()
-                query = (
-                    select(func.count(Advertisement.id))
-                    .where(Advertisement.status == "approved")
-                    .where(Advertisement.city == sub.city)
-                    .where(Advertisement.category == sub.category)
-                    .where(~Advertisement.id.in_(
-                        select(ViewedAds.advertisement_id).where(ViewedAds.user_id == sub.user_id)))
-                    .where(Advertisement.tags.overlap(sub.tags))
-                )
-                missed_count = await session.scalar(query)
-
-                if missed_count > 0:
-                    full_text = f"🔔 По подписке {missed_count} новых объ..ℹ️"
-                    short_text = full_text[:35] if len(full_text) > 35 else full_text
-                    await notify_user(bot, user.telegram_id, short_text, state)
-                    logger.info(f"Отправлено уведомление для telegram_id={user.telegram_id}, count={missed_count}")
-
             await bot.send_message(chat_id=telegram_id, text=f"Объявление #{ad_id} одобрено")
             await send_navigation_keyboard(bot, telegram_id, state)
 
@@ -165,8 +196,7 @@ async def reject_ad(call: CallbackQuery, state: FSMContext):
         result = await session.execute(select(Advertisement).where(Advertisement.id == ad_id))
         ad = result.scalar_one_or_none()
         if ad:
-            ad.status = "rejected"
-            await session.commit()
+            await change_ad_status(session, ad, "rejected")
             user_result = await session.execute(select(User.telegram_id).where(User.id == ad.user_id))
             user_telegram_id = user_result.scalar_one_or_none()
             if user_telegram_id and user_telegram_id != telegram_id:
@@ -250,8 +280,7 @@ async def delete_ad_confirmed(call: CallbackQuery, state: FSMContext):
         if ad:
             user_result = await session.execute(select(User.telegram_id).where(User.id == ad.user_id))
             user_telegram_id = user_result.scalar_one_or_none()
-            await session.delete(ad)
-            await session.commit()
+            await delete_advertisement(session, ad)
             logger.info(f"Объявление #{ad_id} удалено модератором telegram_id={telegram_id}")
             if user_telegram_id and user_telegram_id != telegram_id:
                 await notify_user(bot, user_telegram_id, f"🗑 Объявление #{ad_id} удалено ℹ️", state)
@@ -4,14 +4,71 @@ from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 from sqlalchemy import select, func
 from loguru import logger
-from database import get_db, Advertisement, get_cities, get_category_tags, is_favorite, User, add_to_favorites, Tag, ViewedAds
+from database import get_db, Advertisement, get_cities, get_category_tags, is_favorite, User, add_to_favorites, Tag, UserIdentity, unseen_ads_condition, catalog
 from data.constants import get_main_menu_keyboard
 from data.categories import CATEGORIES
 from tools.utils import render_ad, get_navigation_keyboard
+from tools.keyboards import (browse_tags_keyboard, browse_cities_keyboard, EMPTY_CATEGORY_KEYBOARD,
+                             BROWSE_PAGE_KEYBOARD, BROWSE_PAGE_MORE_KEYBOARD)
 from states import AdsViewForm, AdAddForm
+import config
 
 ads_router = Router()
 
+# Сколько объявлений отправляется за одно нажатие "Найти" / "Показать ещё"
+BROWSE_PAGE_SIZE = getattr(config, "BROWSE_PAGE_SIZE", 10)
+# До скольких объявлений считать найденные для заголовка; больше показывается как "N+"
+BROWSE_COUNT_LIMIT = getattr(config, "BROWSE_COUNT_LIMIT", 100)
+
+
+# Условия выборки объявлений для просмотра по сохранённым в FSM фильтрам
+def _browse_conditions(browse: dict) -> list:
+    conditions = [
+        Advertisement.category == browse["category"],
+        Advertisement.city == browse["city"],
+        Advertisement.status == "approved"
+    ]
+    if browse["tags"]:  # Применяем теги как "ИЛИ"
+        conditions.append(Advertisement.tags.overlap(browse["tags"]))
+    if browse["only_new"]:
+        conditions.append(unseen_ads_condition(browse["user_id"]))
+    return conditions
+
+
+# Отправляет следующую страницу объявлений после курсора browse["last_id"] и меню просмотра
+async def _send_ads_page(call: types.CallbackQuery, state: FSMContext, browse: dict) -> None:
+    telegram_id = str(call.from_user.id)
+    async for session in get_db():
+        result = await session.execute(
+            select(Advertisement)
+            .where(*_browse_conditions(browse), Advertisement.id > browse["last_id"])
+            .order_by(Advertisement.id)
+            .limit(BROWSE_PAGE_SIZE + 1)  # Лишняя запись показывает, есть ли следующая страница
+        )
+        ads = result.scalars().all()
+    has_more = len(ads) > BROWSE_PAGE_SIZE
+    ads = ads[:BROWSE_PAGE_SIZE]
+    logger.debug(f"_send_ads_page: telegram_id={telegram_id}, после id={browse['last_id']} IDs: {[ad.id for ad in ads]}, есть ещё: {has_more}")
+
+    for ad in ads:
+        buttons = [[InlineKeyboardButton(
+            text="В избранное",
+            callback_data=f"favorite:add:{ad.id}"
+        )]]
+        logger.debug(f"Отправка объявления ID {ad.id} для telegram_id={telegram_id}")
+        await render_ad(ad, call.message.bot, call.from_user.id, show_status=False, buttons=buttons, mark_viewed=True, compact=True)
+
+    if ads:
+        browse["last_id"] = ads[-1].id
+    await state.update_data(browse=browse if has_more else None)
+
+    await call.message.bot.send_message(
+        chat_id=call.from_user.id,
+        text="Режим просмотра объявлений",
+        reply_markup=BROWSE_PAGE_MORE_KEYBOARD if has_more else BROWSE_PAGE_KEYBOARD
+    )
+    logger.debug(f"Отправлено финальное меню")
+
 
 # handlers/ads_handler.py
 # Обрабатывает выбор категории и показывает города с кнопкой "Добавить своё" перед навигацией
@@ -25,34 +82,17 @@ async def show_cities_by_category(call: types.CallbackQuery, state: FSMContext):
     logger.debug(f"Получены города для категории '{category}': {cities}, количество: {len(cities)}")
     if not cities:
         display_name = CATEGORIES[category]["display_name"]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            *get_navigation_keyboard().inline_keyboard  # Используем стандартную навигацию
-        ])
-        # Добавляем "Добавить своё" даже если нет городов
-        keyboard.inline_keyboard.insert(0, [InlineKeyboardButton(text="РАЗМЕСТИТЬ ОБЪЯВЛЕНИЕ", callback_data="action:add")])
         await state.update_data(category=category)
         await call.message.edit_text(
             f"В категории '{display_name}' нет одобренных объявлений",
-            reply_markup=keyboard
+            reply_markup=EMPTY_CATEGORY_KEYBOARD  # "Добавить своё" даже если нет городов
         )
         await call.answer()
         return
 
-    city_list = [(city, count) for city, count in cities.items()]
-    buttons = [city_list[i:i + 3] for i in range(0, len(city_list), 3)]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(
-            text=f"{city} ({count})",
-            callback_data=f"city_select:{category}:{city}"
-        ) for city, count in row] for row in buttons
-    ])
-    # Добавляем "Добавить своё" после городов
-    keyboard.inline_keyboard.append([InlineKeyboardButton(text="РАЗМЕСТИТЬ ОБЪЯВЛЕНИЕ", callback_data="action:add")])
-    # Добавляем навигационную клавиатуру в конец
-    keyboard.inline_keyboard.extend(get_navigation_keyboard().inline_keyboard)
     await call.message.edit_text(
         "Выберите город для просмотра объявлений:",
-        reply_markup=keyboard
+        reply_markup=browse_cities_keyboard(category, cities)  # Города, "Добавить своё" и навигация
     )
     await state.update_data(category=category)
     await state.set_state(AdsViewForm.select_city)
@@ -80,15 +120,7 @@ async def show_ads_by_city(call: types.CallbackQuery, state: FSMContext):
         await call.answer()
         return
 
-    buttons = [tags[i:i + 3] for i in range(0, len(tags), 3)]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=name, callback_data=f"tag:{id}") for id, name in row] for row in buttons
-    ])
-    keyboard.inline_keyboard.append([
-        InlineKeyboardButton(text="Только новые", callback_data="only_new"),
-        InlineKeyboardButton(text="Найти", callback_data="skip")
-    ])
-    keyboard.inline_keyboard.append(get_navigation_keyboard().inline_keyboard[0])  # Добавляем "Помощь" и "Назад"
+    keyboard = browse_tags_keyboard(tags)
     await call.message.edit_text(
         f"Выберите теги для <b>{city}</b> (или нажмите <b>Найти</b> для поиска без фильтров):",
         reply_markup=keyboard
@@ -100,7 +132,7 @@ async def show_ads_by_city(call: types.CallbackQuery, state: FSMContext):
 
 # Обрабатывает выбор тегов и выводит отфильтрованные объявления по принципу "ИЛИ" с лимитом в 3 тега
 @ads_router.callback_query(F.data.startswith(("tag:", "only_new", "skip")), StateFilter(AdsViewForm.select_tags))
-async def process_tag_filter(call: types.CallbackQuery, state: FSMContext):
+async def process_tag_filter(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
     telegram_id = str(call.from_user.id)
     logger.debug(f"process_tag_filter: Начало обработки для telegram_id={telegram_id}, callback_data={call.data}")
     data = await state.get_data()
@@ -124,23 +156,12 @@ async def process_tag_filter(call: types.CallbackQuery, state: FSMContext):
         if len(tags) >= 3:
             await call.answer("Ваш максимум - 3 тега", show_alert=True)
             return
-        async for session in get_db():
-            result = await session.execute(select(Tag).where(Tag.id == tag_id))
-            tag = result.scalar_one_or_none()
-            if tag and tag.name not in tags:
-                tags.append(tag.name)
-                await state.update_data(tags=tags, tags_selected=True)  # Устанавливаем флаг при выборе тега
-                await call.answer(f"Выбран тег: {tag.name}")
-        tags_list = await get_category_tags(category, city)
-        buttons = [tags_list[i:i + 3] for i in range(0, len(tags_list), 3)]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=name, callback_data=f"tag:{id}") for id, name in row] for row in buttons
-        ])
-        keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text="Только новые" if not only_new else "Все объявления", callback_data="only_new"),
-            InlineKeyboardButton(text="Найти", callback_data="skip")
-        ])
-        keyboard.inline_keyboard.append(get_navigation_keyboard().inline_keyboard[0])  # Добавляем "Помощь" и "Назад"
+        tag = catalog.tag(tag_id)
+        if tag and tag.name not in tags:
+            tags.append(tag.name)
+            await state.update_data(tags=tags, tags_selected=True)  # Устанавливаем флаг при выборе тега
+            await call.answer(f"Выбран тег: {tag.name}")
+        keyboard = browse_tags_keyboard(await get_category_tags(category, city), only_new)
         selected_filters = tags.copy()
         if only_new:
             selected_filters.append("Только новые")
@@ -154,16 +175,7 @@ async def process_tag_filter(call: types.CallbackQuery, state: FSMContext):
     elif callback_data == "only_new":
         only_new = not only_new
         await state.update_data(only_new=only_new)
-        tags_list = await get_category_tags(category, city)
-        buttons = [tags_list[i:i + 3] for i in range(0, len(tags_list), 3)]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=name, callback_data=f"tag:{id}") for id, name in row] for row in buttons
-        ])
-        keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text="Только новые" if not only_new else "Все объявления", callback_data="only_new"),
-            InlineKeyboardButton(text="Найти", callback_data="skip")
-        ])
-        keyboard.inline_keyboard.append(get_navigation_keyboard().inline_keyboard[0])  # Добавляем "Помощь" и "Назад"
+        keyboard = browse_tags_keyboard(await get_category_tags(category, city), only_new)
         selected_filters = tags.copy()
         if only_new:
             selected_filters.append("Только новые")
@@ -177,76 +189,60 @@ async def process_tag_filter(call: types.CallbackQuery, state: FSMContext):
 
     elif callback_data == "skip":
         logger.debug(f"process_tag_filter: telegram_id={telegram_id}, начало блока skip")
+        if not db_user:
+            await call.message.edit_text(
+                "Ошибка: пользователь не найден.\n:", reply_markup=get_main_menu_keyboard()
+            )
+            await state.clear()
+            await call.answer()
+            return
+        # Фильтры и курсор поиска сохраняются в FSM для кнопки "Показать ещё"
+        browse = {
+            "category": category,
+            "city": city,
+            "tags": tags if tags_selected else [],
+            "only_new": only_new,
+            "user_id": db_user.id,
+            "last_id": 0
+        }
+
         async for session in get_db():
             logger.debug(f"process_tag_filter: telegram_id={telegram_id}, перед запросом к базе")
-            result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
-            user_id = result.scalar_one_or_none()
-            if not user_id:
-                await call.message.edit_text(
-                    "Ошибка: пользователь не найден.\n:", reply_markup=get_main_menu_keyboard()
-                )
-                await state.clear()
-                await call.answer()
-                return
-
-            query = select(Advertisement).where(
-                Advertisement.category == category,
-                Advertisement.city == city,
-                Advertisement.status == "approved"
-            )
-            if tags and tags_selected:  # Применяем теги как "ИЛИ"
-                query = query.where(Advertisement.tags.overlap(tags))
-            if only_new:
-                query = query.where(~Advertisement.id.in_(
-                    select(ViewedAds.advertisement_id).where(ViewedAds.user_id == user_id)
-                ))
-            ads = await session.execute(query.order_by(Advertisement.id))
-            ads = ads.scalars().all()
-            logger.debug(f"process_tag_filter: telegram_id={telegram_id}, найдено объявлений: {len(ads)}, IDs: {[ad.id for ad in ads]}")
-
-            if not ads:
-                await state.update_data(tags=[], only_new=False, tags_selected=False)  # Очищаем теги при отсутствии результатов
-                tags_list = await get_category_tags(category, city)
-                buttons = [tags_list[i:i + 3] for i in range(0, len(tags_list), 3)]
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text=name, callback_data=f"tag:{id}") for id, name in row] for row in buttons
-                ])
-                keyboard.inline_keyboard.append([
-                    InlineKeyboardButton(text="Только новые", callback_data="only_new"),
-                    InlineKeyboardButton(text="Найти", callback_data="skip")
-                ])
-                keyboard.inline_keyboard.append(get_navigation_keyboard().inline_keyboard[0])  # Добавляем "Помощь" и "Назад"
-                await call.message.edit_text(
-                    f"Объявлений в {city} по вашим фильтрам не найдено. Попробуйте другие фильтры:",
-                    reply_markup=keyboard
-                )
-                await call.answer()
-                return
-
-            logger.debug(f"process_tag_filter: telegram_id={telegram_id}, начало отправки объявлений")
-            await call.message.delete()
-            await call.message.bot.send_message(
-                chat_id=call.from_user.id,
-                text=f"Найдено {len(ads)} объявлений\n" + "―" * 21
-            )
-            for ad in ads:
-                buttons = [[InlineKeyboardButton(
-                    text="В избранное",
-                    callback_data=f"favorite:add:{ad.id}"
-                )]]
-                logger.debug(f"Отправка объявления ID {ad.id} для telegram_id={telegram_id}")
-                await render_ad(ad, call.message.bot, call.from_user.id, show_status=False, buttons=buttons, mark_viewed=True)
-
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="Помощь", callback_data="action:help"),
-                InlineKeyboardButton(text="Добавить своё", callback_data="action:add"),
-                InlineKeyboardButton(text="Назад", callback_data="action:back")
-            ]])
-            await state.update_data(category=category, tags_selected=False)  # Сбрасываем флаг после вывода
-            await call.message.bot.send_message(
-                chat_id=call.from_user.id,
-                text="Режим просмотра объявлений",
+            # Считаем не больше BROWSE_COUNT_LIMIT + 1 строк, чтобы время ответа не росло с числом объявлений
+            matched = select(Advertisement.id).where(*_browse_conditions(browse)).limit(BROWSE_COUNT_LIMIT + 1).subquery()
+            total = await session.scalar(select(func.count()).select_from(matched))
+            logger.debug(f"process_tag_filter: telegram_id={telegram_id}, найдено объявлений: {total}")
+
+        if not total:
+            await state.update_data(tags=[], only_new=False, tags_selected=False)  # Очищаем теги при отсутствии результатов
+            keyboard = browse_tags_keyboard(await get_category_tags(category, city))
+            await call.message.edit_text(
+                f"Объявлений в {city} по вашим фильтрам не найдено. Попробуйте другие фильтры:",
                 reply_markup=keyboard
             )
-            logger.debug(f"Отправлено финальное меню")
-            await call.answer()
\ No newline at end of file
+            await call.answer()
+            return
+
+        logger.debug(f"process_tag_filter: telegram_id={telegram_id}, начало отправки объявлений")
+        await call.message.delete()
+        await call.message.bot.send_message(
+            chat_id=call.from_user.id,
+            text=f"Найдено {f'{BROWSE_COUNT_LIMIT}+' if total > BROWSE_COUNT_LIMIT else total} объявлений\n" + "―" * 21
+        )
+        await state.update_data(category=category, tags_selected=False)  # Сбрасываем флаг после вывода
+        await _send_ads_page(call, state, browse)
+        await call.answer()
+
+
+# Отправляет следующую страницу результатов поиска по курсору из FSM
+@ads_router.callback_query(F.data == "browse:more")
+async def process_browse_more(call: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    browse = data.get("browse")
+    if not browse:
+        logger.debug(f"process_browse_more: нет сохранённого поиска для telegram_id={call.from_user.id}")
+        await call.answer("Поиск устарел, начните заново", show_alert=True)
+        return
+    await call.message.delete()  # Меню с кнопкой переедет под новую страницу
+    await _send_ads_page(call, state, browse)
+    await call.answer()
\ No newline at end of file
@@ -4,10 +4,12 @@ from aiogram.filters import Command
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from states import MenuState, AdAddForm, SubscribeForm, AdsViewForm
-from database import get_db, User, select, Favorite, Advertisement, remove_from_favorites, add_to_favorites, Subscription, get_cities, get_all_category_tags, Tag, ViewedAds
+from database import get_db, User, select, Favorite, Advertisement, remove_from_favorites, add_to_favorites, Subscription, add_subscription, delete_subscription, catalog, Tag, UserIdentity, unseen_ads_condition, count_unseen_for_subscriptions, upsert_user, change_ad_status
 from data.constants import get_main_menu_keyboard
 from data.categories import CATEGORIES
 from tools.utils import render_ad, get_navigation_keyboard
+from tools.keyboards import (subscribe_cities_keyboard, subscribe_other_cities_keyboard, subscribe_tags_keyboard,
+                             NO_SUBSCRIPTIONS_KEYBOARD, SUBSCRIPTIONS_FOOTER_KEYBOARD)
 from loguru import logger
 from sqlalchemy.sql import func
 
@@ -26,25 +28,21 @@ ad_start_keyboard = ReplyKeyboardMarkup(
 
 # Обработчик команды /start для показа главного меню
 @menu_router.message(Command("start"))
-async def start_handler(message: types.Message, state: FSMContext):
+async def start_handler(message: types.Message, state: FSMContext, db_user: UserIdentity | None):
     telegram_id = str(message.from_user.id)
     logger.info(f"Получена команда /start от telegram_id={telegram_id}")
 
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            new_user = User(
-                telegram_id=telegram_id,
-                first_name=message.from_user.first_name,
-                last_name=message.from_user.last_name,
-                username=message.from_user.username
-            )
-            session.add(new_user)
-            await session.commit()
-            logger.info(f"Добавлен новый пользователь с telegram_id={telegram_id}")
-        else:
-            logger.debug(f"Пользователь с telegram_id={telegram_id} уже существует")
+    # Upsert пользователя сбрасывает его запись в кэше
+    await upsert_user(
+        telegram_id,
+        first_name=message.from_user.first_name,
+        last_name=message.from_user.last_name,
+        username=message.from_user.username
+    )
+    if not db_user:
+        logger.info(f"Добавлен новый пользователь с telegram_id={telegram_id}")
+    else:
+        logger.debug(f"Пользователь с telegram_id={telegram_id} уже существует")
 
     await state.set_state(AdsViewForm.select_category)
     logger.debug(f"Отправляем главное меню с клавиатурой: {get_main_menu_keyboard().__class__.__name__}")
@@ -60,45 +58,37 @@ async def help_handler(call: types.CallbackQuery):
 
 # Обработчик команды "Настройки" для отображения меню настроек
 @menu_router.callback_query(F.data == "action:settings")
-async def settings_handler(call: types.CallbackQuery):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if user and user.is_admin:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Модерация", callback_data="admin_moderate")],
-                [InlineKeyboardButton(text="Избранное", callback_data="show_favorites")],
-                [InlineKeyboardButton(text="Мои", callback_data="show_my_ads")],
-                [InlineKeyboardButton(text="📩 Подписки", callback_data="action:subscriptions")],
-                [InlineKeyboardButton(text="⬅️", callback_data="action:back")]
-            ])
-            await call.message.edit_text("Настройки для админа:", reply_markup=keyboard)
-        else:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Избранное", callback_data="show_favorites")],
-                [InlineKeyboardButton(text="Мои", callback_data="show_my_ads")],
-                [InlineKeyboardButton(text="📩 Подписки", callback_data="action:subscriptions")],
-                [InlineKeyboardButton(text="⬅️", callback_data="action:back")]
-            ])
-            await call.message.edit_text("Ваши настройки:", reply_markup=keyboard)
+async def settings_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
+    if db_user and db_user.is_admin:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Модерация", callback_data="admin_moderate")],
+            [InlineKeyboardButton(text="Избранное", callback_data="show_favorites")],
+            [InlineKeyboardButton(text="Мои", callback_data="show_my_ads")],
+            [InlineKeyboardButton(text="📩 Подписки", callback_data="action:subscriptions")],
+            [InlineKeyboardButton(text="⬅️", callback_data="action:back")]
+        ])
+        await call.message.edit_text("Настройки для админа:", reply_markup=keyboard)
+    else:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Избранное", callback_data="show_favorites")],
+            [InlineKeyboardButton(text="Мои", callback_data="show_my_ads")],
+            [InlineKeyboardButton(text="📩 Подписки", callback_data="action:subscriptions")],
+            [InlineKeyboardButton(text="⬅️", callback_data="action:back")]
+        ])
+        await call.message.edit_text("Ваши настройки:", reply_markup=keyboard)
     await call.answer()
 
 
 # Показывает подписки пользователя с кнопками для просмотра новых и всех объявлений
 @menu_router.callback_query(F.data == "action:subscriptions")
-async def subscriptions_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
+async def subscriptions_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    user = db_user
+    if not user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        return
 
     async for session in get_db():
-        # Получаем пользователя
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            return
-
         # Получаем подписки пользователя
         subscriptions_result = await session.execute(
             select(Subscription).where(Subscription.user_id == user.id)
@@ -109,27 +99,17 @@ async def subscriptions_handler(call: types.CallbackQuery, state: FSMContext):
         await call.message.delete()
 
         if not subscriptions:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="➕ Добавить", callback_data="action:subscribe")]
-            ])
-            keyboard.inline_keyboard.extend(get_navigation_keyboard().inline_keyboard)
             await call.message.bot.send_message(
                 chat_id=call.from_user.id,
                 text="У вас нет подписок. Создайте первую подписку!",
-                reply_markup=keyboard
+                reply_markup=NO_SUBSCRIPTIONS_KEYBOARD
             )
         else:
+            # Непросмотренные по всем подпискам считаются одним запросом
+            missed_counts = await count_unseen_for_subscriptions([sub.id for sub in subscriptions])
             # Выводим каждую подписку
             for sub in subscriptions:
-                # Подсчет непросмотренных для подписки
-                missed_count = await session.scalar(
-                    select(func.count(Advertisement.id))
-                    .where(Advertisement.status == "approved")
-                    .where(Advertisement.city == sub.city)
-                    .where(Advertisement.category == sub.category)
-                    .where(~Advertisement.id.in_(select(ViewedAds.advertisement_id).where(ViewedAds.user_id == user.id)))
-                    .where(Advertisement.tags.overlap(sub.tags))
-                )
+                missed_count = missed_counts.get(sub.id, 0)
                 sub_text = (
                     f"Подписка #{sub.id}\n"
                     f"Город: {sub.city}\n"
@@ -149,10 +129,7 @@ async def subscriptions_handler(call: types.CallbackQuery, state: FSMContext):
                 )
 
             # Нижняя строка с кнопками, унифицированная с get_navigation_keyboard
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="➕ Добавить подписку (Пока🔒)", callback_data="disabled")]
-            ])
-            keyboard.inline_keyboard.extend(get_navigation_keyboard().inline_keyboard)
+            keyboard = SUBSCRIPTIONS_FOOTER_KEYBOARD
             await call.message.bot.send_message(
                 chat_id=call.from_user.id,
                 text="Ваши подписки 👆",
@@ -165,22 +142,19 @@ async def subscriptions_handler(call: types.CallbackQuery, state: FSMContext):
 
 # Обрабатывает показ объявлений по подписке: новые (непросмотренные) или все
 @menu_router.callback_query(F.data.startswith(("show_new_ads:", "show_all_ads:")))
-async def show_subscription_ads(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
+async def show_subscription_ads(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
     callback_data = call.data
     action, sub_id = callback_data.split(":", 1)
     sub_id = int(sub_id)
     only_new = action == "show_new_ads"  # True для "Новые", False для "Все"
 
-    async for session in get_db():
-        # Получаем пользователя
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            return
+    user = db_user
+    if not user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        return
 
+    async for session in get_db():
         # Получаем подписку
         sub_result = await session.execute(
             select(Subscription).where(Subscription.id == sub_id, Subscription.user_id == user.id)
@@ -199,9 +173,7 @@ async def show_subscription_ads(call: types.CallbackQuery, state: FSMContext):
             Advertisement.tags.overlap(subscription.tags)
         )
         if only_new:
-            query = query.where(~Advertisement.id.in_(
-                select(ViewedAds.advertisement_id).where(ViewedAds.user_id == user.id)
-            ))
+            query = query.where(unseen_ads_condition(user.id))
 
         ads_result = await session.execute(query.order_by(Advertisement.id))
         ads = ads_result.scalars().all()
@@ -227,7 +199,7 @@ async def show_subscription_ads(call: types.CallbackQuery, state: FSMContext):
                     text="В избранное",
                     callback_data=f"favorite:add:{ad.id}"
                 )]]
-                await render_ad(ad, call.message.bot, call.from_user.id, show_status=False, buttons=buttons, mark_viewed=True)
+                await render_ad(ad, call.message.bot, call.from_user.id, show_status=False, buttons=buttons, mark_viewed=True, compact=True)
 
             # Добавляем навигацию
             keyboard = get_navigation_keyboard()
@@ -240,6 +212,21 @@ async def show_subscription_ads(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
+# Удаляет подписку пользователя вместе с её сообщением
+@menu_router.callback_query(F.data.startswith("delete_subscription:"))
+async def delete_subscription_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
+    if not db_user:
+        await call.answer("Пользователь не найден. Используйте /start.", show_alert=True)
+        return
+    sub_id = int(call.data.split(":")[1])
+    if await delete_subscription(db_user.id, sub_id):
+        logger.info(f"Подписка #{sub_id} удалена пользователем user_id={db_user.id}")
+        await call.message.delete()
+        await call.answer("Подписка удалена")
+    else:
+        await call.answer("Подписка не найдена", show_alert=True)
+
+
 # Обработчик для неактивной кнопки "Пока недоступно"
 @menu_router.callback_query(F.data == "disabled")
 async def disabled_button_handler(call: types.CallbackQuery):
@@ -248,32 +235,14 @@ async def disabled_button_handler(call: types.CallbackQuery):
 
 # Обработчик начала создания подписки
 @menu_router.callback_query(F.data == "action:subscribe")
-async def subscribe_start_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
-            return
+async def subscribe_start_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
+        return
 
-        # Получаем список городов из базы
-        cities = await get_cities()
-        main_cities = ["Тбилиси", "Батуми", "Кутаиси", "Гори"]  # Основные города для первого экрана
-        buttons = [
-            InlineKeyboardButton(text=city, callback_data=f"subscribe_city:{city}")
-            for city in main_cities if city in cities
-        ]
-        keyboard_rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]  # По 2 кнопки в ряд
-        keyboard_rows.append([
-            InlineKeyboardButton(text="Другие города", callback_data="subscribe_city_other"),
-            InlineKeyboardButton(text="❓", callback_data="help:subscribe_city"),
-            InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
-        ])
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-        await call.message.edit_text("Выберите город для подписки:", reply_markup=keyboard)
-        await state.set_state("SubscribeForm:select_city")
-        await call.answer()
+    await call.message.edit_text("Выберите город для подписки:", reply_markup=subscribe_cities_keyboard())
+    await state.set_state("SubscribeForm:select_city")
+    await call.answer()
 
 
 # Добавьте этот импорт в начало файла, если его там ещё нет
@@ -282,48 +251,25 @@ from aiogram.filters import StateFilter
 
 # Обработчик выбора "Другие города" для подписки
 @menu_router.callback_query(F.data == "subscribe_city_other", StateFilter("SubscribeForm:select_city"))
-async def subscribe_city_other_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
-
-        # Получаем список городов из базы
-        cities = await get_cities()
-        main_cities = ["Тбилиси", "Батуми", "Кутаиси", "Гори"]  # Основные города, которые уже показаны
-        other_cities = [city for city in cities.keys() if city not in main_cities]
-        buttons = [
-            InlineKeyboardButton(text=city, callback_data=f"subscribe_city:{city}")
-            for city in other_cities
-        ]
-        keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]  # По 3 кнопки в ряд
-        keyboard_rows.append([
-            InlineKeyboardButton(text="❓", callback_data="help:subscribe_city"),
-            InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
-        ])
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+async def subscribe_city_other_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
-        await call.message.edit_text("Выберите другой город для подписки:", reply_markup=keyboard)
-        await call.answer()
+    await call.message.edit_text("Выберите другой город для подписки:", reply_markup=subscribe_other_cities_keyboard())
+    await call.answer()
 
 
 # Обработчик выбора конкретного города для подписки
 @menu_router.callback_query(F.data.startswith("subscribe_city:"), StateFilter("SubscribeForm:select_city"))
-async def subscribe_city_select_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
+async def subscribe_city_select_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
     # Извлекаем выбранный город из callback_data
     city = call.data.split(":", 1)[1]
@@ -348,51 +294,30 @@ async def subscribe_city_select_handler(call: types.CallbackQuery, state: FSMCon
 
 # Обработчик выбора категории для подписки
 @menu_router.callback_query(F.data.startswith("subscribe_category:"), StateFilter("SubscribeForm:select_category"))
-async def subscribe_category_select_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
+async def subscribe_category_select_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
     # Извлекаем выбранную категорию из callback_data
     category = call.data.split(":", 1)[1]
     await state.update_data(category=category)
 
-    # Получаем теги для категории
-    tags = await get_all_category_tags(category)
-    buttons = [
-        InlineKeyboardButton(text=name, callback_data=f"subscribe_tag:{id}")
-        for id, name in tags
-    ]
-    keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]  # По 3 кнопки в ряд
-    keyboard_rows.append([
-        InlineKeyboardButton(text="❓", callback_data="help:subscribe_tags"),
-        InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
-    ])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-
-    await call.message.edit_text("Выберите до 3 тегов для подписки:", reply_markup=keyboard)
+    await call.message.edit_text("Выберите до 3 тегов для подписки:", reply_markup=subscribe_tags_keyboard(category))
     await state.set_state(SubscribeForm.select_tags)
     await call.answer()
 
 
 # Обработчик выбора тегов для подписки
 @menu_router.callback_query(F.data.startswith("subscribe_tag:"), StateFilter("SubscribeForm:select_tags"))
-async def subscribe_tag_select_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
+async def subscribe_tag_select_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
     # Извлекаем ID тега из callback_data
     tag_id = int(call.data.split(":", 1)[1])
@@ -404,28 +329,12 @@ async def subscribe_tag_select_handler(call: types.CallbackQuery, state: FSMCont
         await call.answer("Вы выбрали максимум 3 тега", show_alert=True)
         return
 
-    # Получаем информацию о теге
-    async for session in get_db():
-        result = await session.execute(select(Tag).where(Tag.id == tag_id))
-        tag = result.scalar_one_or_none()
-        if tag and tag.name not in tags:
-            tags.append(tag.name)
-            await state.update_data(tags=tags)
-
-    # Получаем все теги для категории
-    all_tags = await get_all_category_tags(category)
-    buttons = [
-        InlineKeyboardButton(text=name, callback_data=f"subscribe_tag:{id}")
-        for id, name in all_tags
-    ]
-    keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
-    if tags:  # Добавляем "Сохранить", если выбран хотя бы один тег
-        keyboard_rows.append([InlineKeyboardButton(text="💾 Сохранить", callback_data="subscribe_confirm")])
-    keyboard_rows.append([
-        InlineKeyboardButton(text="❓", callback_data="help:subscribe_tags"),
-        InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
-    ])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+    tag = catalog.tag(tag_id)
+    if tag and tag.name not in tags:
+        tags.append(tag.name)
+        await state.update_data(tags=tags)
+
+    keyboard = subscribe_tags_keyboard(category, with_save=bool(tags))  # "Сохранить", если выбран хотя бы один тег
 
     await call.message.edit_text(
         f"Выбрано: {', '.join(tags) if tags else 'ничего'}\nВыберите до 3 тегов или сохраните:",
@@ -436,16 +345,12 @@ async def subscribe_tag_select_handler(call: types.CallbackQuery, state: FSMCont
 
 # Обработчик подтверждения подписки
 @menu_router.callback_query(F.data == "subscribe_confirm", StateFilter("SubscribeForm:select_tags"))
-async def subscribe_confirm_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.",
-                                         reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
+async def subscribe_confirm_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    if not db_user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.",
+                                     reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
     # Получаем данные из состояния
     data = await state.get_data()
@@ -475,32 +380,22 @@ async def subscribe_confirm_handler(call: types.CallbackQuery, state: FSMContext
 
 # Обработчик сохранения подписки
 @menu_router.callback_query(F.data == "save_subscription", StateFilter("SubscribeForm:confirm"))
-async def save_subscription_handler(call: types.CallbackQuery, state: FSMContext):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        # Проверяем пользователя
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
-            await state.clear()
-            return
+async def save_subscription_handler(call: types.CallbackQuery, state: FSMContext, db_user: UserIdentity | None):
+    user = db_user
+    if not user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
 
-        # Получаем данные из состояния
-        data = await state.get_data()
-        city = data.get("city")
-        category = data.get("category")
-        tags = data.get("tags", [])
-
-        # Создаём подписку
-        subscription = Subscription(
-            user_id=user.id,
-            city=city,
-            category=category,
-            tags=tags
-        )
-        session.add(subscription)
-        await session.commit()
+    # Получаем данные из состояния
+    data = await state.get_data()
+    city = data.get("city")
+    category = data.get("category")
+    tags = data.get("tags", [])
+
+    # Создаём подписку, она сразу попадает в индекс рассылки
+    subscription_id = await add_subscription(user, city, category, tags)
+    logger.info(f"Сохранена подписка #{subscription_id} для user_id={user.id}")
 
     # Показываем сообщение и возвращаем в меню подписок
     keyboard = InlineKeyboardMarkup(inline_keyboard=[[
@@ -512,15 +407,13 @@ async def save_subscription_handler(call: types.CallbackQuery, state: FSMContext
 
 
 @menu_router.callback_query(F.data == "show_my_ads")
-async def show_my_ads_handler(call: types.CallbackQuery):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
-            return
+async def show_my_ads_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
+    user = db_user
+    if not user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
+        return
 
+    async for session in get_db():
         ads_result = await session.execute(
             select(Advertisement)
             .where(Advertisement.user_id == user.id, Advertisement.status.in_(["approved", "pending"]))
@@ -540,7 +433,7 @@ async def show_my_ads_handler(call: types.CallbackQuery):
 
         for ad in ads:
             buttons = [[InlineKeyboardButton(text="Удалить", callback_data=f"delete_ad:{ad.id}")]]
-            await render_ad(ad, call.message.bot, call.from_user.id, show_status=True, buttons=buttons, mark_viewed=True)
+            await render_ad(ad, call.message.bot, call.from_user.id, show_status=True, buttons=buttons, mark_viewed=True, compact=True)
 
         back_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
             InlineKeyboardButton(text="Помощь", callback_data="action:help"),
@@ -556,17 +449,16 @@ async def show_my_ads_handler(call: types.CallbackQuery):
 
 
 @menu_router.callback_query(F.data.startswith("delete_ad:"))
-async def delete_ad_handler(call: types.CallbackQuery):
+async def delete_ad_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
     telegram_id = str(call.from_user.id)
     ad_id = int(call.data.split(":")[1])
 
-    async for session in get_db():
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.answer("Пользователь не найден.", show_alert=True)
-            return
+    user = db_user
+    if not user:
+        await call.answer("Пользователь не найден.", show_alert=True)
+        return
 
+    async for session in get_db():
         ad_result = await session.execute(
             select(Advertisement).where(Advertisement.id == ad_id, Advertisement.user_id == user.id)
         )
@@ -575,8 +467,7 @@ async def delete_ad_handler(call: types.CallbackQuery):
             await call.answer("Объявление не найдено или вам не принадлежит.", show_alert=True)
             return
 
-        ad.status = "deleted"
-        await session.commit()
+        await change_ad_status(session, ad, "deleted")
         logger.info(f"Пользователь {telegram_id} пометил объявление #{ad_id} как удалённое")
 
         await call.answer("Объявление помечено как удалённое!", show_alert=True)
@@ -607,15 +498,13 @@ async def delete_ad_handler(call: types.CallbackQuery):
             )
 
 @menu_router.callback_query(F.data == "show_favorites")
-async def show_favorites_handler(call: types.CallbackQuery):
-    telegram_id = str(call.from_user.id)
-    async for session in get_db():
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
-            return
+async def show_favorites_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
+    user = db_user
+    if not user:
+        await call.message.edit_text("Пользователь не найден. Используйте /start.", reply_markup=get_main_menu_keyboard())
+        return
 
+    async for session in get_db():
         favorites = await session.execute(
             select(Favorite).where(Favorite.user_id == user.id)
         )
@@ -645,7 +534,7 @@ async def show_favorites_handler(call: types.CallbackQuery):
                     text="Удалить из избранного",
                     callback_data=f"favorite:remove:{ad.id}"
                 )]]
-                await render_ad(ad, call.message.bot, call.from_user.id, show_status=True, buttons=buttons, mark_viewed=True)
+                await render_ad(ad, call.message.bot, call.from_user.id, show_status=True, buttons=buttons, mark_viewed=True, compact=True)
             else:
                 text = f"Объявление больше не доступно"
                 remove_button = InlineKeyboardButton(
@@ -674,43 +563,37 @@ async def show_favorites_handler(call: types.CallbackQuery):
     await call.answer()
 
 @menu_router.callback_query(F.data.startswith("favorite:remove:"))
-async def remove_from_favorites_handler(call: types.CallbackQuery):
+async def remove_from_favorites_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
     telegram_id = str(call.from_user.id)
     _, action, ad_id = call.data.split(":", 2)
     ad_id = int(ad_id)
 
-    async for session in get_db():
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.answer("Пользователь не найден.", show_alert=True)
-            return
+    if not db_user:
+        await call.answer("Пользователь не найден.", show_alert=True)
+        return
 
-        if await remove_from_favorites(user.id, ad_id):
-            logger.info(f"Пользователь {telegram_id} удалил объявление #{ad_id} из избранного")
-            await call.answer("Удалено из избранного!", show_alert=True)
-        else:
-            await call.answer("Объявление не найдено в избранном.", show_alert=True)
+    if await remove_from_favorites(db_user.id, ad_id):
+        logger.info(f"Пользователь {telegram_id} удалил объявление #{ad_id} из избранного")
+        await call.answer("Удалено из избранного!", show_alert=True)
+    else:
+        await call.answer("Объявление не найдено в избранном.", show_alert=True)
 
-    await show_favorites_handler(call)
+    await show_favorites_handler(call, db_user)
 
 
 # Добавляет объявление в избранное пользователя
 @menu_router.callback_query(F.data.startswith("favorite:add:"))
-async def add_to_favorites_handler(call: types.CallbackQuery):
+async def add_to_favorites_handler(call: types.CallbackQuery, db_user: UserIdentity | None):
     telegram_id = str(call.from_user.id)
     ad_id = int(call.data.split(":", 2)[2])
 
-    async for session in get_db():
-        user_result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            await call.answer("Пользователь не найден.", show_alert=True)
-            return
+    if not db_user:
+        await call.answer("Пользователь не найден.", show_alert=True)
+        return
 
-        favorite_id = await add_to_favorites(user.id, ad_id)
-        logger.info(f"Пользователь {telegram_id} добавил объявление #{ad_id} в избранное, favorite_id={favorite_id}")
-        await call.answer("Добавлено в избранное!", show_alert=True)
+    favorite_id = await add_to_favorites(db_user.id, ad_id)
+    logger.info(f"Пользователь {telegram_id} добавил объявление #{ad_id} в избранное, favorite_id={favorite_id}")
+    await call.answer("Добавлено в избранное!", show_alert=True)
 
 
 @menu_router.callback_query(F.data == "action:back")
@@ -2,25 +2,38 @@
 # Основной файл для запуска бота Froggle
 import asyncio
 from aiogram import Bot, Dispatcher, types
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command
 from loguru import logger
 from config import BOT_TOKEN
-from database import init_db, get_db, Subscription, Advertisement, ViewedAds, User, select
+import config
+from database import init_db, engine, viewed_ads_buffer, load_subscription_index, load_catalog, get_db, Subscription, Advertisement, ViewedAds, User, select
 from handlers.ads_handler import ads_router
 from handlers.menu_handler import menu_router
 from handlers.ad_handler import ad_router
 from handlers.admin_handler import admin_router
 from states import AdsViewForm
 from data.constants import get_main_menu_keyboard
+from tools.middlewares import UserMiddleware
+from tools.rate_limiter import outbound_limiter
+from tools.retry import telegram_retry
+from tools.digest import digest_sender
+from tools.fanout import fanout_worker
+from tools.webhook import run_webhook
+from tools.fsm_storage import fsm_storage
+from tools.scheduler import user_scheduler
+from tools.catalog_refresh import catalog_refresher
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey  # Исправленный импорт
 
 logger.add("logs/froggle.log", rotation="10MB", compression="zip", level="DEBUG")
 
+BOT_MODE = getattr(config, "BOT_MODE", "polling")  # "polling" или "webhook"
+
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-dp = Dispatcher(storage=MemoryStorage())
+bot.session.middleware(telegram_retry)  # Повтор при RetryAfter, сетевых ошибках и 5xx; подключается первым
+bot.session.middleware(outbound_limiter)  # Лимиты Telegram на отправку
+dp = Dispatcher(storage=fsm_storage)
 
 # Middleware для логирования callback-запросов
 async def log_callback_middleware(handler, event: types.CallbackQuery, data: dict):
@@ -58,6 +71,8 @@ async def clean_notification(handler, event, data):
     return await handler(event, data)
 
 # Регистрация middleware после определения dp
+dp.update.outer_middleware(user_scheduler)  # Апдейты одного пользователя по очереди, разных — параллельно
+dp.update.outer_middleware(UserMiddleware())  # Пользователь БД определяется один раз на апдейт
 dp.callback_query.outer_middleware(log_callback_middleware)
 dp.callback_query.middleware(clean_notification)
 dp.message.middleware(clean_notification)
@@ -65,6 +80,8 @@ dp.message.middleware(clean_notification)
 async def main():
     logger.info("Запуск бота Froggle...")
     await init_db()
+    await load_subscription_index()
+    await load_catalog()  # Теги и города для клавиатур держим в памяти
     dp.include_router(ads_router)
     logger.debug("Подключен ads_router")
     dp.include_router(menu_router)
@@ -73,9 +90,27 @@ async def main():
     logger.debug("Подключен ad_router")
     dp.include_router(admin_router)
     logger.debug("Подключен admin_router")
-    logger.info("Бот успешно настроен, начинаем polling...")
-    # asyncio.create_task(notify_subscribers())  # Закомментирован нотификатор
-    await dp.start_polling(bot, skip_updates=True)
+    logger.info(f"Бот успешно настроен, режим {BOT_MODE}")
+    viewed_ads_buffer.start()
+    fsm_storage.start()  # Отложенная запись состояний FSM в базу
+    digest_sender.start(bot, dp.storage)
+    fanout_worker.start()  # Рассылка по одобренным объявлениям в фоне
+    catalog_refresher.start()  # Изменения справочников из других процессов и скриптов заполнения
+    try:
+        if BOT_MODE == "webhook":
+            # Несколько процессов за балансировщиком — только с UPDATE_SHARED_LOCK (см. run_webhook)
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)  # Иначе getUpdates конфликтует с вебхуком
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await catalog_refresher.stop()
+        await fanout_worker.stop()
+        await digest_sender.stop()
+        await viewed_ads_buffer.stop()  # Дописываем накопленные отметки просмотра
+        await fsm_storage.close()  # Дописываем несохранённые состояния FSM
+        await bot.session.close()
+        await engine.dispose()  # Закрываем соединения пула при остановке
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,102 @@
+# tools/ad_draft.py
+# Черновик объявления в мастере добавления: читается из FSM один раз на апдейт и записывается одним update_data
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+from database import Advertisement
+from tools.utils import format_ad_text
+
+
+@dataclass(slots=True)
+class AdDraft:
+    """
+    Поля мастера добавления объявления, хранятся в данных FSM под теми же ключами, что и раньше.
+
+    Изменённые поля запоминаются при присваивании, поэтому списки нужно присваивать целиком
+    (draft.tags = [...]), а не менять на месте. Остальные ключи FSM (меню, просмотр) не трогаются.
+    """
+
+    category: Optional[str] = None
+    city: Optional[str] = None
+    tags: list[str] = field(default_factory=list)
+    title: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[str] = None
+    media_file_ids: list[dict] = field(default_factory=list)
+    media_message_id: Optional[int] = None
+    selected_contact: Optional[str] = None
+    contacts: Optional[str] = None
+    _changed: set[str] = field(default_factory=set, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if not name.startswith("_") and hasattr(self, "_changed"):  # _changed создаётся последним в __init__
+            self._changed.add(name)
+
+    @classmethod
+    def from_data(cls, data: dict) -> "AdDraft":
+        return cls(**{f.name: data[f.name] for f in fields(cls) if not f.name.startswith("_") and data.get(f.name) is not None})
+
+    @classmethod
+    async def load(cls, state: FSMContext) -> "AdDraft":
+        return cls.from_data(await state.get_data())
+
+    def changes(self) -> dict:
+        return {name: getattr(self, name) for name in self._changed}
+
+    async def save(self, state: FSMContext) -> None:
+        """Записывает изменённые поля одним update_data; без изменений в хранилище не обращается."""
+        if self._changed:
+            await state.update_data(self.changes())
+            self._changed.clear()
+
+    def to_ad(self) -> Advertisement:
+        """Временный объект объявления для format_ad_text и render_ad (в сессию не добавляется)."""
+        return Advertisement(
+            category=self.category,
+            city=self.city,
+            tags=self.tags,
+            title_ru=self.title,
+            description_ru=self.description,
+            price=self.price,
+            media_file_ids=self.media_file_ids,
+            contact_info=self.contacts or self.selected_contact
+        )
+
+    def media_line(self) -> str:
+        count = len(self.media_file_ids)
+        if not count:
+            return "Медиа: не загружено"
+        return f"Медиа: {count} файл{'а' if 2 <= count <= 4 else 'ов' if count >= 5 else ''}"
+
+    def preview(self, *fields_: str, media: bool = False, prompt: Optional[str] = None) -> str:
+        """
+        Превью черновика для текущего шага мастера.
+
+        Args:
+            fields_: Уже заполненные поля для format_ad_text (title, description, price, contacts).
+            media: Добавить строку с количеством загруженных файлов.
+            prompt: Подсказка следующего шага в конце превью.
+        """
+        lines = ["Ваше объявление:"] + format_ad_text(self.to_ad(), fields=list(fields_), complete=False)
+        if media:
+            lines.append(self.media_line())
+        if prompt:
+            lines.append(prompt)
+        return "\n".join(lines)
+
+
+class AdDraftMiddleware(BaseMiddleware):
+    """Передаёт хэндлерам ad_router черновик как draft и сохраняет его изменения после хэндлера."""
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        state: FSMContext | None = data.get("state")
+        if state is None:
+            return await handler(event, data)
+        draft = await AdDraft.load(state)
+        data["draft"] = draft
+        result = await handler(event, data)
+        await draft.save(state)
+        return result
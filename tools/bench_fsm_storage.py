@@ -0,0 +1,70 @@
+# tools/bench_fsm_storage.py
+# Сравнивает MemoryStorage и PostgresStorage на типичной нагрузке хэндлеров (чтение состояния и данных, update_data)
+# Запуск из корня проекта: python tools/bench_fsm_storage.py --users 200 --steps 50
+# Ключи пишутся в fsm_states с bot_id=-1 и удаляются после замера, рабочие состояния не затрагиваются
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete
+from database import AsyncSessionLocal, FsmState, engine
+from tools.fsm_storage import PostgresStorage
+
+BENCH_BOT_ID = -1
+
+
+async def simulate_user(storage: BaseStorage, user_id: int, steps: int, latencies: list[float]) -> None:
+    state = FSMContext(storage=storage, key=StorageKey(bot_id=BENCH_BOT_ID, chat_id=user_id, user_id=user_id))
+    await state.set_state("AdForm:title")
+    for step in range(steps):
+        started = time.perf_counter()
+        # Примерно то, что делает хэндлер мастера объявления: проверка состояния, чтение и дополнение данных
+        await state.get_state()
+        data = await state.get_data()
+        await state.update_data(step=step, tags=data.get("tags", [])[-5:] + [f"тег{step}"], media_file_ids=[{"id": f"f{step}"}])
+        latencies.append(time.perf_counter() - started)
+    await state.clear()
+
+
+async def run(name: str, storage: BaseStorage, users: int, steps: int) -> None:
+    latencies: list[float] = []
+    if isinstance(storage, PostgresStorage) and storage.cache_ttl:
+        storage.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(storage, user_id, steps, latencies) for user_id in range(1, users + 1)))
+    await storage.close()  # В замер входит дописывание отложенных изменений
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:<36} {elapsed:8.2f} с {len(latencies) / elapsed:10.0f} шагов/с   p50 {p50:7.2f} мс   p99 {p99:7.2f} мс")
+    if isinstance(storage, PostgresStorage):
+        print(f"{'':<36} {storage.stats()}")
+
+
+async def main(users: int, steps: int) -> None:
+    print(f"Пользователей: {users}, шагов на пользователя: {steps}")
+    try:
+        await run("MemoryStorage", MemoryStorage(), users, steps)
+        await run("PostgresStorage (кэш + отложенная запись)", PostgresStorage(), users, steps)
+        await run("PostgresStorage (без кэша, запись сразу)", PostgresStorage(cache_ttl=0), users, steps)
+    finally:
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(FsmState).where(FsmState.key.like(f"fsm:{BENCH_BOT_ID}:%")))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение хранилищ FSM")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.steps))
@@ -0,0 +1,156 @@
+# tools/bench_indexes.py
+# Сравнивает планы горячих запросов до и после индексов на синтетических данных
+# Запуск из корня проекта: python tools/bench_indexes.py --ads 200000
+# Все таблицы создаются во временной схеме и удаляются после замера, рабочие данные не затрагиваются
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import MetaData, text
+from loguru import logger
+from database import Base, engine
+from data.categories import CATEGORIES
+
+SCHEMA = "bench_indexes"
+TABLES = ["users", "advertisements", "subscriptions", "viewed_ads", "favorites"]
+# Индексы из миграции 7d8eba557cc6, которые сравниваем
+HOT_INDEXES = {
+    "ix_advertisements_category_city_status_id",
+    "ix_advertisements_status_id",
+    "ix_advertisements_tags_gin",
+    "ix_subscriptions_city_category",
+    "ix_subscriptions_user_id",
+    "ix_subscriptions_tags_gin",
+    "ux_viewed_ads_user_id_advertisement_id",
+    "ux_favorites_user_id_advertisement_id",
+}
+CITIES = ["Тбилиси", "Батуми", "Кутаиси", "Гори", "Рустави", "Зугдиди", "Поти", "Телави"]
+TAGS = [f"тег{i}" for i in range(40)]
+
+QUERIES = {
+    "Просмотр: категория/город/статус + теги": f"""
+        SELECT * FROM {SCHEMA}.advertisements
+        WHERE category = 'housing' AND city = 'Батуми' AND status = 'approved'
+          AND tags && ARRAY['тег1', 'тег2']::varchar[]
+        ORDER BY id LIMIT 20
+    """,
+    "Только новые (NOT IN viewed_ads)": f"""
+        SELECT count(*) FROM {SCHEMA}.advertisements
+        WHERE category = 'housing' AND city = 'Батуми' AND status = 'approved'
+          AND id NOT IN (SELECT advertisement_id FROM {SCHEMA}.viewed_ads WHERE user_id = 7)
+    """,
+    "Подбор подписок при одобрении": f"""
+        SELECT id, user_id FROM {SCHEMA}.subscriptions
+        WHERE city = 'Батуми' AND category = 'housing' AND tags && ARRAY['тег1', 'тег3']::varchar[]
+    """,
+    "Очередь модерации": f"""
+        SELECT * FROM {SCHEMA}.advertisements WHERE status = 'pending' ORDER BY id
+    """,
+    "Избранное пользователя": f"""
+        SELECT * FROM {SCHEMA}.favorites WHERE user_id = 7 AND advertisement_id = 100
+    """,
+}
+
+
+def _bench_metadata() -> MetaData:
+    bench_metadata = MetaData(schema=SCHEMA)
+    for name in TABLES:
+        Base.metadata.tables[name].to_metadata(bench_metadata)
+    return bench_metadata
+
+
+def _hot_indexes(bench_metadata: MetaData):
+    return [index for table in bench_metadata.sorted_tables for index in table.indexes if index.name in HOT_INDEXES]
+
+
+async def seed(conn, users: int, ads: int, subscriptions: int, views: int) -> None:
+    categories = "ARRAY[" + ", ".join(f"'{cat}'" for cat in CATEGORIES) + "]"
+    cities = "ARRAY[" + ", ".join(f"'{city}'" for city in CITIES) + "]"
+    tags = "ARRAY[" + ", ".join(f"'{tag}'" for tag in TAGS) + "]::varchar[]"
+    pick_tags = f"ARRAY[({tags})[1 + floor(random() * {len(TAGS)})::int], ({tags})[1 + floor(random() * {len(TAGS)})::int]]"
+
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.users (telegram_id, first_name, is_admin)
+        SELECT g::text, 'user' || g, false FROM generate_series(1, {users}) g
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.advertisements (user_id, category, city, tags, title_ru, description_ru, status, created_at, is_test)
+        SELECT 1 + floor(random() * {users})::int,
+               ({categories})[1 + floor(random() * {len(CATEGORIES)})::int],
+               ({cities})[1 + floor(random() * {len(CITIES)})::int],
+               {pick_tags},
+               'title ' || g, 'description ' || g,
+               CASE WHEN random() < 0.9 THEN 'approved' WHEN random() < 0.5 THEN 'pending' ELSE 'rejected' END,
+               now(), false
+        FROM generate_series(1, {ads}) g
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.subscriptions (user_id, city, category, tags, created_at)
+        SELECT 1 + floor(random() * {users})::int,
+               ({cities})[1 + floor(random() * {len(CITIES)})::int],
+               ({categories})[1 + floor(random() * {len(CATEGORIES)})::int],
+               {pick_tags}, now()
+        FROM generate_series(1, {subscriptions}) g
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.viewed_ads (user_id, advertisement_id)
+        SELECT DISTINCT 1 + floor(random() * {users})::int, 1 + floor(random() * {ads})::int
+        FROM generate_series(1, {views}) g
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.favorites (user_id, advertisement_id, added_at)
+        SELECT DISTINCT 1 + floor(random() * {users})::int, 1 + floor(random() * {ads})::int, now()
+        FROM generate_series(1, {views // 10}) g
+    """))
+    for name in TABLES:
+        await conn.execute(text(f"ANALYZE {SCHEMA}.{name}"))
+
+
+async def explain_all(conn, title: str) -> None:
+    print(f"\n{'=' * 30} {title} {'=' * 30}")
+    for name, query in QUERIES.items():
+        result = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"))
+        print(f"\n--- {name}")
+        for (line,) in result.all():
+            print(line)
+
+
+async def main(users: int, ads: int, subscriptions: int, views: int) -> None:
+    bench_metadata = _bench_metadata()
+    hot_indexes = _hot_indexes(bench_metadata)
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.run_sync(bench_metadata.create_all)
+        for index in hot_indexes:
+            await conn.run_sync(index.drop)
+    try:
+        async with engine.begin() as conn:
+            logger.info(f"Заполнение: users={users}, ads={ads}, subscriptions={subscriptions}, views={views}")
+            await seed(conn, users, ads, subscriptions, views)
+        async with engine.connect() as conn:
+            await explain_all(conn, "БЕЗ индексов")
+        async with engine.begin() as conn:
+            for index in hot_indexes:
+                await conn.run_sync(index.create)
+            for name in TABLES:
+                await conn.execute(text(f"ANALYZE {SCHEMA}.{name}"))
+        async with engine.connect() as conn:
+            await explain_all(conn, "С индексами")
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Планы запросов до и после индексов горячих путей")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--ads", type=int, default=200000)
+    parser.add_argument("--subscriptions", type=int, default=20000)
+    parser.add_argument("--views", type=int, default=500000)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.ads, args.subscriptions, args.views))
@@ -0,0 +1,78 @@
+# tools/catalog.py
+# Справочники в памяти: теги по категориям и города, чтобы не ходить в tags и cities на каждый клик
+from collections import defaultdict
+from typing import Iterable, NamedTuple, Optional
+
+
+class TagEntry(NamedTuple):
+    id: int
+    name: str
+    category: str
+    is_primary: bool
+    order: int
+
+
+class Catalog:
+    """
+    Теги и города из сидов (tools/fill_*.py), разложенные для быстрых выборок.
+
+    Таблицы меняются только скриптами заполнения, поэтому каталог строится при старте бота
+    и перестраивается целиком: в каждом процессе — когда меняется mark (см. refresh_catalog),
+    в процессе администратора — сразу по команде /reload_catalog.
+    Методы возвращают новые списки и словари, их можно менять без вреда для каталога.
+    """
+
+    def __init__(self):
+        self._tags: dict[int, TagEntry] = {}
+        self._by_category: dict[str, list[TagEntry]] = {}
+        self._primary: dict[str, list[str]] = {}
+        self._cities: dict[str, int] = {}
+        self.loaded = False
+        self.reloads = 0
+        self.version = 0  # Растёт при каждой перестройке, входит в ключи кэшированных клавиатур
+        self.mark: tuple | None = None  # Отпечаток таблиц tags и cities, по которому каталог построен
+
+    def rebuild(self, tags: Iterable[TagEntry], cities: Iterable[tuple[str, int]], mark: tuple | None = None) -> None:
+        by_category: dict[str, list[TagEntry]] = defaultdict(list)
+        tags_by_id = {}
+        for tag in tags:
+            tags_by_id[tag.id] = tag
+            by_category[tag.category].append(tag)
+        for entries in by_category.values():
+            entries.sort(key=lambda tag: (tag.order, tag.id))
+        # Подмена целыми словарями: хэндлеры не увидят каталог в середине перестройки
+        self._tags = tags_by_id
+        self._by_category = dict(by_category)
+        self._primary = {
+            category: [tag.name for tag in entries if tag.is_primary] for category, entries in by_category.items()
+        }
+        self._cities = dict(cities)
+        self.mark = mark
+        if self.loaded:
+            self.reloads += 1
+        self.loaded = True
+        self.version += 1
+
+    def category_tags(self, category: str) -> list[tuple[int, str]]:
+        """Все теги категории (id, имя) в порядке поля order — как get_all_category_tags."""
+        return [(tag.id, tag.name) for tag in self._by_category.get(category, ())]
+
+    def tag(self, tag_id: int) -> Optional[TagEntry]:
+        return self._tags.get(tag_id)
+
+    def primary_tags(self, category: str) -> list[str]:
+        """Имена обязательных тегов категории; пустой список, если обязательных нет."""
+        return list(self._primary.get(category, ()))
+
+    def cities(self) -> dict[str, int]:
+        """Все города: имя -> id, в порядке id — как get_cities() без категории."""
+        return dict(self._cities)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "tags": len(self._tags),
+            "categories": len(self._by_category),
+            "cities": len(self._cities),
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,49 @@
+# tools/catalog_refresh.py
+# Периодическая сверка справочников с базой: каждый процесс бота сам подхватывает изменённые теги и города
+import asyncio
+from typing import Optional
+from loguru import logger
+from database import refresh_catalog
+import config
+
+
+class CatalogRefresher:
+    """
+    Раз в interval секунд сверяет отпечаток tags и cities с базой и при изменении перестраивает каталог.
+
+    Каталог свой у каждого процесса, а /reload_catalog попадает только в один воркер вебхука,
+    поэтому остальные процессы догоняют его не позже чем через interval. Новая версия каталога
+    меняет ключи кэшированных клавиатур, так что старые клавиатуры больше не отдаются.
+    """
+
+    def __init__(self, interval: float = 60):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.errors = 0
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await refresh_catalog():
+                    logger.info("Справочники изменились в базе, каталог перестроен")
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка сверки справочников: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Сверка справочников запущена (каждые {self.interval} с)")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+catalog_refresher = CatalogRefresher(interval=getattr(config, "CATALOG_REFRESH_INTERVAL", 60))
@@ -0,0 +1,111 @@
+# tools/digest.py
+# Отправка дайджестов подписчикам: одно уведомление на пользователя за окно вместо сообщения на каждое одобрение
+import asyncio
+from collections import defaultdict
+from typing import Optional
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from loguru import logger
+from database import claim_due_digests, delete_digests, count_unseen_for_subscriptions, subscription_index, refresh_subscription_index
+from data.categories import CATEGORIES
+from tools.rate_limiter import bulk_priority
+from tools.scheduler import user_scheduler
+from tools.utils import notify_user
+import config
+
+# Сколько секунд копятся события по подписке до отправки дайджеста
+DIGEST_WINDOW = getattr(config, "DIGEST_WINDOW", 300)
+
+
+def format_digest(counts: dict[int, int]) -> str:
+    lines = ["🔔 Новые объявления по подпискам:"]
+    for sub_id, count in counts.items():
+        sub = subscription_index.get(sub_id)
+        label = f"{sub.city}, {CATEGORIES[sub.category]['display_name']} ({', '.join(sub.tags)})" if sub else f"#{sub_id}"
+        lines.append(f"• {label}: {count}")
+    return "\n".join(lines)
+
+
+class DigestSender:
+    """
+    Периодически забирает из pending_digests дайджесты с наступившим сроком и рассылает их.
+
+    Дайджесты хранятся в базе, поэтому переживают перезапуск; строка удаляется только после
+    попытки отправки (в худшем случае после падения уведомление придёт повторно, но не потеряется).
+    Пачка на время отправки забирается с lease, поэтому отправителей может быть несколько.
+    """
+
+    def __init__(self, interval: float = 30, batch: int = 500, lease: float = 300):
+        self.interval = interval
+        self.batch = batch
+        self.lease = lease
+        self.bot: Optional[Bot] = None
+        self.storage: Optional[BaseStorage] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.skipped = 0
+        self.errors = 0
+
+    async def send_due(self) -> None:
+        while True:
+            due = await claim_due_digests(self.batch, self.lease)
+            if not due:
+                return
+            await refresh_subscription_index()  # Подписи подписок в дайджесте берутся из индекса
+            counts = await count_unseen_for_subscriptions([sub_id for sub_id, _ in due])
+            by_user: dict[str, dict[int, int]] = defaultdict(dict)
+            for sub_id, telegram_id in due:
+                if counts.get(sub_id):
+                    by_user[telegram_id][sub_id] = counts[sub_id]
+            self.skipped += len(due) - sum(len(subs) for subs in by_user.values())
+
+            with bulk_priority():
+                for telegram_id, user_counts in by_user.items():
+                    # notify_user берёт из state только хранилище, ключ строится по telegram_id
+                    state = FSMContext(storage=self.storage, key=StorageKey(
+                        bot_id=self.bot.id, chat_id=int(telegram_id), user_id=int(telegram_id)))
+                    try:
+                        # notify_user меняет FSM пользователя (rejection_notification_id) — только в его очереди
+                        async with user_scheduler.user_lock(int(telegram_id)):
+                            await notify_user(self.bot, telegram_id, format_digest(user_counts), state)
+                        self.sent += 1
+                    except Exception as e:
+                        self.errors += 1
+                        logger.error(f"Ошибка отправки дайджеста telegram_id={telegram_id}: {e}")
+            await delete_digests([sub_id for sub_id, _ in due])
+            logger.info(f"Дайджесты: обработано подписок {len(due)}, уведомлено пользователей {len(by_user)}")
+            if len(due) < self.batch:
+                return
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.send_due()
+            except Exception as e:
+                self.errors += 1
+                logger.exception(f"Ошибка обработки дайджестов: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, bot: Bot, storage: BaseStorage) -> None:
+        self.bot = bot
+        self.storage = storage
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Отправка дайджестов запущена (окно {DIGEST_WINDOW} с, проверка каждые {self.interval} с)")
+
+    async def stop(self) -> None:
+        """Останавливает цикл; неотправленные дайджесты остаются в базе до следующего запуска."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "skipped": self.skipped, "errors": self.errors}
+
+
+digest_sender = DigestSender(interval=getattr(config, "DIGEST_POLL_INTERVAL", 30))
@@ -0,0 +1,125 @@
+# tools/fanout.py
+# Фоновая рассылка по одобренным объявлениям: approve_ad только записывает событие, работу делает этот обработчик
+import asyncio
+from typing import Optional
+from loguru import logger
+from database import (AsyncSessionLocal, Advertisement, subscription_index, refresh_subscription_index, enqueue_digests,
+                      claim_fanout_events, complete_fanout_event, fail_fanout_event)
+from tools.digest import DIGEST_WINDOW
+import config
+
+
+class FanoutWorker:
+    """
+    Разбирает очередь fanout_events: подбирает подписки к одобренному объявлению и ставит им дайджесты.
+
+    Args:
+        concurrency: Сколько событий обрабатывается одновременно.
+        batch: Сколько событий забирается из очереди за раз.
+        max_attempts: После стольких неудачных попыток событие снимается с очереди (остаётся в таблице с ошибкой).
+        lease: На сколько секунд событие скрывается от других обработчиков на время обработки.
+        interval: Пауза опроса очереди, когда событий нет и никто не разбудил обработчик.
+    """
+
+    def __init__(self, concurrency: int = 4, batch: int = 50, max_attempts: int = 5,
+                 lease: float = 60, interval: float = 5):
+        self.concurrency = concurrency
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.restarts = 0
+
+    def notify(self) -> None:
+        """Будит обработчик сразу после записи нового события."""
+        self._wakeup.set()
+
+    async def _handle(self, ad_id: int) -> int:
+        async with AsyncSessionLocal() as session:
+            ad = await session.get(Advertisement, ad_id)
+        if not ad or ad.status != "approved":
+            logger.debug(f"Рассылка по объявлению #{ad_id} пропущена: объявление не одобрено")
+            return 0
+        subscriptions = subscription_index.match(ad.city, ad.category, ad.tags)
+        await enqueue_digests(subscriptions, DIGEST_WINDOW)
+        return len(subscriptions)
+
+    async def _process(self, semaphore: asyncio.Semaphore, event_id: int, ad_id: int, attempts: int) -> None:
+        async with semaphore:
+            try:
+                matched = await self._handle(ad_id)
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    self.failed += 1
+                    logger.error(f"Рассылка по объявлению #{ad_id} не удалась после {attempts} попыток: {e}")
+                    await fail_fanout_event(event_id, str(e), None)
+                else:
+                    self.retried += 1
+                    retry_in = min(2 ** attempts, 300)
+                    logger.warning(f"Рассылка по объявлению #{ad_id}, попытка {attempts}: {e}; повтор через {retry_in} с")
+                    await fail_fanout_event(event_id, str(e), retry_in)
+                return
+            await complete_fanout_event(event_id)
+            self.processed += 1
+            logger.info(f"Рассылка по объявлению #{ad_id}: подписок {matched}")
+
+    async def run_once(self) -> int:
+        """Обрабатывает одну пачку событий, возвращает их количество."""
+        events = await claim_fanout_events(self.batch, self.lease)
+        if events:
+            await refresh_subscription_index()  # Подписки могли появиться или удалиться в другом процессе
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._process(semaphore, *event) for event in events))
+            logger.debug(f"Обработано событий рассылки: {len(events)}, всего {self.processed}")
+        return len(events)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if await self.run_once() >= self.batch:
+                continue  # Очередь не пуста, забираем следующую пачку сразу
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _supervise(self) -> None:
+        """Перезапускает цикл обработки после непредвиденной ошибки, чтобы рассылка не остановилась молча."""
+        while True:
+            try:
+                await self._run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.restarts += 1
+                logger.exception(f"Обработчик рассылки упал, перезапуск через {self.interval} с: {e}")
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._supervise())
+            logger.info(f"Обработчик рассылки запущен (параллельно {self.concurrency}, пачка {self.batch})")
+
+    async def stop(self) -> None:
+        """Останавливает обработчик; необработанные события остаются в очереди."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "retried": self.retried, "failed": self.failed, "restarts": self.restarts}
+
+
+fanout_worker = FanoutWorker(
+    concurrency=getattr(config, "FANOUT_CONCURRENCY", 4),
+    max_attempts=getattr(config, "FANOUT_MAX_ATTEMPTS", 5)
+)
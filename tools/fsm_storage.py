@@ -0,0 +1,288 @@
+# tools/fsm_storage.py
+# Хранилище FSM в PostgreSQL: кэш в памяти процесса со сверкой версий, запись в конце апдейта и удаление давно неактивных ключей
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from copy import deepcopy
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from loguru import logger
+from database import load_fsm_state, load_fsm_version, save_fsm_states, delete_idle_fsm_states
+from tools.write_buffer import WriteBehindBuffer
+import config
+
+# Сколько раз подряд перечитывать строку, которую параллельно меняет другой процесс
+_SAVE_ATTEMPTS = 5
+
+# Ключи, уже сверенные с базой в текущем блоке user_scope(); None — вне блока, сверка при каждом чтении
+_checked: ContextVar[Optional[set[str]]] = ContextVar("fsm_checked", default=None)
+
+_MISSING = object()
+
+
+@dataclass
+class _Entry:
+    state: Optional[str] = None
+    data: dict[str, Any] = field(default_factory=dict)
+    version: int = 0  # Растёт при каждом изменении
+    saved_version: int = 0  # Версия, которая уже записана в базу
+    row_version: int = 0  # Версия строки в базе, от которой отсчитываются изменения; 0 — строки нет
+    base_state: Optional[str] = None  # Состояние и данные строки row_version
+    base_data: dict[str, Any] = field(default_factory=dict)
+    loaded: float = field(default_factory=time.monotonic)  # Когда запись последний раз сверялась с базой
+
+    @classmethod
+    def from_row(cls, row: Optional[tuple[Optional[str], dict, int]]) -> "_Entry":
+        if row is None:
+            return cls()
+        state, data, row_version = row
+        return cls(state=state, data=deepcopy(data), row_version=row_version, base_state=state, base_data=data)
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.saved_version
+
+    def rebase(self, row: Optional[tuple[Optional[str], dict, int]]) -> int:
+        """
+        Переносит несохранённые изменения на свежую строку из базы: по ключам data и состоянию.
+
+        Поле, которое успел изменить и другой процесс, остаётся как в базе: та запись уже сделана,
+        а порядок двух изменений здесь неизвестен, поэтому старое не должно затирать новое.
+
+        Returns:
+            Сколько своих изменений отброшено из-за такого столкновения.
+        """
+        fresh = _Entry.from_row(row)
+        data = fresh.data
+        dropped = 0
+        for name in self.base_data.keys() | self.data.keys():
+            ours, base = self.data.get(name, _MISSING), self.base_data.get(name, _MISSING)
+            theirs = fresh.base_data.get(name, _MISSING)
+            if ours == base or ours == theirs:
+                continue
+            if theirs != base:
+                dropped += 1
+            elif ours is _MISSING:
+                data.pop(name, None)
+            else:
+                data[name] = deepcopy(ours)
+        state = fresh.state
+        if self.state != self.base_state and self.state != fresh.state:
+            if fresh.state == self.base_state:
+                state = self.state
+            else:
+                dropped += 1
+        self.state, self.data = state, data
+        self.row_version, self.base_state, self.base_data = fresh.row_version, fresh.base_state, fresh.base_data
+        self.loaded = fresh.loaded
+        return dropped
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram поверх таблицы fsm_states.
+
+    Args:
+        cache_ttl: Сколько секунд неиспользуемая запись держится в памяти процесса; 0 — без кэша, чтение всегда из базы.
+        flush_interval: Период фоновой записи изменений в базу.
+        max_batch: Сколько ключей записывается одним запросом.
+        idle_ttl: Записи, не менявшиеся дольше стольких секунд, удаляются из базы (брошенные черновики).
+        key_builder: Как StorageKey превращается в строковый ключ таблицы.
+
+    Кэш свой у каждого процесса (воркеры вебхука, api.py), поэтому:
+    - перед использованием запись из кэша сверяется с базой по версии строки (запрос по первичному
+      ключу без данных); если версия другая, запись перечитывается. Внутри user_scope() — под
+      блокировкой пользователя, когда другие процессы строку не меняют — ключ сверяется один раз;
+    - изменения попадают в кэш сразу, а в базу — при выходе из user_scope(), то есть в конце апдейта
+      и до снятия блокировки пользователя, так что следующий апдейт в любом процессе их увидит.
+      Изменения вне user_scope() пишутся пачкой раз в flush_interval (после start()), а без start() —
+      сразу, так хранилище используется в api.py;
+    - строка пишется только поверх той версии, от которой отсчитаны изменения. Если её успел
+      изменить другой процесс, строка перечитывается, и поверх неё заново применяются изменённые
+      здесь ключи data и состояние — кроме тех, что изменил и он (см. _Entry.rebase).
+    Запись с несохранёнными изменениями из кэша не вытесняется и не перечитывается до записи.
+    """
+
+    def __init__(self, cache_ttl: float = 60, flush_interval: float = 0.5, max_batch: int = 500,
+                 idle_ttl: float = 30 * 24 * 3600, key_builder: Optional[KeyBuilder] = None):
+        self.cache_ttl = cache_ttl
+        self.idle_ttl = idle_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._entries: dict[str, _Entry] = {}
+        self._buffer = WriteBehindBuffer(self._flush, max_batch=max_batch, interval=flush_interval, name="fsm_storage")
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.checks = 0
+        self.evicted = 0
+        self.expired = 0
+        self.conflicts = 0
+        self.dropped = 0
+
+    async def _entry(self, key: StorageKey) -> tuple[str, _Entry]:
+        if not self.cache_ttl:
+            self._evict()  # Без кэша держим только ещё не сохранённые записи
+        db_key = self.key_builder.build(key)
+        checked = _checked.get()
+        entry = self._entries.get(db_key)
+        if entry is not None and not entry.dirty and (checked is None or db_key not in checked):
+            self.checks += 1
+            if await load_fsm_version(db_key) == entry.row_version:
+                entry.loaded = time.monotonic()
+            else:
+                entry = None  # Строку изменил другой процесс
+        if entry is None:
+            self.loads += 1
+            loaded = _Entry.from_row(await load_fsm_state(db_key))
+            # Пока шёл запрос, запись могла измениться в этом процессе — она новее прочитанной
+            current = self._entries.get(db_key)
+            if current is None or not current.dirty:
+                self._entries[db_key] = loaded
+            entry = self._entries[db_key]
+        if checked is not None:
+            checked.add(db_key)
+        return db_key, entry
+
+    async def _changed(self, db_key: str, entry: _Entry) -> None:
+        entry.version += 1
+        if self._buffer.running:
+            await self._buffer.add(db_key)
+            return
+        try:
+            await self._flush([db_key])  # Без start() пишем сразу, не выстраиваясь в очередь буфера
+        except Exception:
+            self._entries.pop(db_key, None)  # Несохранённое изменение не должно читаться как сохранённое
+            raise
+
+    async def _flush(self, keys: list[str]) -> None:
+        for _ in range(_SAVE_ATTEMPTS):
+            snapshot = []
+            for db_key in keys:
+                entry = self._entries.get(db_key)
+                if entry is not None:
+                    snapshot.append((db_key, entry, entry.version, entry.state, deepcopy(entry.data), entry.row_version))
+            saved = await save_fsm_states([
+                (db_key, state, data, row_version) for db_key, _, _, state, data, row_version in snapshot
+            ])
+            conflicts = []
+            for db_key, entry, version, state, data, _ in snapshot:
+                if db_key not in saved:
+                    conflicts.append(db_key)
+                    continue
+                entry.saved_version = max(entry.saved_version, version)
+                entry.row_version, entry.base_state, entry.base_data = saved[db_key], state, data
+                entry.loaded = time.monotonic()
+            if not conflicts:
+                return
+            # Строки изменил другой процесс: перечитываем и накладываем свои изменения поверх
+            self.conflicts += len(conflicts)
+            for db_key in conflicts:
+                row = await load_fsm_state(db_key)
+                entry = self._entries.get(db_key)
+                if entry is not None:
+                    dropped = entry.rebase(row)
+                    if dropped:
+                        self.dropped += dropped
+                        logger.warning(f"FSM: {db_key}: {dropped} изменений уступили параллельной записи другого процесса")
+            keys = conflicts
+        raise RuntimeError(f"FSM: {len(keys)} ключей не записаны за {_SAVE_ATTEMPTS} попыток из-за параллельных изменений")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._changed(db_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        db_key, entry = await self._entry(key)
+        entry.data = deepcopy(data)
+        await self._changed(db_key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, entry = await self._entry(key)
+        return deepcopy(entry.data)
+
+    def _evict(self) -> None:
+        """Убирает из кэша сохранённые записи, не использованные дольше cache_ttl."""
+        deadline = time.monotonic() - self.cache_ttl
+        stale = [db_key for db_key, entry in self._entries.items()
+                 if entry.loaded <= deadline and not entry.dirty]
+        for db_key in stale:
+            del self._entries[db_key]
+        self.evicted += len(stale)
+
+    async def _maintain(self) -> None:
+        last_cleanup = 0.0
+        while True:
+            await asyncio.sleep(min(self.cache_ttl, 60) or 60)
+            self._evict()
+            if time.monotonic() - last_cleanup >= 3600:
+                last_cleanup = time.monotonic()
+                try:
+                    expired = await delete_idle_fsm_states(self.idle_ttl)
+                    self.expired += expired
+                    if expired:
+                        logger.info(f"FSM: удалено неактивных записей {expired}")
+                except Exception as e:
+                    logger.error(f"FSM: ошибка удаления неактивных записей: {e}")
+
+    @asynccontextmanager
+    async def user_scope(self) -> AsyncIterator[None]:
+        """
+        Блок обработки апдейта под блокировкой пользователя (UserScheduler.user_lock).
+
+        Каждый ключ сверяется с базой один раз за блок, а изменения записываются при выходе из него.
+        """
+        token = _checked.set(set())
+        try:
+            yield
+        finally:
+            _checked.reset(token)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает в базу все накопленные изменения, не дожидаясь flush_interval."""
+        if self._buffer.running:
+            await self._buffer.flush()
+
+    def start(self) -> None:
+        """Включает отложенную запись и обслуживание кэша."""
+        self._buffer.start()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        """Дописывает несохранённые изменения в базу."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._buffer.stop()
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._entries),
+            "loads": self.loads,
+            "checks": self.checks,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "conflicts": self.conflicts,
+            "dropped": self.dropped,
+            **{f"write_{name}": value for name, value in self._buffer.stats().items()},
+        }
+
+
+# Хранилище FSM бота, подключается в main.py
+fsm_storage = PostgresStorage(
+    cache_ttl=getattr(config, "FSM_CACHE_TTL", 60),
+    flush_interval=getattr(config, "FSM_FLUSH_INTERVAL", 0.5),
+    idle_ttl=getattr(config, "FSM_IDLE_TTL", 30 * 24 * 3600)
+)
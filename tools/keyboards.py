@@ -0,0 +1,211 @@
+# tools/keyboards.py
+# Фабрика клавиатур: статичные меню строятся один раз при импорте, зависящие от данных — кэшируются по ключу
+from typing import Callable, Hashable, Iterable, Optional, Sequence
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from data.categories import CATEGORIES
+from database import catalog
+from tools.cache import TTLCache
+import config
+
+# Главные города, которые показываются кнопками до "Другой город"
+MAIN_CITIES = ["Тбилиси", "Батуми", "Кутаиси", "Гори"]
+
+
+def _rows(buttons: Sequence[InlineKeyboardButton], width: int) -> list[list[InlineKeyboardButton]]:
+    return [list(buttons[i:i + width]) for i in range(0, len(buttons), width)]
+
+
+def navigation_row() -> list[InlineKeyboardButton]:
+    """Строка "ℹ️" (Помощь) и "⬅️" (Назад) для добавления к своим кнопкам; каждый раз новый список."""
+    return list(_NAVIGATION_ROW)
+
+
+class KeyboardCache:
+    """
+    Готовые InlineKeyboardMarkup по ключу, чтобы не собирать pydantic-модели на каждый апдейт.
+
+    Args:
+        maxsize: Сколько клавиатур держать, при переполнении вытесняются давно не использованные.
+
+    Ключ должен включать всё, от чего зависит клавиатура: категорию, версию каталога
+    или сами данные (например, города с количеством объявлений). Клавиатуры из кэша
+    общие для всех апдейтов — их нельзя менять (inline_keyboard.append и т.п.), только собирать новые.
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def get(self, key: Hashable, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        markup = self._cache.get(key)
+        if markup is None:
+            markup = build()
+            self._cache.set(key, markup)
+        return markup
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+keyboard_cache = KeyboardCache(maxsize=getattr(config, "KEYBOARD_CACHE_SIZE", 1000))
+
+
+# Статичные клавиатуры: строятся один раз, отдаются одним и тем же объектом
+
+_NAVIGATION_ROW = (
+    InlineKeyboardButton(text="ℹ️", callback_data="action:help"),
+    InlineKeyboardButton(text="⬅️", callback_data="action:back"),
+)
+
+NAVIGATION_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[navigation_row()])
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=_rows(
+    [InlineKeyboardButton(text=CATEGORIES[cat]["display_name"], callback_data=f"category:{cat}") for cat in CATEGORIES]
+    + [InlineKeyboardButton(text="ℹ️", callback_data="action:help"),
+       InlineKeyboardButton(text="Настройки", callback_data="action:settings")],
+    3
+))
+
+_ADD_AD_BUTTON = InlineKeyboardButton(text="РАЗМЕСТИТЬ ОБЪЯВЛЕНИЕ", callback_data="action:add")
+
+# Категория без одобренных объявлений: разместить своё или вернуться
+EMPTY_CATEGORY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[_ADD_AD_BUTTON], navigation_row()])
+
+_BROWSE_PAGE_ROW = [
+    InlineKeyboardButton(text="Помощь", callback_data="action:help"),
+    InlineKeyboardButton(text="Добавить своё", callback_data="action:add"),
+    InlineKeyboardButton(text="Назад", callback_data="action:back"),
+]
+BROWSE_PAGE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[list(_BROWSE_PAGE_ROW)])
+BROWSE_PAGE_MORE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Показать ещё", callback_data="browse:more")],
+    list(_BROWSE_PAGE_ROW)
+])
+
+NO_SUBSCRIPTIONS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Добавить", callback_data="action:subscribe")],
+    navigation_row()
+])
+SUBSCRIPTIONS_FOOTER_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Добавить подписку (Пока🔒)", callback_data="disabled")],
+    navigation_row()
+])
+
+
+# Мастер добавления объявления
+
+def _step_buttons(category: str, step: str) -> list[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text="Помощь", callback_data=f"help:{category}:{step}"),
+            InlineKeyboardButton(text="Назад", callback_data="back")]
+
+
+def wizard_step_keyboard(category: str, step: str, extra: Optional[tuple[str, str]] = None) -> InlineKeyboardMarkup:
+    """
+    "Помощь" и "Назад" шага мастера, при необходимости с кнопкой действия над ними.
+
+    Args:
+        category: Категория объявления.
+        step: Шаг мастера для help:{category}:{step}.
+        extra: (текст, callback_data) кнопки над строкой навигации, например ("Без цены", "skip_price").
+    """
+    def build() -> InlineKeyboardMarkup:
+        rows = [[InlineKeyboardButton(text=extra[0], callback_data=extra[1])]] if extra else []
+        return InlineKeyboardMarkup(inline_keyboard=rows + [_step_buttons(category, step)])
+    return keyboard_cache.get(("wizard_step", category, step, extra), build)
+
+
+def wizard_city_keyboard(category: str) -> InlineKeyboardMarkup:
+    """Главные города, "Другой город" и навигация шага выбора города."""
+    def build() -> InlineKeyboardMarkup:
+        cities = [InlineKeyboardButton(text=city, callback_data=f"city:{category}:{city}") for city in MAIN_CITIES]
+        return InlineKeyboardMarkup(inline_keyboard=_rows(cities, 2) + [
+            [InlineKeyboardButton(text="Другой город", callback_data=f"city_other:{category}")] + _step_buttons(category, "city")
+        ])
+    return keyboard_cache.get(("wizard_city", category), build)
+
+
+def wizard_other_cities_keyboard(category: str) -> InlineKeyboardMarkup:
+    def build() -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(inline_keyboard=_rows([
+            InlineKeyboardButton(text=city, callback_data=f"city:{category}:{city}")
+            for city in catalog.cities() if city not in MAIN_CITIES
+        ], 3))
+    return keyboard_cache.get(("wizard_other_cities", category, catalog.version), build)
+
+
+def wizard_tags_keyboard(category: str, with_next: bool = False) -> InlineKeyboardMarkup:
+    """Все теги категории по три в ряд, кнопка "Далее" (если выбран обязательный тег) и навигация."""
+    def build() -> InlineKeyboardMarkup:
+        rows = _rows([InlineKeyboardButton(text=name, callback_data=f"tag_select:{id}")
+                      for id, name in catalog.category_tags(category)], 3)
+        if with_next:
+            rows.append([InlineKeyboardButton(text="Далее", callback_data="next_to_title")])
+        return InlineKeyboardMarkup(inline_keyboard=rows + [_step_buttons(category, "tags")])
+    return keyboard_cache.get(("wizard_tags", category, with_next, catalog.version), build)
+
+
+# Подписки
+
+def subscribe_cities_keyboard() -> InlineKeyboardMarkup:
+    def build() -> InlineKeyboardMarkup:
+        cities = catalog.cities()
+        rows = _rows([InlineKeyboardButton(text=city, callback_data=f"subscribe_city:{city}")
+                      for city in MAIN_CITIES if city in cities], 2)
+        return InlineKeyboardMarkup(inline_keyboard=rows + [[
+            InlineKeyboardButton(text="Другие города", callback_data="subscribe_city_other"),
+            InlineKeyboardButton(text="❓", callback_data="help:subscribe_city"),
+            InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
+        ]])
+    return keyboard_cache.get(("subscribe_cities", catalog.version), build)
+
+
+def subscribe_other_cities_keyboard() -> InlineKeyboardMarkup:
+    def build() -> InlineKeyboardMarkup:
+        rows = _rows([InlineKeyboardButton(text=city, callback_data=f"subscribe_city:{city}")
+                      for city in catalog.cities() if city not in MAIN_CITIES], 3)
+        return InlineKeyboardMarkup(inline_keyboard=rows + [[
+            InlineKeyboardButton(text="❓", callback_data="help:subscribe_city"),
+            InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
+        ]])
+    return keyboard_cache.get(("subscribe_other_cities", catalog.version), build)
+
+
+def subscribe_tags_keyboard(category: str, with_save: bool = False) -> InlineKeyboardMarkup:
+    def build() -> InlineKeyboardMarkup:
+        rows = _rows([InlineKeyboardButton(text=name, callback_data=f"subscribe_tag:{id}")
+                      for id, name in catalog.category_tags(category)], 3)
+        if with_save:
+            rows.append([InlineKeyboardButton(text="💾 Сохранить", callback_data="subscribe_confirm")])
+        return InlineKeyboardMarkup(inline_keyboard=rows + [[
+            InlineKeyboardButton(text="❓", callback_data="help:subscribe_tags"),
+            InlineKeyboardButton(text="⬅️", callback_data="action:subscriptions")
+        ]])
+    return keyboard_cache.get(("subscribe_tags", category, with_save, catalog.version), build)
+
+
+# Просмотр объявлений: ключом служат сами данные, они меняются вместе со счётчиками
+
+def browse_cities_keyboard(category: str, cities: dict[str, int]) -> InlineKeyboardMarkup:
+    """Города категории с числом объявлений, кнопка размещения и навигация."""
+    def build() -> InlineKeyboardMarkup:
+        rows = _rows([InlineKeyboardButton(text=f"{city} ({count})", callback_data=f"city_select:{category}:{city}")
+                      for city, count in cities.items()], 3)
+        return InlineKeyboardMarkup(inline_keyboard=rows + [[_ADD_AD_BUTTON], navigation_row()])
+    return keyboard_cache.get(("browse_cities", category, tuple(cities.items())), build)
+
+
+def browse_tags_keyboard(tags_list: Iterable[tuple[int, str, int]], only_new: bool = False) -> InlineKeyboardMarkup:
+    """Фильтр по тегам с количеством объявлений на кнопках."""
+    tags_key = tuple((id, name, count) for id, name, count in tags_list)
+
+    def build() -> InlineKeyboardMarkup:
+        rows = _rows([InlineKeyboardButton(text=f"{name} ({count})", callback_data=f"tag:{id}")
+                      for id, name, count in tags_key], 3)
+        return InlineKeyboardMarkup(inline_keyboard=rows + [
+            [InlineKeyboardButton(text="Только новые" if not only_new else "Все объявления", callback_data="only_new"),
+             InlineKeyboardButton(text="Найти", callback_data="skip")],
+            navigation_row()
+        ])
+    return keyboard_cache.get(("browse_tags", tags_key, only_new), build)
@@ -0,0 +1,67 @@
+# tools/media_group.py
+# Сборщик альбомов: части медиа-группы копятся в памяти и отдаются одним списком после паузы
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+from loguru import logger
+import config
+
+
+class _Group:
+    __slots__ = ("items", "on_complete", "timer")
+
+    def __init__(self, on_complete: Callable[[list], Awaitable[None]]):
+        self.items: list = []
+        self.on_complete = on_complete
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MediaGroupCollector:
+    """
+    Копит части альбома по media_group_id и вызывает on_complete один раз на весь альбом.
+
+    Args:
+        delay: Сколько секунд ждать следующую часть; таймер перезапускается с каждой частью.
+
+    Telegram присылает части альбома отдельными сообщениями почти одновременно, поэтому
+    хэндлер только добавляет часть (без обращений к FSM), а состояние пишется один раз при сборе.
+    Используется колбэк первой части альбома.
+    """
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self._groups: dict[str, _Group] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.parts = 0
+        self.albums = 0
+        self.errors = 0
+
+    def add(self, media_group_id: str, item: Any, on_complete: Callable[[list], Awaitable[None]]) -> None:
+        group = self._groups.get(media_group_id)
+        if group is None:
+            group = self._groups[media_group_id] = _Group(on_complete)
+        group.items.append(item)
+        self.parts += 1
+        if group.timer:
+            group.timer.cancel()
+        group.timer = asyncio.get_running_loop().call_later(self.delay, self._complete, media_group_id)
+
+    def _complete(self, media_group_id: str) -> None:
+        group = self._groups.pop(media_group_id)
+        task = asyncio.create_task(self._run(media_group_id, group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, media_group_id: str, group: _Group) -> None:
+        try:
+            await group.on_complete(group.items)
+            self.albums += 1
+            logger.debug(f"Альбом {media_group_id} собран: частей {len(group.items)}")
+        except Exception as e:
+            self.errors += 1
+            logger.exception(f"Ошибка обработки альбома {media_group_id}: {e}")
+
+    def stats(self) -> dict:
+        return {"pending": len(self._groups), "parts": self.parts, "albums": self.albums, "errors": self.errors}
+
+
+media_group_collector = MediaGroupCollector(delay=getattr(config, "MEDIA_GROUP_DELAY", 1.0))
@@ -1,23 +1,13 @@
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-from loguru import logger
-import asyncio
-import aiohttp
+from database import get_user_identity
+
+# Сетевые ошибки запросов к Telegram повторяет tools.retry.RetryMiddleware на уровне bot.session
+
+class UserMiddleware(BaseMiddleware):
+    """Определяет пользователя БД один раз на апдейт и передаёт его в хэндлеры как db_user."""
 
-class NetworkErrorMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: TelegramObject, data: dict):
-        try:
-            return await handler(event, data)
-        except aiohttp.ClientOSError as e:
-            logger.exception(
-                f"Network error caught: {str(e)}\n"
-                f"Event: {event.__class__.__name__}\n"
-                f"Bot ID: {data['bot'].id}\n"
-                f"Update ID: {event.update_id if hasattr(event, 'update_id') else 'N/A'}"
-            )
-            # Продолжаем выполнение, чтобы не прерывать polling
-            await asyncio.sleep(1)  # Ждем 1 секунду перед повторной попыткой
-            return None
-        except Exception as e:
-            logger.exception(f"Unexpected error: {str(e)}")
-            raise  # Пробрасываем другие ошибки дальше
\ No newline at end of file
+        from_user = data.get("event_from_user")
+        data["db_user"] = await get_user_identity(str(from_user.id)) if from_user else None
+        return await handler(event, data)
@@ -0,0 +1,182 @@
+# tools/rate_limiter.py
+# Ограничитель исходящих запросов к Telegram: глобальный и по чатам token bucket, приоритеты
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, SendMediaGroup, CopyMessage, CopyMessages, ForwardMessage, ForwardMessages
+from aiogram.methods.base import Response, TelegramType
+from loguru import logger
+import config
+
+# Приоритеты отправки: меньше — раньше
+INTERACTIVE = 0  # Ответы на действия пользователя
+BULK = 1  # Рассылки и уведомления подписчикам
+
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    """Все отправки внутри блока идут в очередь рассылок и пропускают вперёд ответы пользователям."""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float = 1, now: Optional[float] = None) -> float:
+        """Через сколько секунд можно будет взять amount токенов (0 — можно сейчас)."""
+        now = now or time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        missing = min(amount, self.capacity) - self.tokens
+        if missing > 0:
+            wait = max(wait, missing / self.rate)
+        return wait
+
+    def take(self, amount: float = 1) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Request-middleware для bot.session, пропускающий отправку сообщений с учётом лимитов Telegram.
+
+    Args:
+        global_rate: Сообщений в секунду на весь бот.
+        chat_rate: Сообщений в секунду в один чат при длительной отправке.
+        chat_burst: Сколько сообщений в чат можно отправить подряд без ожидания.
+
+    Ответы пользователям (INTERACTIVE) получают токены раньше рассылок (BULK), приоритет задаётся
+    через bulk_priority(). Результат запроса возвращается вызывающему как обычно, поэтому
+    message_id по-прежнему доступны в render_ad и других местах.
+
+    После TelegramRetryAfter чат блокируется на указанное время, а сама ошибка уходит наружу —
+    повторяет запрос tools.retry.RetryMiddleware, и повтор снова встаёт в очередь этого чата.
+    """
+
+    LIMITED_METHODS = (SendMediaGroup, CopyMessage, CopyMessages, ForwardMessage, ForwardMessages)
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 20):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chats: dict[str, TokenBucket] = {}
+        self._waiters: list[tuple[int, int, int | str, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retry_after = 0
+        self.waited_total = 0.0
+
+    def _is_limited(self, method: TelegramMethod) -> bool:
+        return type(method).__name__.startswith("Send") or isinstance(method, self.LIMITED_METHODS)
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        chat_id = str(chat_id)  # В коде встречаются и int, и str telegram_id
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:  # Полные вёдра ничего не ограничивают, их можно забыть
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if b.delay(b.capacity, now) > 0}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id: int | str, cost: float) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((send_priority.get(), next(self._seq), chat_id, cost, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        """Выдаёт токены ожидающим по приоритету и порядку поступления."""
+        while self._waiters:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_wait = None
+            for waiter in sorted(self._waiters):
+                priority, _, chat_id, cost, future = waiter
+                if future.done():  # Отправитель отменил ожидание
+                    self._waiters.remove(waiter)
+                    continue
+                chat_bucket = self._chat_bucket(chat_id)
+                global_wait = self.global_bucket.delay(cost, now)
+                chat_wait = chat_bucket.delay(1, now)
+                if global_wait == 0 and chat_wait == 0:
+                    self.global_bucket.take(cost)
+                    chat_bucket.take(1)
+                    self._waiters.remove(waiter)
+                    future.set_result(None)
+                    continue
+                wait = max(global_wait, chat_wait)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                if chat_wait == 0:
+                    break  # Ждём только глобальный токен — более низкий приоритет не пропускаем вперёд
+            if self._waiters:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=next_wait or 0.05)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not self._is_limited(method):
+            return await make_request(bot, method)
+        cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        started = time.monotonic()
+        await self._acquire(chat_id, cost)
+        self.waited_total += time.monotonic() - started
+        try:
+            response = await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.retry_after += 1
+            self._chat_bucket(chat_id).block(e.retry_after)
+            logger.debug(f"RetryAfter {e.retry_after} с для chat_id={chat_id}, чат заблокирован")
+            raise
+        self.sent += 1
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "queued": len(self._waiters),
+            "chats": len(self._chats),
+            "wait_avg_ms": round(self.waited_total / self.sent * 1000, 2) if self.sent else 0.0,
+        }
+
+
+# Общий ограничитель бота, подключается в main.py через bot.session.middleware()
+outbound_limiter = OutboundLimiter(
+    global_rate=getattr(config, "TG_GLOBAL_RATE", 30),
+    chat_rate=getattr(config, "TG_CHAT_RATE", 1),
+    chat_burst=getattr(config, "TG_CHAT_BURST", 20)
+)
@@ -0,0 +1,112 @@
+# tools/retry.py
+# Повтор запросов к Telegram: классификация ошибок, экспоненциальная пауза со случайным разбросом и общий дедлайн
+import random
+from collections import Counter
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (TelegramRetryAfter, TelegramNetworkError, TelegramServerError,
+                                TelegramForbiddenError)
+from aiogram.methods import TelegramMethod, GetUpdates
+from aiogram.methods.base import Response, TelegramType
+from loguru import logger
+from tenacity import (AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, stop_before_delay,
+                      wait_random_exponential)
+import config
+
+
+def classify_error(error: BaseException) -> str | None:
+    """Вид ошибки для повтора и метрик; None — ошибку повторять бессмысленно."""
+    if isinstance(error, TelegramRetryAfter):
+        return "retry_after"
+    if isinstance(error, TelegramNetworkError):
+        return "network"
+    if isinstance(error, TelegramServerError):
+        return "server"
+    return None
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    """
+    Request-middleware для bot.session, повторяющий запросы при временных ошибках Telegram.
+
+    Args:
+        max_attempts: Сколько всего попыток делается на один запрос.
+        deadline: Сколько секунд от первой попытки можно потратить на повторы; новая попытка,
+            которая началась бы позже, не делается, и наружу уходит последняя ошибка.
+        backoff: Начальная пауза для сетевых ошибок и 5xx, дальше растёт вдвое (со случайным разбросом).
+        max_backoff: Верхняя граница такой паузы.
+
+    RetryAfter ждёт ровно столько, сколько просит Telegram; сетевые ошибки и 5xx — экспоненциальную
+    паузу; Forbidden (бот заблокирован) и прочие ошибки запроса не повторяются. Подключается раньше
+    outbound_limiter, поэтому каждая повторная отправка снова проходит через лимиты.
+    getUpdates не трогаем: у polling свой цикл повторов.
+    """
+
+    def __init__(self, max_attempts: int = 4, deadline: float = 30, backoff: float = 0.5, max_backoff: float = 10):
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self._backoff = wait_random_exponential(multiplier=backoff, max=max_backoff)
+        self.retries: Counter[str] = Counter()
+        self.recovered = 0
+        self.gave_up = 0
+        self.forbidden = 0
+
+    def _wait(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception()
+        if isinstance(error, TelegramRetryAfter):
+            return error.retry_after + random.uniform(0, 0.5)
+        return self._backoff(retry_state)
+
+    def _before_sleep(self, retry_state: RetryCallState) -> None:
+        error = retry_state.outcome.exception()
+        kind = classify_error(error)
+        self.retries[kind] += 1
+        logger.warning(f"{type(error.method).__name__}: {kind} ({error}), попытка {retry_state.attempt_number}, "
+                       f"повтор через {retry_state.upcoming_sleep:.1f} с")
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        retrying = AsyncRetrying(
+            retry=retry_if_exception(lambda e: classify_error(e) is not None),
+            stop=stop_after_attempt(self.max_attempts) | stop_before_delay(self.deadline),
+            wait=self._wait,
+            before_sleep=self._before_sleep,
+            reraise=True
+        )
+        try:
+            # make_request — partial от следующего middleware, tenacity не распознаёт его как корутину,
+            # поэтому ждём запрос сами внутри попытки
+            async for attempt in retrying:
+                with attempt:
+                    response = await make_request(bot, method)
+        except TelegramForbiddenError:
+            self.forbidden += 1
+            raise
+        except Exception as e:
+            if classify_error(e) is not None:
+                self.gave_up += 1
+                logger.error(f"{type(method).__name__}: {e}, повторы исчерпаны "
+                             f"за {retrying.statistics.get('attempt_number', 1)} попыток")
+            raise
+        if retrying.statistics.get("attempt_number", 1) > 1:
+            self.recovered += 1
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "retries": dict(self.retries),
+            "recovered": self.recovered,
+            "gave_up": self.gave_up,
+            "forbidden": self.forbidden,
+        }
+
+
+# Общий слой повторов, подключается в main.py и api.py через bot.session.middleware()
+telegram_retry = RetryMiddleware(
+    max_attempts=getattr(config, "TG_RETRY_ATTEMPTS", 4),
+    deadline=getattr(config, "TG_RETRY_DEADLINE", 30),
+    backoff=getattr(config, "TG_RETRY_BACKOFF", 0.5),
+    max_backoff=getattr(config, "TG_RETRY_MAX_BACKOFF", 10)
+)
@@ -0,0 +1,162 @@
+# tools/scheduler.py
+# Планировщик апдейтов: апдейты одного пользователя обрабатываются по очереди, разных — параллельно
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from loguru import logger
+from database import try_lock_user, extend_user_lock, unlock_user
+from tools.fsm_storage import PostgresStorage, fsm_storage
+import config
+
+# Очередь пользователя общая для всех процессов (аренда в user_locks): нужна, когда апдейты одного
+# пользователя попадают в разные процессы — воркеры вебхука за балансировщиком, api.py
+SHARED_USER_LOCK = getattr(config, "UPDATE_SHARED_LOCK", getattr(config, "BOT_MODE", "polling") == "webhook")
+# На сколько секунд берётся аренда; продлевается, пока апдейт обрабатывается, и истекает, если процесс упал
+USER_LOCK_LEASE = getattr(config, "UPDATE_LOCK_LEASE", 60)
+
+
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0  # Выполняющийся апдейт плюс ожидающие
+
+
+class UserScheduler(BaseMiddleware):
+    """
+    Outer-middleware для dp.update: у каждого пользователя своя очередь, общий предел параллельности.
+
+    Args:
+        max_concurrency: Сколько апдейтов всех пользователей обрабатывается одновременно.
+        max_user_queue: Сколько апдейтов одного пользователя может ждать в очереди; лишние отбрасываются.
+        storage: FSM-хранилище, чьи изменения записываются в базу до снятия очереди (PostgresStorage.user_scope).
+
+    Диспетчер уже запускает каждый апдейт отдельной задачей (polling с handle_as_tasks, вебхук в фоне),
+    здесь задача сначала встаёт в очередь своего пользователя (asyncio.Lock обслуживает ожидающих по порядку),
+    затем занимает слот общего семафора. Поэтому апдейты одного пользователя не перемешиваются
+    и не теряют записи FSM, а медленный пользователь держит только свою очередь и один слот.
+    Фоновая работа с FSM пользователя вне хэндлера должна брать ту же очередь через user_lock().
+
+    asyncio.Lock работает только внутри процесса. При SHARED_USER_LOCK очередь дополнительно берётся
+    арендой строки в user_locks, так что апдейты одного пользователя идут по очереди и тогда, когда
+    балансировщик раздаёт их разным воркерам вебхука.
+    """
+
+    def __init__(self, max_concurrency: int = 100, max_user_queue: int = 20, storage: Optional[PostgresStorage] = None):
+        self.max_concurrency = max_concurrency
+        self.max_user_queue = max_user_queue
+        self.storage = storage
+        self.owner = uuid.uuid4().hex  # Этот планировщик (процесс) в user_locks.owner
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues: dict[int, _UserQueue] = {}
+        self.running = 0
+        self.waiting = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.shared_waits = 0
+        self.lost_leases = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @asynccontextmanager
+    async def user_lock(self, user_id: int) -> AsyncIterator[None]:
+        """Ждёт своей очереди у пользователя user_id и держит её до выхода из блока и записи изменений FSM."""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = _UserQueue()
+        queue.depth += 1
+        self.max_depth = max(self.max_depth, queue.depth)
+        try:
+            async with queue.lock:
+                async with self._user_lease(user_id) if SHARED_USER_LOCK else nullcontext():
+                    async with self.storage.user_scope() if self.storage else nullcontext():
+                        yield
+        finally:
+            queue.depth -= 1
+            if not queue.depth:
+                del self._queues[user_id]
+
+    @asynccontextmanager
+    async def _user_lease(self, user_id: int) -> AsyncIterator[None]:
+        """Ждёт, пока другой процесс отпустит очередь пользователя (или его аренда истечёт), и держит её."""
+        delay = 0.02
+        while not await try_lock_user(user_id, self.owner, USER_LOCK_LEASE):
+            self.shared_waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        renew = asyncio.create_task(self._renew_lease(user_id))
+        try:
+            yield
+        finally:
+            renew.cancel()
+            try:
+                await unlock_user(user_id, self.owner)
+            except Exception as e:
+                logger.error(f"Не удалось снять аренду очереди telegram_id={user_id}, истечёт сама: {e}")
+
+    async def _renew_lease(self, user_id: int) -> None:
+        while True:
+            await asyncio.sleep(USER_LOCK_LEASE / 3)
+            try:
+                if not await extend_user_lock(user_id, self.owner, USER_LOCK_LEASE):
+                    self.lost_leases += 1
+                    logger.warning(f"Аренда очереди telegram_id={user_id} истекла и перешла к другому процессу")
+                    return
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды очереди telegram_id={user_id}: {e}")
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        from_user = data.get("event_from_user")
+        queue = self._queues.get(from_user.id) if from_user else None
+        if queue and queue.depth > self.max_user_queue:
+            self.dropped += 1
+            logger.warning(f"Очередь апдейтов telegram_id={from_user.id} переполнена ({queue.depth}), апдейт отброшен")
+            return None
+        started = time.monotonic()
+        self.waiting += 1
+        started_running = False
+        try:
+            async with self.user_lock(from_user.id) if from_user else nullcontext():
+                async with self._semaphore:
+                    waited = time.monotonic() - started
+                    self.waiting -= 1
+                    started_running = True
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                    self.running += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+        finally:
+            if not started_running:  # Задачу отменили, пока она ждала очереди
+                self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "users": len(self._queues),
+            "max_depth": self.max_depth,
+            "shared_waits": self.shared_waits,
+            "lost_leases": self.lost_leases,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "wait_avg_ms": round(self.wait_total / self.processed * 1000, 2) if self.processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+# Общий планировщик, подключается в main.py первым outer-middleware на dp.update
+user_scheduler = UserScheduler(
+    max_concurrency=getattr(config, "UPDATE_CONCURRENCY", 100),
+    max_user_queue=getattr(config, "UPDATE_MAX_USER_QUEUE", 20),
+    storage=fsm_storage
+)
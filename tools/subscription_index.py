@@ -0,0 +1,72 @@
+# tools/subscription_index.py
+# Индекс подписок в памяти: (город, категория, тег) -> подписки, для рассылки при одобрении объявления
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+
+class SubscriptionEntry(NamedTuple):
+    id: int
+    user_id: int
+    telegram_id: str
+    city: str
+    category: str
+    tags: tuple[str, ...]
+
+
+class SubscriptionIndex:
+    """
+    Подписки, разложенные по ключам (city, category, tag).
+
+    Поиск совпадений для объявления стоит O(тегов объявления + совпадений) и не ходит в базу.
+    Индекс строится при старте бота и обновляется при сохранении и удалении подписок в этом процессе;
+    изменения из других процессов подхватываются перестройкой по mark (см. refresh_subscription_index).
+    """
+
+    def __init__(self):
+        self._subs: dict[int, SubscriptionEntry] = {}
+        self._by_key: dict[tuple[str, str, str], set[int]] = defaultdict(set)
+        self.mark: tuple | None = None  # Отпечаток таблицы subscriptions, по которому индекс построен
+        self.rebuilds = 0
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def rebuild(self, entries: Iterable[SubscriptionEntry], mark: tuple | None = None) -> None:
+        self._subs.clear()
+        self._by_key.clear()
+        for entry in entries:
+            self.add(entry)
+        self.mark = mark
+        self.rebuilds += 1
+
+    def add(self, entry: SubscriptionEntry) -> None:
+        self.remove(entry.id)
+        entry = entry._replace(tags=tuple(entry.tags))
+        self._subs[entry.id] = entry
+        for tag in entry.tags:
+            self._by_key[(entry.city, entry.category, tag)].add(entry.id)
+
+    def remove(self, subscription_id: int) -> None:
+        entry = self._subs.pop(subscription_id, None)
+        if not entry:
+            return
+        for tag in entry.tags:
+            key = (entry.city, entry.category, tag)
+            ids = self._by_key.get(key)
+            if ids is not None:
+                ids.discard(subscription_id)
+                if not ids:
+                    del self._by_key[key]
+
+    def get(self, subscription_id: int) -> SubscriptionEntry | None:
+        return self._subs.get(subscription_id)
+
+    def match(self, city: str, category: str, tags: Iterable[str]) -> list[SubscriptionEntry]:
+        """Подписки города и категории, у которых есть хотя бы один общий тег с объявлением."""
+        ids = set()
+        for tag in tags or ():
+            ids |= self._by_key.get((city, category, tag), set())
+        return [self._subs[sub_id] for sub_id in sorted(ids)]
+
+    def stats(self) -> dict:
+        return {"subscriptions": len(self._subs), "keys": len(self._by_key), "rebuilds": self.rebuilds}
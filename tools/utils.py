@@ -3,20 +3,17 @@ from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
 from database import Advertisement
 from loguru import logger
-from database import mark_ad_as_viewed
+from database import mark_ad_as_viewed, ad_card_cache
 from data.categories import CATEGORIES
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
+from tools.keyboards import NAVIGATION_KEYBOARD
 
 
-# Создает навигационную клавиатуру с кнопками "ℹ️" (Помощь) и "⬅️" (Назад)
+# Навигационная клавиатура с кнопками "ℹ️" (Помощь) и "⬅️" (Назад); один общий объект, не изменять
 def get_navigation_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton(text="ℹ️", callback_data="action:help"),
-         InlineKeyboardButton(text="⬅️", callback_data="action:back")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return NAVIGATION_KEYBOARD
 
 
 def format_ad_text(ad: Advertisement, fields: Optional[List[str]] = None, complete: bool = True,
@@ -74,10 +71,101 @@ def format_ad_text(ad: Advertisement, fields: Optional[List[str]] = None, comple
     return lines
 
 
+# Максимальная длина подписи к медиа в Telegram
+CAPTION_LIMIT = 1024
+
+
+# Готовое к отправке представление объявления; списки медиа не изменяются после сборки
+class AdCard(NamedTuple):
+    text: str  # Текст для полного режима
+    caption: str  # Текст для компактного режима с номером объявления
+    fits: bool  # Влезает ли caption в подпись к медиа
+    photos: tuple[InputMediaPhoto, ...]
+    videos: tuple[InputMediaVideo, ...]
+    album: tuple[InputMediaPhoto | InputMediaVideo, ...]  # Фото и видео вместе, с подписью, если влезает
+
+
+def _build_ad_card(ad: Advertisement, show_status: bool) -> AdCard:
+    text = format_ad_text(ad, complete=True, show_status=show_status)
+    caption = f"<b>Объявление #{ad.id}</b>\n" + text
+    fits = len(caption) <= CAPTION_LIMIT
+    media = ad.media_file_ids or []
+    album = []
+    for i, item in enumerate(media[:10]):
+        media_type = InputMediaVideo if item["type"] == "video" else InputMediaPhoto
+        if i == 0 and fits:
+            album.append(media_type(media=item["id"], caption=caption, parse_mode="HTML"))
+        else:
+            album.append(media_type(media=item["id"]))
+    return AdCard(
+        text=text,
+        caption=caption,
+        fits=fits,
+        photos=tuple(InputMediaPhoto(media=m["id"]) for m in media if m["type"] == "photo")[:10],
+        videos=tuple(InputMediaVideo(media=m["id"]) for m in media if m["type"] == "video")[:10],
+        album=tuple(album)
+    )
+
+
+def get_ad_card(ad: Advertisement, show_status: bool = False) -> AdCard:
+    """Возвращает карточку объявления из кэша, собирая её при промахе; несохранённые объявления не кэшируются."""
+    if ad.id is None:
+        return _build_ad_card(ad, show_status)
+    variants = ad_card_cache.get(ad.id)
+    if variants is None:
+        variants = {}
+        ad_card_cache.set(ad.id, variants)
+    variant = (ad.status, show_status)  # Статус служит версией карточки
+    card = variants.get(variant)
+    if card is None:
+        card = variants[variant] = _build_ad_card(ad, show_status)
+    return card
+
+
+# Компактный показ: одно сообщение с медиа и подписью или один альбом, текст отдельно только если не влез
+async def _render_ad_compact(ad: Advertisement, bot: Bot, chat_id: int, show_status: bool,
+                             keyboard: Optional[InlineKeyboardMarkup]) -> list[int]:
+    card = get_ad_card(ad, show_status)
+
+    if not card.album:
+        msg = await bot.send_message(chat_id=chat_id, text=card.caption, reply_markup=keyboard, parse_mode="HTML")
+        return [msg.message_id]
+
+    if len(card.album) == 1:  # Альбом из одного элемента Telegram не принимает
+        item = card.album[0]
+        send = bot.send_video if isinstance(item, InputMediaVideo) else bot.send_photo
+        msg = await send(chat_id, item.media, caption=card.caption if card.fits else None,
+                         reply_markup=keyboard if card.fits else None, parse_mode="HTML")
+        message_ids = [msg.message_id]
+        keyboard = None if card.fits else keyboard  # Уже отправлена вместе с подписью
+    else:
+        album = await bot.send_media_group(chat_id=chat_id, media=list(card.album))
+        message_ids = [msg.message_id for msg in album]
+        logger.debug(f"Отправлен альбом объявления #{ad.id}, message_ids={message_ids}, подпись: {card.fits}")
+
+    # Клавиатуру к альбому прикрепить нельзя, поэтому она едет коротким сообщением
+    if not card.fits or keyboard:
+        text = card.caption if not card.fits else f"Объявление #{ad.id}"
+        msg = await bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard, parse_mode="HTML")
+        message_ids.append(msg.message_id)
+    return message_ids
+
+
 # Отображает объявление, рендерит все фото и видео группами, возвращает список message_id
+# compact=True — сокращённый показ для просмотра (1–2 сообщения вместо 3–4); модерация редактирует
+# текстовое сообщение объявления, поэтому там используется полный режим
 async def render_ad(ad: Advertisement, bot: Bot, chat_id: int, show_status: bool = False,
-                    buttons: list[InlineKeyboardButton] = None, mark_viewed: bool = False):
+                    buttons: list[InlineKeyboardButton] = None, mark_viewed: bool = False,
+                    compact: bool = False):
+    if compact:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+        message_ids = await _render_ad_compact(ad, bot, chat_id, show_status, keyboard)
+        if mark_viewed and ad.id:
+            await mark_ad_as_viewed(str(chat_id), ad.id)
+        return message_ids
+
     message_ids = []
+    card = get_ad_card(ad, show_status)
 
     # Отправляем заголовок со звёздочками
     msg1 = await bot.send_message(chat_id=chat_id, text=f"*****       Объявление #{ad.id}       *****")
@@ -85,25 +173,20 @@ async def render_ad(ad: Advertisement, bot: Bot, chat_id: int, show_status: bool
 
     # Обработка медиа
     if ad.media_file_ids:
-        photos = [media for media in ad.media_file_ids if media["type"] == "photo"]
-        videos = [media for media in ad.media_file_ids if media["type"] == "video"]
-
-        if photos:
-            media_group = [InputMediaPhoto(media=photo["id"]) for photo in photos[:10]]
-            photo_msgs = await bot.send_media_group(chat_id=chat_id, media=media_group)
+        if card.photos:
+            photo_msgs = await bot.send_media_group(chat_id=chat_id, media=list(card.photos))
             message_ids.extend(msg.message_id for msg in photo_msgs)
             logger.debug(
                 f"Отправлена группа фото для объявления #{ad.id}, message_ids={[msg.message_id for msg in photo_msgs]}")
 
-        if videos:
-            media_group = [InputMediaVideo(media=video["id"]) for video in videos[:10]]
-            video_msgs = await bot.send_media_group(chat_id=chat_id, media=media_group)
+        if card.videos:
+            video_msgs = await bot.send_media_group(chat_id=chat_id, media=list(card.videos))
             message_ids.extend(msg.message_id for msg in video_msgs)
             logger.debug(
                 f"Отправлена группа видео для объявления #{ad.id}, message_ids={[msg.message_id for msg in video_msgs]}")
 
-    # Формируем основной текст
-    ad_text = format_ad_text(ad, complete=True, show_status=show_status)
+    # Основной текст берём из карточки
+    ad_text = card.text
 
     # Создаём клавиатуру, если переданы кнопки
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
@@ -120,22 +203,38 @@ async def render_ad(ad: Advertisement, bot: Bot, chat_id: int, show_status: bool
     return message_ids
 
 
+# Предел deleteMessages в Bot API
+DELETE_BATCH_SIZE = 100
+
+
 # Утилита для удаления списка сообщений с обработкой ошибок
 async def delete_messages(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
     """
     Удаляет сообщения по их ID в указанном чате.
 
+    Сообщения удаляются пачками до 100 штук через deleteMessages (уже удалённые Telegram пропускает).
+    Если пачка не удалилась целиком, её сообщения удаляются по одному.
+
     Args:
         bot: Объект бота для выполнения операций.
         chat_id: ID чата, где нужно удалить сообщения.
         message_ids: Список ID сообщений для удаления.
     """
-    for msg_id in message_ids:
+    message_ids = list(dict.fromkeys(message_ids))  # Без повторов, порядок сохраняется
+    for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        chunk = message_ids[i:i + DELETE_BATCH_SIZE]
         try:
-            await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-            logger.debug(f"Удалено сообщение {msg_id} в чате {chat_id}")
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+            logger.debug(f"Удалены сообщения {chunk} в чате {chat_id}")
+            continue
         except Exception as e:
-            logger.error(f"Ошибка удаления сообщения {msg_id} в чате {chat_id}: {e}")
+            logger.warning(f"Пакетное удаление {chunk} в чате {chat_id} не удалось, удаляем по одному: {e}")
+        for msg_id in chunk:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+                logger.debug(f"Удалено сообщение {msg_id} в чате {chat_id}")
+            except Exception as e:
+                logger.error(f"Ошибка удаления сообщения {msg_id} в чате {chat_id}: {e}")
 
 
 async def notify_user(bot: Bot, telegram_id: str, text: str, state: FSMContext, reply_markup=None) -> None:
@@ -0,0 +1,108 @@
+# tools/webhook.py
+# Приём апдейтов через вебхук: aiohttp-сервер, проверка секрета, обработка апдейтов в фоне
+import asyncio
+import signal
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+from tools.fsm_storage import PostgresStorage
+from tools.scheduler import SHARED_USER_LOCK
+import config
+
+WEBHOOK_BASE_URL = getattr(config, "WEBHOOK_BASE_URL", None)  # Публичный адрес балансировщика, например https://bot.example.com
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_SET = getattr(config, "WEBHOOK_SET", True)  # Регистрировать ли вебхук в Telegram при старте этого процесса
+WEBHOOK_SHUTDOWN_TIMEOUT = getattr(config, "WEBHOOK_SHUTDOWN_TIMEOUT", 30)
+
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """
+    Отвечает Telegram сразу и обрабатывает апдейт отдельной задачей.
+
+    При остановке дожидается уже принятых апдейтов (не дольше shutdown_timeout) и не закрывает
+    сессию бота: её закрывает main.py после остановки фоновых задач.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, shutdown_timeout: float = 30):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token)
+        self.shutdown_timeout = shutdown_timeout
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f"Ожидание обработки принятых апдейтов: {len(tasks)}")
+        _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+        if pending:
+            logger.warning(f"Не дождались обработки апдейтов: {len(pending)}, отменяем")
+            for task in pending:
+                task.cancel()
+
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка живости для балансировщика."""
+    return web.Response(text="ok")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Поднимает aiohttp-сервер с вебхуком и работает до SIGINT/SIGTERM.
+
+    Несколько процессов можно запустить за балансировщиком с одинаковыми настройками;
+    регистрировать вебхук в Telegram достаточно одному из них (WEBHOOK_SET).
+
+    Telegram шлёт все апдейты на один адрес, и балансировщику не по чему направлять апдейты
+    одного пользователя в один и тот же процесс. Поэтому несколько процессов безопасны только
+    с общей очередью пользователя (UPDATE_SHARED_LOCK, по умолчанию включена в режиме webhook)
+    и FSM-хранилищем, которое сверяет кэш с базой и пишет изменения до снятия очереди
+    (PostgresStorage). Без UPDATE_SHARED_LOCK запускайте один процесс: иначе два апдейта одного
+    пользователя обрабатываются одновременно в разных процессах и затирают записи FSM друг друга.
+    """
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_SECRET в config.py")
+    if WEBHOOK_SET and not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для регистрации вебхука нужен WEBHOOK_BASE_URL в config.py")
+    if not isinstance(dp.storage, PostgresStorage):
+        raise RuntimeError("Для режима webhook нужно общее для процессов FSM-хранилище PostgresStorage")
+    if not SHARED_USER_LOCK:
+        logger.warning(
+            "UPDATE_SHARED_LOCK выключен: запускайте только один процесс вебхука, "
+            "иначе апдейты одного пользователя будут обрабатываться параллельно в разных процессах"
+        )
+
+    app = web.Application()
+    handler = BackgroundRequestHandler(dp, bot, WEBHOOK_SECRET, WEBHOOK_SHUTDOWN_TIMEOUT)
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        if WEBHOOK_SET:
+            await bot.set_webhook(
+                url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True
+            )
+            logger.info(f"Вебхук зарегистрирован: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+        await stop.wait()
+        logger.info("Остановка вебхука...")
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        # Сначала перестаём принимать запросы, затем ждём принятые апдейты (BackgroundRequestHandler.close)
+        await runner.cleanup()
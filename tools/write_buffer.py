@@ -0,0 +1,113 @@
+# tools/write_buffer.py
+# Буфер отложенной записи: копит элементы в памяти и сбрасывает их пачками по размеру или по таймеру
+import asyncio
+from typing import Awaitable, Callable, Hashable, Iterable, Optional
+from loguru import logger
+
+
+class WriteBehindBuffer:
+    """
+    Копит уникальные элементы и передаёт их пачкой в flush_func.
+
+    Args:
+        flush_func: Корутина, которая записывает пачку элементов (например, одним INSERT).
+        max_batch: Размер пачки, при достижении которого сброс запускается сразу.
+        interval: Период фонового сброса в секундах.
+        max_pending: Предел элементов в памяти, если запись в базу недоступна; лишнее отбрасывается.
+        name: Имя буфера для логов.
+
+    Пока фоновая задача не запущена через start(), add() записывает элементы сразу,
+    поэтому буфер безопасно использовать и в скриптах без цикла сброса.
+    """
+
+    def __init__(self, flush_func: Callable[[list], Awaitable[None]], max_batch: int = 500,
+                 interval: float = 2.0, max_pending: int = 50000, name: str = "buffer"):
+        self.flush_func = flush_func
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_pending = max_pending
+        self.name = name
+        self._pending: dict[Hashable, None] = {}  # dict сохраняет порядок и убирает дубли
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def add(self, item: Hashable) -> None:
+        self._pending[item] = None
+        if not self.running:
+            await self.flush()
+        elif len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def extend(self, items: Iterable[Hashable]) -> None:
+        for item in items:
+            self._pending[item] = None
+
+    async def flush(self) -> None:
+        """Записывает всё накопленное; при ошибке элементы возвращаются в буфер."""
+        async with self._lock:
+            while self._pending:
+                batch = list(self._pending)[:self.max_batch]
+                for item in batch:
+                    del self._pending[item]
+                try:
+                    await self.flush_func(batch)
+                except asyncio.CancelledError:
+                    self.extend(batch)  # Пачка допишется при stop()
+                    raise
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"{self.name}: ошибка записи пачки из {len(batch)} элементов: {e}")
+                    self.extend(batch)
+                    overflow = len(self._pending) - self.max_pending
+                    if overflow > 0:
+                        for item in list(self._pending)[:overflow]:
+                            del self._pending[item]
+                        self.dropped += overflow
+                        logger.warning(f"{self.name}: отброшено {overflow} элементов из-за переполнения")
+                    return
+                self.flushes += 1
+                self.flushed += len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"{self.name}: фоновый сброс запущен (пачка {self.max_batch}, период {self.interval} с)")
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и дописывает остаток."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info(f"{self.name}: остановлен, записано всего {self.flushed}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }